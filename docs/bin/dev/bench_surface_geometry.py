@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the vectorized geometry of tvb.recon.model.surface.Surface against the previous per triangle loops.
+
+Usage: python bench_surface_geometry.py [surface_path]
+(defaults to $SUBJECTS_DIR/$SUBJECT/surf/lh.pial, a full resolution FreeSurfer surface)
+
+"""
+
+import os
+import sys
+import time
+import numpy
+from tvb.recon.io.factory import IOUtils
+
+
+def loop_vertex_normals(vertices, triangles):
+    vf = vertices[triangles]
+    fn = numpy.cross(vf[:, 1] - vf[:, 0], vf[:, 2] - vf[:, 0])
+    vf = [set() for _ in range(len(vertices))]
+    for i, fi in enumerate(triangles):
+        for j in fi:
+            vf[j].add(i)
+    vn = numpy.zeros_like(vertices)
+    for i, fi in enumerate(vf):
+        norm = fn[list(fi)].sum(axis=0)
+        norm /= numpy.sqrt((norm ** 2).sum())
+        vn[i] = norm
+    return vn
+
+
+def loop_triangle_angles(vertices, triangles):
+    angles = numpy.zeros((triangles.shape[0], 3))
+    for tt in range(triangles.shape[0]):
+        triangle = triangles[tt, :]
+        for ta in range(3):
+            ang = numpy.roll(triangle, -ta)
+            angles[tt, ta] = numpy.arccos(numpy.dot(
+                (vertices[ang[1], :] - vertices[ang[0], :]) /
+                numpy.sqrt(numpy.sum((vertices[ang[1], :] - vertices[ang[0], :]) ** 2, axis=0)),
+                (vertices[ang[2], :] - vertices[ang[0], :]) /
+                numpy.sqrt(numpy.sum((vertices[ang[2], :] - vertices[ang[0], :]) ** 2, axis=0))))
+    return angles
+
+
+def loop_vertex_areas(vertices, triangles, triangle_areas):
+    vertex_areas = numpy.zeros((vertices.shape[0]))
+    for triang, verts in enumerate(triangles):
+        for i in range(3):
+            vertex_areas[verts[i]] += 1. / 3. * triangle_areas[triang]
+    return vertex_areas
+
+
+def loop_vertex_triangles(n_vertices, triangles):
+    vertex_triangles = [[] for _ in range(n_vertices)]
+    for k in range(triangles.shape[0]):
+        for i in range(3):
+            vertex_triangles[triangles[k, i]].append(k)
+    return vertex_triangles
+
+
+def timed(label, func, *args):
+    tic = time.time()
+    result = func(*args)
+    print("%-40s %8.3f s" % (label, time.time() - tic))
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        surf_path = sys.argv[1]
+    else:
+        surf_path = os.path.join(os.environ["SUBJECTS_DIR"], os.environ["SUBJECT"], "surf", "lh.pial")
+    surface = IOUtils.read_surface(surf_path, False)
+    print("%d vertices, %d triangles" % (surface.n_vertices, surface.n_triangles))
+
+    geometry = timed("vectorized Surface.get_geometry", surface.get_geometry)
+
+    vn = timed("loop vertex normals", loop_vertex_normals, surface.vertices, surface.triangles)
+    angles = timed("loop triangle angles", loop_triangle_angles, surface.vertices, surface.triangles)
+    vertex_areas = timed("loop vertex areas", loop_vertex_areas, surface.vertices, surface.triangles,
+                         geometry["triangle_areas"][:, 0])
+    vertex_triangles = timed("loop vertex triangles", loop_vertex_triangles, surface.n_vertices, surface.triangles)
+
+    assert numpy.allclose(vn, geometry["vertex_normals"], equal_nan=True)
+    assert numpy.allclose(angles, geometry["triangle_angles"], equal_nan=True)
+    assert numpy.allclose(vertex_areas, geometry["vertex_areas"])
+    assert vertex_triangles == geometry["vertex_triangles"]
+    print("All results match.")
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the vectorized tvb.recon.model.volume.Volume.slice_volume against the previous per pixel loop.
+
+Usage: python bench_volume_slicing.py [volume_path]
+(defaults to a synthetic 256^3 T1-like volume with a 1 mm, LIA oriented, FreeSurfer conformed affine)
+
+"""
+
+import sys
+import time
+import numpy
+from nibabel.affines import apply_affine
+from tvb.recon.io.factory import IOUtils
+from tvb.recon.model.constants import PROJECTIONS, X_Y_INDEX
+from tvb.recon.model.volume import Volume
+
+
+def loop_slice_volume(volume, projection, ras):
+    affine_inverse = numpy.linalg.inv(volume.affine_matrix)
+    ijk_ras = numpy.round(apply_affine(affine_inverse, ras)).astype('i')
+
+    slice_index_1, slice_index_2 = X_Y_INDEX[projection]
+
+    slice_data = numpy.zeros(
+        (volume.dimensions[slice_index_1], volume.dimensions[slice_index_2]))
+    x_axis_coords = numpy.zeros_like(slice_data)
+    y_axis_coords = numpy.zeros_like(slice_data)
+
+    for i in range(volume.dimensions[slice_index_1]):
+        for j in range(volume.dimensions[slice_index_2]):
+            ijk_ras[slice_index_1] = i
+            ijk_ras[slice_index_2] = j
+
+            ras_coordinates = apply_affine(volume.affine_matrix, ijk_ras)
+            x_axis_coords[i, j] = ras_coordinates[slice_index_1]
+            y_axis_coords[i, j] = ras_coordinates[slice_index_2]
+
+            color = volume.data[ijk_ras[0], ijk_ras[1], ijk_ras[2]]
+            if isinstance(color, (list, numpy.ndarray)):
+                color = color[0]
+            slice_data[i][j] = color
+
+    return x_axis_coords, y_axis_coords, slice_data
+
+
+def synthetic_t1(n=256):
+    affine = numpy.array([[-1.0, 0.0, 0.0, n / 2],
+                          [0.0, 0.0, 1.0, -n / 2],
+                          [0.0, -1.0, 0.0, n / 2],
+                          [0.0, 0.0, 0.0, 1.0]])
+    data = numpy.random.RandomState(42).randint(0, 255, (n, n, n)).astype(numpy.uint8)
+    return Volume(data, affine, None)
+
+
+def timed(label, func, *args):
+    tic = time.time()
+    result = func(*args)
+    print("%-40s %8.3f s" % (label, time.time() - tic))
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        volume = IOUtils.read_volume(sys.argv[1])
+    else:
+        volume = synthetic_t1()
+    print("volume of shape %s" % (volume.dimensions,))
+    ras = volume.get_center_point()
+
+    for projection in PROJECTIONS:
+        vectorized = timed("vectorized %s slice" % projection, volume.slice_volume, projection, ras)
+        loop = timed("loop %s slice" % projection, loop_slice_volume, volume, projection, ras)
+        for vectorized_array, loop_array in zip(vectorized, loop):
+            assert vectorized_array.dtype == loop_array.dtype
+            assert numpy.array_equal(vectorized_array, loop_array)
+    print("All results are identical.")
@@ -12,7 +12,6 @@ requirements = (
     'scipy',
     'scikit-learn',
     'matplotlib',
-    'trimesh',
     'anytree',
     'Pegasus',
     'h5py',
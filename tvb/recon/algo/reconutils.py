@@ -1,7 +1,7 @@
 import os
 import sys
 import warnings
-from tvb.recon.algo.service.surface import SurfaceService
+from tvb.recon.algo.service.surface import SurfaceService, GDIST_CHUNK_SIZE
 from tvb.recon.algo.service.volume import VolumeService
 from tvb.recon.algo.service.subparcellation import SubparcellationService
 from tvb.recon.algo.service.sensor import SensorService
@@ -37,8 +37,8 @@ def convert_fs_to_brain_visa(fs_surf, bv_surf=None):
     surfaceService.convert_fs_to_brain_visa(fs_surf, bv_surf)
 
 
-def compute_gdist_mat(surf_name='pial', max_distance=40.0):
-    surfaceService.compute_gdist_mat(surf_name, max_distance)
+def compute_gdist_mat(surf_name='pial', max_distance=40.0, n_processes=None, chunk_size=GDIST_CHUNK_SIZE):
+    surfaceService.compute_gdist_mat(surf_name, max_distance, n_processes, chunk_size)
 
 
 def aseg_surf_conc_annot(surf_path, out_surf_path, annot_path, labels,
@@ -74,9 +74,9 @@ def mask_to_vol(in_vol_path, mask_vol_path, out_vol_path=None, labels=None, ctx=
                               labels, ctx, vol2mask_path, vn, th, labels_mask, labels_nomask)
 
 
-def label_with_dilation(to_label_nii_fname, dilated_nii_fname, out_nii_fname):
+def label_with_dilation(to_label_nii_fname, dilated_nii_fname, out_nii_fname, min_size=0):
     volumeService.label_with_dilation(
-        to_label_nii_fname, dilated_nii_fname, out_nii_fname)
+        to_label_nii_fname, dilated_nii_fname, out_nii_fname, min_size)
 
 
 def label_vol_from_tdi(tdi_nii_fname, out_fname, lo=0.5):
@@ -84,9 +84,9 @@ def label_vol_from_tdi(tdi_nii_fname, out_fname, lo=0.5):
 
 
 def remove_zero_connectivity_nodes(
-        node_vol_path, con_mat_path, tract_length_path=None):
+        node_vol_path, con_mat_path, tract_length_path=None, binary_only=False, sparse=False):
     volumeService.remove_zero_connectivity_nodes(
-        node_vol_path, con_mat_path, tract_length_path)
+        node_vol_path, con_mat_path, tract_length_path, binary_only, sparse)
 
 
 def simple_label_config(aparc_fname, out_fname):
@@ -121,7 +121,8 @@ def connectivity_geodesic_subparc(self, surf_path, annot_path, con_verts_idx, ou
                                   cras_path=None, ref_vol_path=None, consim_path=None,
                                   in_lut_path=os.path.join(
                                       os.environ['FREESURFER_HOME'], DEFAULT_LUT),
-                                  out_lut_path=os.path.join(os.environ['FREESURFER_HOME'], DEFAULT_LUT)):
+                                  out_lut_path=os.path.join(os.environ['FREESURFER_HOME'], DEFAULT_LUT),
+                                  cache_dir=None):
     subparcelatioService.connectivity_geodesic_subparc(surf_path, annot_path, con_verts_idx,
                                                        out_annot_path=out_annot_path, labels=labels, ctx=ctx,
                                                        add_string=add_string,
@@ -131,7 +132,8 @@ def connectivity_geodesic_subparc(self, surf_path, annot_path, con_verts_idx, ou
                                                        clustering_mode=clustering_mode,
                                                        cras_path=cras_path, ref_vol_path=ref_vol_path,
                                                        consim_path=consim_path,
-                                                       in_lut_path=in_lut_path, out_lut_path=out_lut_path)
+                                                       in_lut_path=in_lut_path, out_lut_path=out_lut_path,
+                                                       cache_dir=cache_dir)
 
 
 def node_connectivity_metric(
@@ -8,7 +8,7 @@ import scipy.ndimage
 def seeg_pos():
     # dilated image for labeling
     d4 = nibabel.load('elec_bin_d4.nii')
-    img = d4.get_data()
+    img = numpy.asanyarray(d4.dataobj)
     aff = d4.get_affine()
 
     lab_img, n = scipy.ndimage.label(img)
@@ -16,7 +16,7 @@ def seeg_pos():
     nibabel.save(lab, 'd4_lab.nii')
 
     # binarized without dilation
-    bin_dat = nibabel.load('elec_bin.nii').get_data()
+    bin_dat = numpy.asanyarray(nibabel.load('elec_bin.nii').dataobj)
 
     # label the simple binarization
     lab_bin = lab_img * bin_dat
@@ -17,6 +17,7 @@ from tvb.recon.io.generic import GenericIO
 matplotlib.use(os.environ.get('MPLBACKEND', 'Agg'))
 import pylab
 from tvb.recon.model.surface import Surface
+from scipy.sparse import csr_matrix
 from tvb.recon.algo.service.volume import VolumeService
 
 SIGMA = 1.0
@@ -211,8 +212,8 @@ class SensorService(object):
             if transform_mat is not None:
                 assert src_img is not None and dest_img is not None
                 volume_service = VolumeService()
-                target = volume_service.transform_coords(target, src_img, dest_img, transform_mat)
-                entry = volume_service.transform_coords(entry, src_img, dest_img, transform_mat)
+                target, entry = volume_service.transform_coords(numpy.array([target, entry]), src_img, dest_img,
+                                                                transform_mat)[0]
             contacts = self.gen_contacts_on_electrode(name, target, entry, ncontacts, spacing_pattern)
             for contact_name, pos in contacts:
                 outfile.write("%-6s %7.2f %7.2f %7.2f\n" % (contact_name, pos[0], pos[1], pos[2]))
@@ -260,11 +261,11 @@ class SensorService(object):
         return gain_mtx_vert
 
     def _get_verts_regions_matrix(self, nvertices: int, nregions: int, region_mapping: list) \
-            -> numpy.ndarray:
-        reg_map_mtx = numpy.zeros((nvertices, nregions), dtype=int)
-        for i, region in enumerate(region_mapping):
-            if region >= 0:
-                reg_map_mtx[i, region] = 1
+            -> csr_matrix:
+        region_mapping = numpy.asarray(region_mapping)
+        verts, = numpy.nonzero(region_mapping >= 0)
+        reg_map_mtx = csr_matrix((numpy.ones(verts.size, dtype=int), (verts, region_mapping[verts])),
+                                 shape=(nvertices, nregions))
 
         return reg_map_mtx
 
@@ -277,13 +278,13 @@ class SensorService(object):
 
         cort_vertices = genericIO.read_field_from_zip("vertices.txt", cort_file)
         cort_triangles = genericIO.read_field_from_zip("triangles.txt", cort_file, dtype="i")
-        cort_surf = Surface(cort_vertices, cort_triangles)
+        cort_surf = Surface(cort_vertices, cort_triangles, compact=True)
         cort_normals = cort_surf.vertex_normals()
         cort_areas = cort_surf.get_vertex_areas()
 
         subcort_vertices = genericIO.read_field_from_zip("vertices.txt", subcort_file)
         subcort_triangles = genericIO.read_field_from_zip("triangles.txt", subcort_file, dtype="i")
-        subcort_surf = Surface(subcort_vertices, subcort_triangles)
+        subcort_surf = Surface(subcort_vertices, subcort_triangles, compact=True)
         subcort_areas = subcort_surf.get_vertex_areas()
 
         cort_rm = list(numpy.genfromtxt(cort_rm, usecols=[0], dtype='i'))
@@ -299,9 +300,10 @@ class SensorService(object):
 
         gain_matrix_subcort = self._gain_matrix_inv_square(subcort_surf.vertices, subcort_areas, sensors)
 
-        gain_total = numpy.concatenate((gain_matrix, gain_matrix_subcort), axis=1)
-
-        gain_out = gain_total @ verts_regions_mat
+        # reduce each block to regions separately, instead of concatenating them into one more full matrix
+        nr_cort_vertices = cort_surf.vertices.shape[0]
+        gain_out = gain_matrix @ verts_regions_mat[:nr_cort_vertices] + \
+                   gain_matrix_subcort @ verts_regions_mat[nr_cort_vertices:]
         numpy.savetxt(out_gain_mat, gain_out)
 
         return gain_out
@@ -3,13 +3,15 @@
 import os
 import numpy
 import scipy
-from scipy.spatial.distance import pdist, cdist, squareform
+from scipy.spatial.distance import pdist, squareform
 from sklearn.cluster import AgglomerativeClustering
 from ...io.factory import IOUtils
 from ...algo.service.annotation import AnnotationService, DEFAULT_LUT
 from ...algo.service.surface import SurfaceService
 from ...algo.service.volume import VolumeService
 from ...model.annotation import Annotation
+from ...model.spatial_index import SpatialIndex
+from ...model.component_tracker import ComponentTracker
 
 
 # TODO should be parameters to relevant methods
@@ -29,11 +31,7 @@ class SubparcellationService(object):
         # TODO subcort subparc with geodesic on bounding gmwmi
         # TODO normalize fiber counts by relevant gmwmi area
 
-        vertex_face_mapping = [set([]) for _ in surface.vertices]
-        for i, face in enumerate(surface.triangles):
-            for j in face:
-                vertex_face_mapping[j].add(i)
-        vertex_face_mapping = numpy.array(vertex_face_mapping)
+        vertex_face_incidence = surface.get_vertex_triangle_incidence()
 
         # Make new annotation
         new_annotation = Annotation([], [], [])
@@ -51,18 +49,14 @@ class SubparcellationService(object):
                 continue
 
             # indices of faces in ROI
-            rfi = set([])
-            for face_set in vertex_face_mapping[mask]:
-                rfi.update(face_set)
-            rfi = numpy.array(list(rfi))
+            rfi, = numpy.nonzero(vertex_face_incidence.T.dot(mask))
 
             # empty roi
             if rfi.size == 0:
                 continue
 
             # compute area of faces in roi
-            roi_area = numpy.sum(self.surface_service.tri_area(
-                surface.vertices[surface.triangles[rfi]]))
+            roi_area = numpy.sum(surface.get_triangle_areas()[rfi])
 
             # choose k for desired roi area
             k = int(roi_area / trg_area) + 1
@@ -136,6 +130,12 @@ class SubparcellationService(object):
         clusters = -numpy.ones((n_points,)).astype('i')
         # Cluster areas'list
         clusters_size = [0.0, 0.0]
+        # If the surface is in the input and structural constraints are present,
+        # track incrementally the connected components of each cluster:
+        if (surface is not None) and (connectivity is not None):
+            clusters_components = [ComponentTracker(connectivity), ComponentTracker(connectivity)]
+        else:
+            clusters_components = None
         # Deterministic initialization: find two points that maximize their mutual distance,
         # and are, optionally, well connected:
         #...Find the maximum distance...
@@ -158,6 +158,9 @@ class SubparcellationService(object):
             #...and assign it as first points to each cluster:
             clusters[c1[con_max_id]] = 0
             clusters[c2[con_max_id]] = 1
+        if clusters_components is not None:
+            clusters_components[0].add(clusters == 0)
+            clusters_components[1].add(clusters == 1)
         # While there are remaining points:
         n_remaining = n_points - 2
         while n_remaining > 0:
@@ -191,45 +194,39 @@ class SubparcellationService(object):
                 # If the distance is positive (for the smallest cluster) or
                 # negative (for the bigger cluster)...
                 if curr_dist * sign >= 0.0:
-                    #...get the points that are equal to that distance...
-                    curr_points, = numpy.where(mean_dist == curr_dist)
+                    #...get the (indices of the remaining) points that are equal to that distance...
+                    curr_points = numpy.where(points_left)[0][mean_dist == curr_dist]
                     # ...and assign them to the current cluster...
                     clusters[curr_points] = ic
                     # ...signaling that at least one point has been assigned...
                     cluster_done = True
                     n_assigned[ic] += len(curr_points)
                     #...if the surface is in the input and structural constraints are present...
-                    if (surface is not None) and (connectivity is not None):
+                    if clusters_components is not None:
                         # Find how many connnected components are now in this
                         # cluster:
-                        (n_components, components, comp_areas) = \
-                            self.surface_service.connected_surface_components(surface=surface,
-                                                                              connectivity=connectivity,
-                                                                              verts_mask=clusters == ic)
+                        cluster_components = clusters_components[ic]
+                        cluster_components.add(curr_points)
 
                         # If there are more than one components,
-                        if n_components > 1:
+                        if cluster_components.n_components > 1:
                             # we need to remove all but the main and larger component:
-                            #...find the component labels,
-                            comp_labels = numpy.unique(components)
-                            #...except for the masked ones (-1), i.e., those that do not belong to this cluster
-                            comp_labels = comp_labels[
-                                comp_labels > -1].tolist()
+                            #...find the component labels (-1 for the points that do not belong to this cluster),
+                            components = cluster_components.get_labels()
+                            comp_areas = self.surface_service.compute_areas_for_components(
+                                surface, components, cluster_components.n_components)
                             #...find the main and larger component:
                             comp_max = numpy.argmax(comp_areas)
-                            #...and remove it from the list of components to remove
-                            comp_labels.remove(comp_max)
                             #...find the points of the components to remove
-                            remove_points = numpy.where(
-                                numpy.in1d(components, comp_labels))
+                            remove_points, = numpy.where(numpy.logical_and(components > -1, components != comp_max))
                             #...remove them from this cluster...
                             clusters[remove_points] = -1
+                            cluster_components.remove(remove_points)
                             #...reduce accordingly the assignment counter
                             n_assigned[ic] -= len(remove_points)
                             #...if we removed exactly the points we have just added and no changes
                             # has been made to the cluster
-                            if numpy.all(numpy.sort(curr_points) ==
-                                         numpy.sort(remove_points)):
+                            if numpy.array_equal(numpy.sort(curr_points), remove_points):
                                 #...signal so...
                                 cluster_done = False
                 else:
@@ -264,7 +261,7 @@ class SubparcellationService(object):
             # TODO: through an exception if this happens without the respective connectivity constraints,
             # i.e., wihtout having points that are closer to one cluster, but
             # not connected to it.
-            if numpy.all(n_assigned == 0):
+            if numpy.all(numpy.array(n_assigned) == 0):
                 if connectivity is None:
                     print("ERROR: 0 assignement although there are no "
                           "connectivity constraints")
@@ -274,16 +271,20 @@ class SubparcellationService(object):
                     # Calculate the sum of connectivity of each of the cluster
                     # points to each one of the remaining points,
                     remaining_points, = numpy.where(clusters == -1)
-                    sum_connectivity = numpy.sum(connectivity[clusters == ic, :][
-                                                 :, remaining_points], axis=0)
+                    if remaining_points.size == 0:
+                        break
+                    sum_connectivity = numpy.asarray(numpy.sum(connectivity[clusters == ic, :][
+                                                            :, remaining_points], axis=0)).ravel()
                     #...and assign the maximally connected point to the cluster, if it is connected (>0)
                     max_connectivity = numpy.argmax(sum_connectivity)
                     if sum_connectivity[max_connectivity] > 0:
                         clusters[remaining_points[max_connectivity]] = ic
+                        if clusters_components is not None:
+                            clusters_components[ic].add([remaining_points[max_connectivity]])
                         n_assigned[ic] = 1
             # If there is still no assignment, meaning that these points are
             # fully disconnected, through an error:
-            if numpy.all(n_assigned == 0):
+            if numpy.all(numpy.array(n_assigned) == 0):
                 print("ERROR: fully disconnected points")
                 return clusters
             # Update the stopping criterion
@@ -382,11 +383,16 @@ class SubparcellationService(object):
                 curr_clusters = self.agglomerative_clustering(curr_affinity, n_clusters=curr_n_clusters,
                                                               connectivity=curr_connectivity)
             elif clustering_mode == 'divisive':
+                curr_n_clusters = 2
                 print(("     Iteration " + str(iter) + "...aiming at "
                        "clustering a white tract area of "
                        + str(curr_area) + " mm2 in 2 clusters..."))
+                # (the sub-surface is a view, sharing the vertices of the surface)
+                curr_surface = self.surface_service.extract_subsurf(surface, curr_verts_mask, output='view')
                 curr_clusters = self.divisive_clustering(curr_affinity, connectivity=curr_connectivity,
-                                                         surface=self.surface_service.extract_subsurf(surface, curr_verts_mask))
+                                                         surface=curr_surface)
+            # count the connected components of all resulting clusters at once...
+            curr_n_components = self.surface_service.count_components_of_labels(curr_connectivity, curr_clusters)
             # and loop through the respective labels...
             for i_cluster in range(curr_n_clusters):
                 # ...compute a boolean mask of the vertices of each label:
@@ -400,10 +406,7 @@ class SubparcellationService(object):
                 # allowed:
                 if subcluster_lbl_area > min_parc_area and subcluster_lbl_area < max_parc_area:
                     #...make sure that the parcel is fully connected:
-                    n_components = \
-                        self.surface_service.connected_surface_components(connectivity=connectivity,
-                                                                          verts_mask=subcluster_mask)[0]
-                    assert n_components == 1
+                    assert curr_n_components[i_cluster] == 1
                     clusters[subcluster_mask] = n_out_clusters
                     clusters_labels.append(n_out_clusters)
                     # clusters_areas.append(subcluster_lbl_area)
@@ -460,12 +463,11 @@ class SubparcellationService(object):
         clusters_areas = []
         print(" ...Finally, checking that all clusters are fully connected "
               "and calculating final white tract areas...")
+        n_components = self.surface_service.count_components_of_labels(connectivity, clusters)
+        comp_area = self.surface_service.compute_areas_for_components(surface, clusters.astype('i'), n_out_clusters)
         for i_cluster in clusters_labels:
-            (n_components, _, comp_area) = \
-                self.surface_service.connected_surface_components(surface=surface, connectivity=connectivity,
-                                                                  verts_mask=clusters == i_cluster)
-            assert n_components == 1
-            clusters_areas.append(comp_area[0])
+            assert n_components[i_cluster] == 1
+            clusters_areas.append(comp_area[i_cluster])
         # The following code is not used anymore:
         # You can also do
         # children=model.children_
@@ -492,7 +494,8 @@ class SubparcellationService(object):
                                       cras_path=None, ref_vol_path=None, consim_path=None,
                                       in_lut_path=os.path.join(
                                           os.environ['FREESURFER_HOME'], DEFAULT_LUT),
-                                      out_lut_path=os.path.join(os.environ['FREESURFER_HOME'], DEFAULT_LUT)):
+                                      out_lut_path=os.path.join(os.environ['FREESURFER_HOME'], DEFAULT_LUT),
+                                      cache_dir=None):
         """
         This is the main function performing the sub-parcellation.
         :param surf_path: The path to the surface to be parcellated, in ras or freesurfer ras (tk-ras) coordinates
@@ -519,6 +522,8 @@ class SubparcellationService(object):
                             Necessary only if the connectivity dissimilarity affinity is used.
         :param in_lut_path: The path to an input freesurfer-like Color LUT file ot use for reading target label names
         :param out_lut_path: The path to a freesurfer-like Color LUT file, to be written/appended for the new annotation
+        :param cache_dir: An optional directory of the run's outputs or temporary files, to cache the connectome
+                          nodes-voxels of ref_vol_path to, for the runs of other labels. Nothing is cached by default.
         :return: Nothing. New annotation is saved to a file.
         """
 
@@ -540,15 +545,17 @@ class SubparcellationService(object):
             labels=labels, ctx=ctx)
         if con_sim_aff > 0:
             # Load voxel connectivity dissimilarity/distance matrix:
-            con = numpy.load(consim_path).astype('single')
+            con = numpy.load(consim_path).astype('single', copy=False)
             # Convert it back to similarity cosine because we want to use
-            # arccos instead of 1-cos for distance:
-            con = 1 - con
+            # arccos instead of 1-cos for distance (in place, not to hold two node x node matrices):
+            numpy.subtract(1, con, out=con)
             # Read the cras:
             cras = numpy.loadtxt(cras_path)
             # Get only the reference tdi_lbl volume's voxels that correspond to connectome nodes
             # and their ras xyz coordinates:
-            vox, voxxzy = self.volume_service.con_vox_in_ras(ref_vol_path)
+            # (read compactly, and optionally cached, since it is the same for all the labels' runs)
+            vox, voxxzy = self.volume_service.con_vox_in_ras(ref_vol_path, compact=True, cache_dir=cache_dir)
+            voxxzy_index = SpatialIndex(voxxzy)
         # Initialize the output:
         region_names = []
         region_color_table = []
@@ -583,7 +590,7 @@ class SubparcellationService(object):
                 surface, ind_verts_mask)
             # Compute distances among directly connected vertices
             dist = self.surface_service.vertex_connectivity(label_surface, mode="sparse",
-                                                            metric='euclidean', symmetric=True).astype('single')
+                                                            metric='euclidean', symmetric=True)
             # Mask of label vertices that are neighbors of tract end voxels
             # ("con"):
             label_surface.area_mask = numpy.in1d(ind_verts, con_verts_idx)
@@ -652,7 +659,8 @@ class SubparcellationService(object):
                               "affinity matrix...")
                         affinity =\
                             self.surface_service.compute_consim_affinity(
-                                component_surface.vertices, vox, voxxzy, con, cras).astype('single')
+                                component_surface.vertices, vox, voxxzy, con, cras,
+                                voxxzy_index=voxxzy_index).astype('single')
                         # Convert cosine distance to cosine
                         affinity = 1 - affinity
                         # invert cosine similarity to arccos distance
@@ -688,19 +696,24 @@ class SubparcellationService(object):
                     parcels[i_comp_verts] = clusters + n_parcels
                     n_parcels += int(n_clusters)
             parcel_labels = list(range(n_parcels))
+            # Spatial indices of the vertices assigned to parcels so far, together with their parcels:
+            parcels_indices = [(SpatialIndex(label_surface.vertices[parcels >= 0]), parcels[parcels >= 0])]
             for i_comp_verts in too_small_parcels:
                 print(("...Dealing now with too small surface components..."
                        + " of region " + annotation.region_names[i_label]))
                 comp_to_parcel_mindist = 1000.0  # this is 1 meter long!
                 assign_to_parcel = -1
-                for ip in parcel_labels:
-                    temp_dist =\
-                        numpy.min(cdist(label_surface.vertices[i_comp_verts, :], label_surface.vertices[parcels == ip, :],
-                                        'euclidean'), axis=None)
-                    if temp_dist < comp_to_parcel_mindist:
-                        comp_to_parcel_mindist = temp_dist
-                        assign_to_parcel = ip
+                for parcels_index, index_parcels in parcels_indices:
+                    temp_dist, nearest = parcels_index.query_nearest(label_surface.vertices[i_comp_verts, :],
+                                                                     max_distance=comp_to_parcel_mindist)
+                    i_nearest = numpy.argmin(temp_dist)
+                    if temp_dist[i_nearest] < comp_to_parcel_mindist:
+                        comp_to_parcel_mindist = temp_dist[i_nearest]
+                        assign_to_parcel = index_parcels[nearest[i_nearest]]
                 parcels[i_comp_verts] = assign_to_parcel
+                if assign_to_parcel >= 0:
+                    parcels_indices.append((SpatialIndex(label_surface.vertices[i_comp_verts, :]),
+                                            parcels[i_comp_verts]))
                 print(("...Component " + str(i_comp) + " assigned to parcel " + str(assign_to_parcel)
                        + " with a minimum euclidean distance of " + str(
                     comp_to_parcel_mindist) + " mm"))
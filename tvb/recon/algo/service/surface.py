@@ -1,23 +1,85 @@
 # -*- coding: utf-8 -*-
 
 from typing import Optional, Union
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import glob
 import os
+import shutil
 import gdist
 import numpy
 import scipy
+import scipy.ndimage
 from tvb.recon.io.factory import IOUtils
 from tvb.recon.logger import get_logger
 from tvb.recon.algo.service.annotation import AnnotationService, DEFAULT_LUT
 from tvb.recon.io.volume import VolumeIO
-from tvb.recon.model.surface import Surface
+from tvb.recon.model.surface import Surface, SubSurface, COMPACT_VERTICES_DTYPE, COMPACT_TRIANGLES_DTYPE
 from tvb.recon.model.annotation import Annotation
-from scipy.sparse import csr_matrix
+from tvb.recon.model.label_index import LabelIndex
+from tvb.recon.model.constants import NPZ_EXTENSION
+from scipy.sparse import csr_matrix, load_npz, save_npz
 from scipy.sparse.csgraph import connected_components, shortest_path
-from sklearn.metrics.pairwise import paired_distances
-from scipy.spatial.distance import cdist
+from tvb.recon.model.spatial_index import SpatialIndex
 from tvb.recon.algo.service.annotation import default_lut_path  # TODO into fs module
 
+# number of vertices above which a dense vertex connectivity matrix is warned about
+DENSE_CONNECTIVITY_WARNING_SIZE = 10000
+# number of source vertices (rows) per chunk of a local geodesic distance matrix
+GDIST_CHUNK_SIZE = 2000
+
+# per process cache of the surfaces of the geodesic distance computations, with their search structures
+_gdist_surfaces = {}
+
+
+def _get_gdist_surface(surf_path: str) -> tuple:
+    if surf_path not in _gdist_surfaces:
+        surface = IOUtils.read_surface(surf_path, False)
+        edges = surface.get_edges()
+        max_edge_length = numpy.max(numpy.sqrt(numpy.sum(
+            (surface.vertices[edges[:, 0]] - surface.vertices[edges[:, 1]]) ** 2, axis=1)))
+        _gdist_surfaces[surf_path] = (surface.vertices.astype('float64'), surface.triangles.astype('<i4'),
+                                      surface.get_spatial_index(), surface.get_vertex_triangle_incidence(),
+                                      max_edge_length)
+    return _gdist_surfaces[surf_path]
+
+
+def _compute_gdist_chunk(surf_path: str, start: int, end: int, max_distance: float, chunk_path: str) -> str:
+    """
+    Compute the rows start...end-1 of the local geodesic distance matrix of a surface, and save them to chunk_path.
+    A geodesic path of length up to max_distance does not leave the ball of that radius around its source, so every
+    source is solved on the mesh of the triangles within max_distance + the longest edge length from it,
+    giving the same distances as gdist.local_gdist_matrix on the whole mesh.
+    """
+    vertices, triangles, spatial_index, incidence, max_edge_length = _get_gdist_surface(surf_path)
+    local_indices = -numpy.ones((vertices.shape[0],), dtype='<i4')
+    rows, cols, data = [], [], []
+    neighbors = spatial_index.query_radius(vertices[start:end], max_distance + max_edge_length)
+    for source, source_neighbors in zip(range(start, end), neighbors):
+        local_indices[source_neighbors] = numpy.arange(source_neighbors.size)
+        local_triangles = local_indices[triangles[numpy.unique(incidence[source_neighbors].indices)]]
+        local_triangles = local_triangles[numpy.all(local_triangles >= 0, axis=1)]
+        if local_triangles.shape[0] == 0:
+            local_indices[source_neighbors] = -1
+            continue
+        distances = gdist.compute_gdist(vertices[source_neighbors], local_triangles,
+                                        source_indices=local_indices[[source]], max_distance=max_distance)
+        local_indices[source_neighbors] = -1
+        within = numpy.logical_and(distances > 0, distances <= max_distance)
+        rows.append(numpy.full((numpy.sum(within),), source - start))
+        cols.append(source_neighbors[within])
+        data.append(distances[within])
+    if data:
+        chunk = csr_matrix((numpy.concatenate(data), (numpy.concatenate(rows), numpy.concatenate(cols))),
+                           shape=(end - start, vertices.shape[0]))
+    else:
+        # none of the sources is a vertex of a triangle
+        chunk = csr_matrix((end - start, vertices.shape[0]))
+    # write to a temporary file first, so that only complete chunks are found when resuming
+    with open(chunk_path + ".tmp", "wb") as chunk_file:
+        save_npz(chunk_file, chunk)
+    os.replace(chunk_path + ".tmp", chunk_path)
+    return chunk_path
+
 
 class SurfaceService(object):
     logger = get_logger(__name__)
@@ -62,52 +124,120 @@ class SurfaceService(object):
         for surf_name in glob.glob(surfs_glob):
             self.convert_fs_to_brain_visa(surf_name)
 
-    def merge_surfaces(self, surfaces: Surface) -> Surface:
+    def merge_surfaces(self, surfaces: Surface, compact: bool=False) -> Surface:
         """
         Merge several surfaces, and their region mappings.
+        The output arrays are allocated once and filled surface by surface.
+        :param compact: if True, the merged surface is stored with float32 vertices and int32 triangles
         :return: the merge result surface and region mapping.
         """
         n_surfaces = len(surfaces)
-        out_surface = Surface([], [])
+        n_vertices = sum(surface.n_vertices for surface in surfaces)
+        n_triangles = sum(surface.n_triangles for surface in surfaces)
+        if compact:
+            vertices_dtype, triangles_dtype = COMPACT_VERTICES_DTYPE, COMPACT_TRIANGLES_DTYPE
+        else:
+            vertices_dtype = numpy.result_type(float, *[surface.vertices for surface in surfaces])
+            triangles_dtype = numpy.result_type('i', *[surface.triangles for surface in surfaces])
+        vertices = numpy.empty((n_vertices, 3), dtype=vertices_dtype)
+        triangles = numpy.empty((n_triangles, 3), dtype=triangles_dtype)
+        area_mask = numpy.ones((n_vertices,), dtype='bool')
+        out_surface = Surface([], [], compact=compact)
         # TODO: how to deal with the metadata of merged surfaces, so that freesurfer.io can handle them, e.g., write them
         # i.e., we need to have a final unique version of the metadata, not a list of them, as I am doing here in the
         # commented code
         # out_surface_attributes=dict()
         # for attribute in ["vertices_coord_system", "generic_metadata", "vertices_metadata", "triangles_metadata"]:
         #     out_surface_attributes[attribute]=[]
+        i_vertex = 0
+        i_triangle = 0
         for i_srf in range(n_surfaces):
-            out_surface.add_vertices_and_triangles(surfaces[i_srf].vertices,
-                                                   surfaces[i_srf].triangles,
-                                                   surfaces[i_srf].area_mask)
+            surface = surfaces[i_srf]
+            vertices[i_vertex:i_vertex + surface.n_vertices] = surface.vertices
+            triangles[i_triangle:i_triangle + surface.n_triangles] = surface.triangles
+            triangles[i_triangle:i_triangle + surface.n_triangles] += i_vertex
+            if len(surface.area_mask) == surface.n_vertices:
+                area_mask[i_vertex:i_vertex + surface.n_vertices] = surface.area_mask
+            i_vertex += surface.n_vertices
+            i_triangle += surface.n_triangles
             if out_surface.get_main_metadata() is None:
-                out_surface.set_main_metadata(surfaces[i_srf].get_main_metadata())
-            if len(surfaces[i_srf].center_ras) == 0:
+                out_surface.set_main_metadata(surface.get_main_metadata())
+            if len(surface.center_ras) == 0:
                 pass
             elif len(out_surface.center_ras) == 0:
-                out_surface.center_ras = surfaces[i_srf].center_ras
-            elif numpy.any(out_surface.center_ras != surfaces[i_srf].center_ras):
+                out_surface.center_ras = surface.center_ras
+            elif numpy.any(out_surface.center_ras != surface.center_ras):
                 self.logger.warn("At least two surfaces have different -non empty- centers in RAS coordinates!")
             # #TODO: think about how to better merge these fields
             # for attribute in ["vertices_coord_system", "generic_metadata", "vertices_metadata", "triangles_metadata"]:
             #     out_surface_attributes[attribute].append(getattr(surfaces[i_srf],attribute))
             #     setattr(out_surface,attribute,out_surface_attributes[attribute])
+        out_surface.vertices = vertices
+        out_surface.triangles = triangles
+        out_surface.area_mask = area_mask
         return out_surface
 
-    def compute_gdist_mat(self, surf_name: str='pial', max_distance: float=40.0) -> numpy.ndarray:
-        max_distance = float(max_distance)  # in case passed from sys.argv
+    def compute_gdist_mat(self, surf_name: str='pial', max_distance: float=40.0, n_processes: Optional[int]=None,
+                          chunk_size: int=GDIST_CHUNK_SIZE, subjects_dir: Optional[str]=None,
+                          subject: Optional[str]=None) -> list:
+        """
+        Compute the local geodesic distance matrices (up to max_distance) of the surfaces of both hemispheres, and save
+        them as compressed sparse matrices to $SUBJECTS_DIR/$SUBJECT/surf/?h.<surf_name>.gdist.<max_distance>mm.npz.
+        The rows of both hemispheres are computed in chunks of vertices, in parallel in a pool of processes.
+        Completed chunks are kept until the matrix is assembled, so that an interrupted computation resumes from them,
+        and existing matrices (of the same max_distance) are not recomputed.
+        :param n_processes: number of worker processes, by default the number of CPUs; 1 computes in this process
+        :param chunk_size: number of vertices (rows) per chunk
+        :param subjects_dir: by default $SUBJECTS_DIR
+        :param subject: by default $SUBJECT
+        :return: the paths of the right and left hemisphere matrices
+        """
+        # in case passed from sys.argv
+        max_distance = float(max_distance)
+        n_processes = int(n_processes or os.cpu_count() or 1)
+        chunk_size = int(chunk_size)
+        subjects_dir = subjects_dir or os.environ['SUBJECTS_DIR']
+        subject = subject or os.environ['SUBJECT']
+        mat_paths = []
+        matrices_chunks = []
+        tasks = []
         for h in 'rl':
-            subjects_dir = os.environ['SUBJECTS_DIR']
-            subject = os.environ['SUBJECT']
             surf_path = '%s/%s/surf/%sh.%s' % (subjects_dir,
                                                subject, h, surf_name)
-            surface = IOUtils.read_surface(surf_path, False)
-            mat_path = '%s/%s/surf/%sh.%s.gdist.mat' % (
-                subjects_dir, subject, h, surf_name)
-            mat = gdist.local_gdist_matrix(
-                surface.vertices, surface.triangles.astype('<i4'), max_distance=max_distance)
-            scipy.io.savemat(mat_path, {'gdist': mat})
+            mat_path = '%s/%s/surf/%sh.%s.gdist.%gmm%s' % (
+                subjects_dir, subject, h, surf_name, max_distance, NPZ_EXTENSION)
+            mat_paths.append(mat_path)
+            if os.path.exists(mat_path):
+                self.logger.info("Geodesic distance matrix %s exists already", mat_path)
+                continue
+            chunks_dir = mat_path + '.chunks'
+            os.makedirs(chunks_dir, exist_ok=True)
+            # (the search structures are only built in the workers)
+            n_vertices = IOUtils.read_surface(surf_path, False).n_vertices
+            chunk_paths = []
+            for start in range(0, n_vertices, chunk_size):
+                end = min(start + chunk_size, n_vertices)
+                chunk_path = os.path.join(chunks_dir, '%d-%d%s' % (start, end, NPZ_EXTENSION))
+                chunk_paths.append(chunk_path)
+                if not os.path.exists(chunk_path):
+                    tasks.append((surf_path, start, end, max_distance, chunk_path))
+            matrices_chunks.append((mat_path, chunks_dir, chunk_paths))
+
+        self.logger.info("Computing %d chunks of geodesic distances in %d processes", len(tasks), n_processes)
+        if n_processes > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=n_processes) as executor:
+                futures = [executor.submit(_compute_gdist_chunk, *task) for task in tasks]
+                for future in as_completed(futures):
+                    self.logger.info("Computed %s", future.result())
+        else:
+            for task in tasks:
+                self.logger.info("Computed %s", _compute_gdist_chunk(*task))
 
-            return mat
+        for mat_path, chunks_dir, chunk_paths in matrices_chunks:
+            mat = scipy.sparse.vstack([load_npz(chunk_path) for chunk_path in chunk_paths], format='csr')
+            save_npz(mat_path, mat)
+            shutil.rmtree(chunks_dir)
+        return mat_paths
 
     # TODO: maybe create a new "connectome" service and transfer this function there
     # TODO: add more normalizations modes
@@ -140,20 +270,15 @@ class SurfaceService(object):
         An important step is to replace old vertices indexes of faces to the new ones.
         :param: surface: input surface object
         :param: verts_mask: mask of the sub-surface to be extracted
+        :param output: 'surface' for a new surface object, 'view' for a SubSurface view that shares the vertices of
+                       the input surface, or else a (vertices, triangles, area_mask) tuple
         :return: output surface object
         """
 
-        verts_out = surface.vertices[verts_mask]
-        triangles_mask = numpy.c_[verts_mask[surface.triangles[:, 0]],
-                                  verts_mask[surface.triangles[:, 1]],
-                                  verts_mask[surface.triangles[:, 2]]].all(axis=1)
-        triangles_out = numpy.array(surface.triangles[triangles_mask, :])
-        verts_out_inds, = numpy.where(verts_mask)
-        for triang_idx in range(triangles_out.shape[0]):
-            for vertex_idx in range(3):
-                triangles_out[triang_idx, vertex_idx], = \
-                    numpy.where(
-                        triangles_out[triang_idx, vertex_idx] == verts_out_inds)
+        if output == 'view':
+            return SubSurface(surface, verts_mask)
+        verts_out_inds, triangles_out_inds, triangles_out = surface.get_sub_surface_indices(verts_mask)
+        verts_out = surface.vertices[verts_out_inds]
         if output == 'surface':
             out_surface = Surface(verts_out, triangles_out, area_mask=surface.area_mask[verts_out_inds],
                                   center_ras=surface.center_ras, vertices_coord_system=surface.vertices_coord_system,
@@ -174,66 +299,33 @@ class SurfaceService(object):
             """
         if area_mask is None:
             area_mask = surface.area_mask
-        # Apply the mask in order to extract the sub-surface (vertices and
-        # relevant triangles)
-        (vertices, triangles) = self.extract_subsurf(
-            surface, area_mask, output='verts_triangls')[:2]
-        return numpy.sum(self.tri_area(vertices[triangles]))
+        # Sum the (cached) areas of the triangles of the sub-surface, i.e., the ones with all 3 vertices in the mask
+        triangles_mask = numpy.asarray(area_mask, dtype=bool)[surface.triangles].all(axis=1)
+        return numpy.sum(surface.get_triangle_areas()[triangles_mask])
 
     def vertex_connectivity(self, surface: Surface, mode: str="sparse", metric: Optional[str]=None,
                             symmetric: bool=False, verts_mask: Union[numpy.ndarray, list]=None) \
             -> Union[numpy.ndarray, scipy.sparse.csr.csr_matrix]:
         """
         It computes a sparse matrix of the connectivity among the vertices of a surface.
+        The sparse matrix is cached by the surface (see Surface.get_vertex_connectivity) and should not be modified.
         :param surface: input surface object
         :param mode: "sparse" by default or "2D"
         :param metric: None by default, could be "euclidean"
         :param symmetric: True for symmetric matrix output
         :param verts_mask: a mask to apply the method to a a sub-surface of the original surface
-        :return: the computed matrix.
+        :return: the computed float32 matrix.
         """
         if verts_mask is not None:
-            (vertices, triangles) = self.extract_subsurf(
-                surface, verts_mask, output='verts_triangls')[:2]
-        else:
-            vertices = surface.vertices
-            triangles = surface.triangles
-        # Get all pairs of vertex indexes (i.e., edges) that appear in each
-        # face (triangle)
-        edges = numpy.r_[triangles[:, [0, 1]],
-                         triangles[:, [1, 2]], triangles[:, [2, 0]]]
-        # Remove repetitions
-        edges = numpy.vstack(set(map(tuple, edges)))
-        # Mark all existing pairs to 1
-        n_v = vertices.shape[0]
-        n_e = edges.shape[0]
-        # For symmetric output...
-        if symmetric:
-            # ...create for the moment the "double" edges
-            edges2 = numpy.r_[edges, edges[:, [1, 0]]]
-        if metric is None:
-            # For symmetric output...
-            if symmetric:
-                # ...remove repetitions of edges2
-                edges = numpy.vstack(set(map(tuple, edges2)))
-                n_e = edges.shape[0]
-            con = csr_matrix(
-                (numpy.ones((n_e,)), (edges[:, 0], edges[:, 1])), shape=(n_v, n_v))
-            if mode != "sparse":
-                # Create non-sparse matrix
-                con = con.todense()
-        else:
-            d = paired_distances(vertices[edges[:, 0]], vertices[
-                edges[:, 1]], metric)
-            # For symmetric output...
-            if symmetric:
-                # double also d...
-                d = numpy.r_[d, d]
-                edges = edges2
-            if mode == "sparse":
-                # Create sparse matrix
-                con = csr_matrix(
-                    (d, (edges[:, 0], edges[:, 1])), shape=(n_v, n_v))
+            surface = self.extract_subsurf(surface, verts_mask, output='view')
+        con = surface.get_vertex_connectivity(metric, symmetric)
+        if mode != "sparse":
+            if surface.n_vertices > DENSE_CONNECTIVITY_WARNING_SIZE:
+                self.logger.warning("Creating a dense %d x %d vertex connectivity matrix (%.1f GB)!",
+                                    surface.n_vertices, surface.n_vertices,
+                                    surface.n_vertices ** 2 * con.dtype.itemsize / 2.0 ** 30)
+            # Create non-sparse matrix
+            con = con.toarray()
         return con
 
     # TODO: use surface instead of verts and faces?? Denis: not sure about
@@ -257,11 +349,12 @@ class SurfaceService(object):
             return 0
         elif connectivity is None:
             n_verts = surface.vertices.shape[0]
-            # Create the connectivity matrix, if not in the input:
-            connectivity = self.vertex_connectivity(
-                surface, verts_mask=verts_mask)
+            # Create the connectivity matrix, if not in the input, from the surface's cached adjacency:
+            connectivity = surface.get_vertex_adjacency()
             if verts_mask is None:
                 verts_mask = numpy.ones((n_verts,), dtype=bool)
+            else:
+                connectivity = connectivity[verts_mask, :][:, verts_mask]
         else:
             n_verts = connectivity.shape[0]
             if verts_mask is None:
@@ -272,19 +365,52 @@ class SurfaceService(object):
         (n_components, components_masked) = \
             connected_components(connectivity, directed=False,
                                  connection='weak', return_labels=True)
-        comp_area = []
-        if surface is not None:
-            # For each component...
-            for ic in range(n_components):
-                i_comp_verts = components_masked == ic
-                # ...compute the surface area, after applying any specified mask
-                comp_area.append(self.compute_surface_area(surface,
-                                                           mask=numpy.logical_and(i_comp_verts, surface.area_mask)))
         # Prepare final components' labels output:
         components = -numpy.ones((n_verts,)).astype('i')
         components[verts_mask] = components_masked
+        comp_area = []
+        if surface is not None:
+            comp_area = self.compute_areas_for_components(surface, components, n_components)
         return n_components, components, numpy.array(comp_area)
 
+    def compute_areas_for_components(self, surface: Surface, components: numpy.ndarray, n_components: int) \
+            -> numpy.ndarray:
+        """
+        For each component, compute the surface area of the triangles that lie entirely within it,
+        after applying the surface's area mask.
+        :param components: array (number of vertices, ) of component labels >= 0, or -1 for vertices of no component
+        :return: array of the areas of the components 0...n_components-1
+        """
+        triangles_components = numpy.where(surface.area_mask, components, -1)[surface.triangles]
+        in_component = numpy.logical_and(triangles_components[:, 0] >= 0,
+                                         numpy.all(triangles_components == triangles_components[:, [0]], axis=1))
+        return numpy.bincount(triangles_components[in_component, 0],
+                              surface.get_triangle_areas()[in_component, 0], minlength=n_components)
+
+    def count_components_of_labels(self, connectivity: Union[numpy.ndarray, csr_matrix],
+                                   labels: Union[numpy.ndarray, list]) -> numpy.ndarray:
+        """
+        Count the connected components of the vertices of every label, with a single connected components computation
+        over the connections among vertices of the same label.
+        :param connectivity: array or sparse matrix of structural connectivity constraints, as for
+                             connected_surface_components
+        :param labels: integer array (number of vertices, ) of labels >= 0, or < 0 for vertices to exclude
+        :return: array of the number of components of every label 0...max(labels)
+        """
+        labels = numpy.asarray(labels).astype('int64')
+        connectivity = scipy.sparse.coo_matrix(connectivity)
+        within_labels = numpy.logical_and(labels[connectivity.row] == labels[connectivity.col],
+                                          labels[connectivity.row] >= 0)
+        connectivity = csr_matrix((numpy.ones((numpy.sum(within_labels),)),
+                                   (connectivity.row[within_labels], connectivity.col[within_labels])),
+                                  shape=connectivity.shape)
+        n_components, components = connected_components(connectivity, directed=False, connection='weak',
+                                                        return_labels=True)
+        included = labels >= 0
+        # every distinct (label, component) pair is a component of that label
+        label_components = numpy.unique(labels[included] * n_components + components[included])
+        return numpy.bincount(label_components // n_components, minlength=labels.max() + 1)
+
     def aseg_surf_conc_annot(self, surf_path: str, out_surf_path: str, annot_path: str,
                              label_indices: Union[numpy.ndarray, list], lut_path: Optional[str]=None) -> Surface:
         """
@@ -323,18 +449,35 @@ class SurfaceService(object):
 
         return out_surface
 
-    def __prepare_grid(self, vertex_neighbourhood: int) -> (numpy.ndarray, int):
-        # Prepare grid if needed for possible use:
+    @staticmethod
+    def _near_labels(data: numpy.ndarray, ijk: numpy.ndarray, labels: list,
+                     vertex_neighbourhood: int=0) -> numpy.ndarray:
+        """
+        Test voxel positions against a dilated mask of the target labels, restricted to their bounding box.
+        :param data: label volume data
+        :param ijk: voxel indices array (number of positions x 3)
+        :param labels: the target labels
+        :param vertex_neighbourhood: radius (in voxels) of the cube neighbourhood of every position
+        :return: boolean array, True for the positions with a voxel of one of the labels in their neighbourhood,
+                 neighbourhoods being clipped to the volume
+        """
+        if ijk.shape[0] == 0:
+            return numpy.zeros((0,), dtype='bool')
+        box_start = ijk.min(axis=0) - vertex_neighbourhood
+        box_end = ijk.max(axis=0) + vertex_neighbourhood + 1
+        vol_start = numpy.maximum(box_start, 0)
+        vol_end = numpy.minimum(box_end, data.shape[:3])
+        target_mask = numpy.zeros(box_end - box_start, dtype='bool')
+        if numpy.all(vol_end > vol_start):
+            target_mask[tuple(slice(start - box, end - box) for start, end, box in
+                              zip(vol_start, vol_end, box_start))] = \
+                numpy.isin(data[tuple(slice(start, end) for start, end in zip(vol_start, vol_end))], labels)
         if vertex_neighbourhood > 0:
-            grid = numpy.meshgrid(list(range(-vertex_neighbourhood, vertex_neighbourhood + 1, 1)),
-                                  list(range(-vertex_neighbourhood,
-                                             vertex_neighbourhood + 1, 1)),
-                                  list(range(-vertex_neighbourhood, vertex_neighbourhood + 1, 1)), indexing='ij')
-            grid = numpy.c_[
-                numpy.array(grid[0]).flatten(), numpy.array(grid[1]).flatten(), numpy.array(grid[2]).flatten()]
-            n_grid = grid.shape[0]
-
-            return grid, n_grid
+            # the box extends vertex_neighbourhood voxels beyond every position, so the filter's border mode is irrelevant
+            target_mask = scipy.ndimage.maximum_filter(target_mask, size=2 * vertex_neighbourhood + 1,
+                                                       mode='constant', cval=False)
+        ijk = ijk - box_start
+        return target_mask[ijk[:, 0], ijk[:, 1], ijk[:, 2]]
 
     def sample_vol_on_surf(self, surf_path: str, vol_path: str, annot_path: str, out_surf_path: str,
                            cras_path: str, add_string: str='', vertex_neighbourhood: int=1,
@@ -353,7 +496,7 @@ class SurfaceService(object):
         annotation = IOUtils.read_annotation(annot_path)
         labels = self.annotation_service.annot_names_to_labels(annotation.region_names,
                                                                add_string=add_string, lut_path=lut_path)
-        region_mapping_indexes = numpy.unique(annotation.region_mapping)
+        region_index = annotation.get_region_index()
 
         volume_parser = VolumeIO()
         volume = volume_parser.read(vol_path)
@@ -361,73 +504,27 @@ class SurfaceService(object):
 
         cras = numpy.loadtxt(cras_path)
 
-        grid, n_grid = self.__prepare_grid(vertex_neighbourhood)
+        # Compute the nearest voxel coordinates of all vertices, after adding cras to take them to scanner ras
+        ijk = numpy.round((surface.vertices + cras).dot(ras2vox_affine_matrix[:3, :3].T) +
+                          ras2vox_affine_matrix[:3, 3]).astype('i')
 
         # Initialize the output mask:
-        verts_out_mask = numpy.repeat([False], surface.vertices.shape[0])
-        for label_index in range(len(region_mapping_indexes)):
+        verts_out_mask = numpy.zeros((surface.vertices.shape[0],), dtype='bool')
+        for label_index, region in enumerate(region_index.labels):
 
             self.logger.info("%s", add_string +
                              annotation.region_names[label_index])
 
             # Get the indexes of the vertices corresponding to this label:
-            verts_indices_of_label, = numpy.where(
-                annotation.region_mapping[:] == region_mapping_indexes[label_index])
-            verts_indices_of_label_size = verts_indices_of_label.size
-            if verts_indices_of_label_size == 0:
-                continue
+            verts_indices_of_label = region_index.get_flat_indices(region)
 
             # Add any additional labels
             all_labels = [labels[label_index]] + add_lbl
 
-            # get the vertices for current label and add cras to take them to
-            # scanner ras
-            verts_of_label = surface.vertices[verts_indices_of_label, :]
-            verts_of_label += numpy.repeat(numpy.expand_dims(
-                cras, 1).T, verts_indices_of_label_size, axis=0)
-
-            # Compute the nearest voxel coordinates using the affine transform
-            ijk = numpy.round(
-                ras2vox_affine_matrix.dot(numpy.c_[verts_of_label, numpy.ones(verts_indices_of_label_size)].T)[:3].T) \
-                .astype('i')
-
-            # Get the labels of these voxels:
-            surf_vxls = volume.data[ijk[:, 0], ijk[:, 1], ijk[:, 2]]
-
-            # Vertex mask to keep: those that correspond to voxels of one of
-            # the target labels
-            # surf_vxls==lbl if only one target label
-            verts_keep, = numpy.where(numpy.in1d(surf_vxls, all_labels))
-            verts_out_mask[verts_indices_of_label[verts_keep]] = True
-
-            if vertex_neighbourhood > 0:
-                # These are now the remaining indexes to be checked for
-                # neighboring voxels
-                verts_indices_of_label = numpy.delete(
-                    verts_indices_of_label, verts_keep)
-                ijk = numpy.delete(ijk, verts_keep, axis=0)
-
-                for vertex_index in range(verts_indices_of_label.size):
-                    # Generate the specific grid centered at the voxel ijk
-                    ijk_grid = grid + \
-                               numpy.tile(ijk[vertex_index, :], (n_grid, 1))
-
-                    # Remove voxels outside the volume
-                    indexes_within_limits = numpy.all([(ijk_grid[:, 0] >= 0), (ijk_grid[:, 0] < volume.dimensions[0]),
-                                                       (ijk_grid[:, 1] >= 0), (ijk_grid[
-                                                                               :, 1] < volume.dimensions[1]),
-                                                       (ijk_grid[:, 2] >= 0), (ijk_grid[:, 2] < volume.dimensions[2])],
-                                                      axis=0)
-                    ijk_grid = ijk_grid[indexes_within_limits, :]
-                    surf_vxls = volume.data[
-                        ijk_grid[:, 0], ijk_grid[:, 1], ijk_grid[:, 2]]
-
-                    # If any of the neighbors is of the target labels include
-                    # the current vertex
-                    # surf_vxls==lbl if only one target label
-                    if numpy.any(numpy.in1d(surf_vxls, all_labels)):
-                        verts_out_mask[
-                            verts_indices_of_label[vertex_index]] = True
+            # Vertex mask to keep: those that correspond to voxels of one of the target labels,
+            # or that have such voxels within their neighbourhood
+            verts_out_mask[verts_indices_of_label] = self._near_labels(
+                volume.data, ijk[verts_indices_of_label], all_labels, max(vertex_neighbourhood, 0))
 
         # Vertex indexes and vertices to keep:
         verts_out_indices, = numpy.where(verts_out_mask)
@@ -436,17 +533,8 @@ class SurfaceService(object):
         # TODO maybe: make sure that all voxels of this label correspond to at least one vertex.
         # Create a similar mask for faces by picking only triangles of which
         # all 3 vertices are included
-        face_out_mask = numpy.c_[
-            verts_out_mask[surface.triangles[:, 0]], verts_out_mask[surface.triangles[:, 1]], verts_out_mask[
-                surface.triangles[:, 2]]].all(axis=1)
-        faces_out = surface.triangles[face_out_mask]
-
-        # The old vertices' indexes of faces have to be transformed to the new
-        # vrtx_out_inds:
-        for iF in range(faces_out.shape[0]):
-            for vertex_index in range(3):
-                faces_out[iF, vertex_index], = numpy.where(
-                    faces_out[iF, vertex_index] == verts_out_indices)
+        # all 3 vertices are included, and transform the old vertices' indexes of faces to the new vrtx_out_inds:
+        faces_out = surface.get_sub_surface_indices(verts_out_mask)[2]
 
         surface.vertices = verts_out
         surface.triangles = faces_out
@@ -456,7 +544,7 @@ class SurfaceService(object):
         IOUtils.write_surface(out_surf_path, surface)
 
         annotation.set_region_mapping(
-            annotation.get_region_mapping_by_indices([verts_out_indices]))
+            annotation.get_region_mapping_by_indices(verts_out_indices))
         IOUtils.write_annotation(out_surf_path + ".annot", annotation)
 
         numpy.save(out_surf_path + "-idx.npy", verts_out_indices)
@@ -467,7 +555,8 @@ class SurfaceService(object):
     # TODO: maybe create a new "connectome" service and transfer this function
     # there
     def compute_consim_affinity(self, verts: numpy.ndarray, vox: Union[numpy.ndarray, list], voxxzy: numpy.ndarray,
-                                con: numpy.ndarray, cras: Optional[Union[numpy.ndarray, list]]=None) -> numpy.ndarray:
+                                con: numpy.ndarray, cras: Optional[Union[numpy.ndarray, list]]=None,
+                                voxxzy_index: Optional[SpatialIndex]=None) -> numpy.ndarray:
         """
         This function creates a connectome affinity matrix among vertices,
         starting from an affinity matrix among voxels,
@@ -478,19 +567,21 @@ class SurfaceService(object):
         :param con: connectivity affinity matrix
         :param cras: center ras point to be optionally added to the vertices coordinates
                     (being probably in freesurfer tk-ras or surface ras coordinates) to align with the volume voxels
+        :param voxxzy_index: optional prebuilt SpatialIndex of voxxzy, to be reused among calls
         :return: the affinity matrix among vertices
         """
         # Add the cras to take them to scanner ras coordinates, if necessary:
         if cras is not None:
-            verts += numpy.repeat(numpy.expand_dims(cras,
-                                                    1).T, verts.shape[0], axis=0)
+            verts = verts + numpy.reshape(cras, (1, 3))
         # TODO?: to use aparc+aseg to correspond vertices only to voxels of the same label
         # There would have to be a vertex->voxel of aparc+aseg of the same label -> voxel of tdi_lbl_in_T1 mapping
         # Maybe redundant  because we might be ending to the same voxel of tdi_lbl anyway...
         # Something to test/discuss...
         # Find for each vertex the closest voxel node in terms of euclidean
         # distance:
-        v2n = numpy.argmin(cdist(verts, voxxzy, 'euclidean'), axis=1)
+        if voxxzy_index is None:
+            voxxzy_index = SpatialIndex(voxxzy)
+        v2n = voxxzy_index.query_nearest(verts)[1]
         # Assign to each vertex the integer identity of the nearest voxel node.
         v2n = vox[v2n]
         print("...surface component's vertices correspond to " +
@@ -498,43 +589,58 @@ class SurfaceService(object):
         affinity = con[v2n - 1, :][:, v2n - 1]
         return affinity
 
+    @staticmethod
+    def get_region_index(region_mapping: Union[LabelIndex, Annotation, numpy.ndarray, list]) -> LabelIndex:
+        """
+        :param region_mapping: a region mapping, an Annotation, or an already built region index (returned as is)
+        :return: the vertices grouped by region, to be shared by the compute_*_for_regions methods
+        """
+        if isinstance(region_mapping, LabelIndex):
+            return region_mapping
+        if isinstance(region_mapping, Annotation):
+            return region_mapping.get_region_index()
+        return LabelIndex(region_mapping)
+
+    def _reduce_for_regions(self, regions, region_index: LabelIndex, region_values: numpy.ndarray) -> numpy.ndarray:
+        """
+        :param region_values: one row of values per label of region_index
+        :return: the rows of region_values for the given regions, zeros for the regions without vertices
+        """
+        positions = region_index.get_label_positions(numpy.asarray(regions))
+        result = numpy.zeros((positions.size,) + region_values.shape[1:])
+        result[positions >= 0] = region_values[positions[positions >= 0]]
+        return result
+
     # TODO: keep the commented methods definition in py3
-    def compute_areas_for_regions(self, regions: list, surface: Surface, region_mapping: list) -> numpy.array:
+    def compute_areas_for_regions(self, regions: list, surface: Surface,
+                                  region_mapping: Union[LabelIndex, list]) -> numpy.array:
         """Compute the areas of given regions"""
 
-        region_surface_area = numpy.zeros(len(regions))
-        avt = numpy.array(surface.get_vertex_triangles())
+        region_index = self.get_region_index(region_mapping)
+        # Region (position in region_index.labels) of the vertices of every triangle
+        triangle_regions = region_index.get_element_positions()[surface.triangles]
+        triangle_areas = surface.get_triangle_areas()[:, 0]
         # NOTE: Slightly overestimates as it counts overlapping border triangles,
         #       but, not really a problem provided triangle-size << region-size.
-        for i, k in enumerate(regions):
-            regs = list(map(set, avt[numpy.array(region_mapping) == k]))
-            if len(regs) == 0:
-                continue
-            region_triangles = set.union(*regs)
-            if region_triangles:
-                region_surface_area[i] = surface.get_triangle_areas()[list(region_triangles)].sum()
-
-        return region_surface_area
-
-    def compute_orientations_for_regions(self, regions, surface, region_mapping) -> numpy.ndarray:
+        region_areas = numpy.zeros((region_index.labels.size,))
+        for i in range(3):
+            # count every triangle once for each distinct region of its vertices
+            first = numpy.all(triangle_regions[:, :i] != triangle_regions[:, i:i + 1], axis=1)
+            region_areas += numpy.bincount(triangle_regions[first, i], triangle_areas[first],
+                                           minlength=region_index.labels.size)
+        return self._reduce_for_regions(regions, region_index, region_areas)
+
+    def compute_orientations_for_regions(self, regions, surface,
+                                         region_mapping: Union[LabelIndex, list]) -> numpy.ndarray:
         """Compute the orientation of given regions from vertex_normals and region mapping"""
 
-        average_orientation = numpy.zeros((len(regions), 3))
-        vertex_normals = surface.vertex_normals()
-        # Average orientation of the region
-        for i, k in enumerate(regions):
-            orient = vertex_normals[numpy.array(region_mapping) == k, :]
-            if orient.shape[0] > 0:
-                avg_orient = numpy.mean(orient, axis=0)
-                average_orientation[i, :] = avg_orient / numpy.sqrt(numpy.sum(avg_orient ** 2))
-
-        return average_orientation
-
-    def compute_centers_for_regions(self, regions, surface, region_mapping) -> numpy.ndarray:
-        region_centers = numpy.zeros((len(regions), 3))
-        for i, k in enumerate(regions):
-            vert = surface.vertices[numpy.array(region_mapping) == k, :]
-            if vert.shape[0] > 0:
-                region_centers[i, :] = numpy.mean(vert, axis=0)
-
-        return region_centers
+        region_index = self.get_region_index(region_mapping)
+        # Average orientation of the regions
+        avg_orient = region_index.get_means(surface.vertex_normals())
+        average_orientation = avg_orient / numpy.sqrt(numpy.sum(avg_orient ** 2, axis=1))[:, numpy.newaxis]
+        return self._reduce_for_regions(regions, region_index, average_orientation)
+
+    def compute_centers_for_regions(self, regions, surface,
+                                    region_mapping: Union[LabelIndex, list]) -> numpy.ndarray:
+        region_index = self.get_region_index(region_mapping)
+        return self._reduce_for_regions(regions, region_index, region_index.get_means(surface.vertices))
@@ -7,11 +7,12 @@ import scipy.ndimage
 from tvb.recon.dax import AtlasSuffix
 import nibabel
 from tvb.recon.logger import get_logger
-from tvb.recon.algo.service.utils import execute_command
 from tvb.recon.algo.service.annotation import AnnotationService
 from tvb.recon.io.factory import IOUtils
+from tvb.recon.io.generic import GenericIO
 from tvb.recon.model.volume import Volume
-from tvb.recon.model.constants import NPY_EXTENSION
+from tvb.recon.model.label_index import LabelIndex
+from tvb.recon.model.constants import NPY_EXTENSION, NPZ_EXTENSION
 
 
 class VolumeService(object):
@@ -19,25 +20,28 @@ class VolumeService(object):
 
     def __init__(self):
         self.annotation_service = AnnotationService()
+        self.generic_io = GenericIO()
 
     def gen_label_volume_from_labels_inds(self, values: Union[numpy.ndarray, list],
-                                          input_label_volume_file: os.PathLike, output_label_volume_file: os.PathLike) \
-            -> nibabel.nifti1.Nifti1Image:
+                                          input_label_volume_file: os.PathLike, output_label_volume_file: os.PathLike,
+                                          dtype: numpy.dtype=numpy.float32) -> nibabel.nifti1.Nifti1Image:
         """
         This function creates a new volume matrix from an input label_volume matrix
-        by setting values[i] to all voxels where label_volume == i
+        by setting values[i] to all voxels where label_volume == i + 1, and nan to all other voxels
+        :param dtype: the (floating point) dtype of the output volume
         """
 
         label_nii = nibabel.load(input_label_volume_file)
-        label_volume = label_nii.get_data()
+        label_volume = numpy.asanyarray(label_nii.dataobj)
 
-        new_volume = numpy.zeros(label_volume.shape)
-        new_volume[:, :] = numpy.nan
-
-        for i, value in enumerate(values):
-            region = i + 1
-            mask = label_volume[:, :, :] == region
-            new_volume[mask] = value
+        # Lookup table of the values of labels 1..n_values, followed by the nan of any other label
+        n_values = len(values)
+        values_lut = numpy.full((n_values + 2,), numpy.nan, dtype=dtype)
+        values_lut[1:-1] = values
+        in_lut = (label_volume >= 1) & (label_volume <= n_values)
+        if not numpy.issubdtype(label_volume.dtype, numpy.integer):
+            in_lut &= numpy.mod(label_volume, 1) == 0
+        new_volume = values_lut[numpy.where(in_lut, label_volume, n_values + 1).astype(numpy.intp)]
 
         # TODO: I don't know what this is... I have to ask Viktor...
         def add_min_max(volume):
@@ -54,8 +58,8 @@ class VolumeService(object):
     def gen_label_volume_from_coords(self, values: Union[numpy.ndarray, list],
                                      coords: Union[os.PathLike, numpy.ndarray],
                                      labels: Union[os.PathLike, numpy.ndarray, list], ref_volume_file: os.PathLike,
-                                     out_volume_file: os.PathLike, skip_missing: bool=False, dist: int=0) \
-            -> numpy.ndarray:
+                                     out_volume_file: os.PathLike, skip_missing: bool=False, dist: int=0,
+                                     dtype: numpy.dtype=numpy.float32) -> nibabel.nifti1.Nifti1Image:
         """
         # Create and save a new nifti label volume of similar shape to a reference volume
         # by setting input values at input positions (optionally + & - (int) dist)
@@ -68,6 +72,7 @@ class VolumeService(object):
         :param out_volume_file: file path for the output nifti volume to be written
         :param skip_missing: flag
         :param dist: integer indicating the size of the neighborhood around the coords' positions to be labeled
+        :param dtype: the dtype of the output volume
         :return: output nifti volume
         """
         ref_volume = nibabel.load(ref_volume_file)
@@ -80,15 +85,13 @@ class VolumeService(object):
         if os.path.isfile(str(coords)):
             coords = numpy.genfromtxt(coords, dtype=float, usecols=(1, 2, 3))
 
-        positions = numpy.zeros((len(values), 3))
+        # The position of every label is the one of its first occurrence
+        first_label_inds = {}
         for i, label in enumerate(labels):
-            try:
-                contact_ind = labels.index(label)
-                coord = coords[contact_ind, :]
-            except ValueError:
-                coord = numpy.array([numpy.nan, numpy.nan, numpy.nan])
-
-            positions[i, :] = coord
+            first_label_inds.setdefault(label, i)
+        values = numpy.asarray(values)
+        positions = numpy.zeros((len(values), 3))
+        positions[:len(labels)] = numpy.asarray(coords)[[first_label_inds[label] for label in labels]]
 
         missing_mask = numpy.isnan(positions[:, 0])
         if skip_missing:
@@ -101,23 +104,32 @@ class VolumeService(object):
 
             # numpy.array(names)[missing_mask]))
 
-        new_volume = numpy.zeros(ref_volume.shape)
+        new_volume = numpy.zeros(ref_volume.shape, dtype=dtype)
         # TODO: Find out the use of the following commented line:
         # new_volume[:, :] = numpy.nan
 
-        kx, ky, kz = numpy.mgrid[-dist:dist + 1, -dist:dist + 1, -dist:dist + 1]
-
-        for val, pos in zip(values, positions):
-            ix, iy, iz = numpy.linalg.solve(ref_volume.affine, numpy.append(pos, 1.0))[0:3].astype(int)
-            # new_volume[inds[0], inds[1], inds[2]] = val
-            new_volume[ix + kx, iy + ky, iz + kz] = val
+        # Voxel indices of all positions, and of their +/- dist neighborhoods
+        ijk = numpy.linalg.solve(ref_volume.affine, numpy.c_[positions, numpy.ones(positions.shape[0])].T)[0:3]
+        ijk = ijk.T.astype(int)
+        kijk = numpy.mgrid[-dist:dist + 1, -dist:dist + 1, -dist:dist + 1].reshape((3, -1)).T
+        neighborhoods_ijk = (ijk[:, numpy.newaxis, :] + kijk[numpy.newaxis]).reshape((-1, 3))
+        neighborhoods_values = numpy.repeat(values, kijk.shape[0])
+
+        inside_volume = numpy.all((neighborhoods_ijk >= 0) & (neighborhoods_ijk < ref_volume.shape[:3]), axis=1)
+        if not numpy.all(inside_volume):
+            self.logger.warning("%d voxels of the neighborhoods of the positions are outside the volume %s",
+                                numpy.sum(~inside_volume), ref_volume_file)
+        neighborhoods_ijk = neighborhoods_ijk[inside_volume]
+        # Later positions overwrite the neighborhoods of earlier ones
+        new_volume[neighborhoods_ijk[:, 0], neighborhoods_ijk[:, 1], neighborhoods_ijk[:, 2]] = \
+            neighborhoods_values[inside_volume]
 
         # add_min_max(new_volume)
 
         new_nii = nibabel.Nifti1Image(new_volume, ref_volume.affine)
         nibabel.save(new_nii, out_volume_file)
 
-        return nibabel.nifti1.Nifti1Image
+        return new_nii
 
     def vol_to_ext_surf_vol(self, in_vol_path: os.PathLike, labels: Optional[Union[numpy.ndarray, list]]=None,
                             ctx: Optional[os.PathLike]=None, out_vol_path: Optional[os.PathLike]=None,
@@ -163,60 +175,26 @@ class VolumeService(object):
         # Read the input volume...
         volume = IOUtils.read_volume(in_vol_path)
 
-        # Neigbors' grid sharing a face
-        eye3 = numpy.identity(3)
-        border_grid = numpy.c_[eye3, -eye3].T.astype('i')
-        n_border = 6
-
         out_volume = Volume(numpy.array(volume.data),
                             volume.affine_matrix, volume.header)
 
+        # Voxels with at least one neighbor sharing a face, inside the image, of a different label
+        surface_voxels = self._get_surface_voxels(volume.data)
+
         # Initialize output indexes
-        out_ijk = []
+        out_ijk = [numpy.zeros((0, 3), dtype=numpy.intp)]
 
+        volume_label_index = volume.get_label_index()
         for label_index in range(number_of_labels):
-            current_label = labels[label_index]
-            # Get the indexes of all voxels of this label:
-            label_volxels_i, label_voxels_j, label_voxels_k = numpy.where(
-                volume.data == current_label)
-            # and for each voxel
-            for voxel_index in range(label_volxels_i.size):
-                # indexes of this voxel:
-                current_voxel_i, current_voxel_j, current_voxel_k = \
-                    label_volxels_i[voxel_index], label_voxels_j[
-                        voxel_index], label_voxels_k[voxel_index]
-                # Create the neighbors' grid sharing a face
-                ijk_grid = border_grid + \
-                           numpy.tile(numpy.array(
-                               [current_voxel_i, current_voxel_j, current_voxel_k]), (n_border, 1))
-                # Remove voxels outside the image
-                indices_inside_image = numpy.all([(ijk_grid[:, 0] >= 0), (ijk_grid[:, 0] < volume.dimensions[0]),
-                                                  (ijk_grid[:, 1] >= 0), (ijk_grid[
-                                                                          :, 1] < volume.dimensions[1]),
-                                                  (ijk_grid[:, 2] >= 0), (ijk_grid[:, 2] < volume.dimensions[2])],
-                                                 axis=0)
-                ijk_grid = ijk_grid[indices_inside_image, :]
-                try:
-                    # If all face neighbors are of the same label...
-                    if numpy.all(volume.data[ijk_grid[:, 0], ijk_grid[:, 1], ijk_grid[:, 2]] == numpy.tile(
-                            volume.data[current_voxel_i,
-                                        current_voxel_j, current_voxel_k],
-                            (n_border, 1))):
-                        # ...set this voxel to the corresponding inner target label
-                        out_volume.data[current_voxel_i, current_voxel_j,
-                                        current_voxel_k] = labels_inner[label_index]
-                    else:
-                        # ...set this voxel to the corresponding surface target label
-                        out_volume.data[current_voxel_i, current_voxel_j,
-                                        current_voxel_k] = labels_surf[label_index]
-                        out_ijk.append(
-                            [current_voxel_i, current_voxel_j, current_voxel_k])
-                except ValueError:  # empty grid
-                    self.logger.error("Error at voxel ( %s, %s, %s ) of label %s: It appears to have no common-face "
-                                      "neighbors inside the image!", str(
-                        current_voxel_i), str(current_voxel_j),
-                                      str(current_voxel_k), str(current_label))
-                    return
+            # Get the flat indexes of all voxels of this label:
+            label_voxels = volume_label_index.get_flat_indices(labels[label_index])
+            label_surface_voxels = surface_voxels.flat[label_voxels]
+            # ...set the inner voxels to the corresponding inner target label
+            out_volume.data.flat[label_voxels[~label_surface_voxels]] = labels_inner[label_index]
+            # ...and the surface voxels to the corresponding surface target label
+            label_voxels = label_voxels[label_surface_voxels]
+            out_volume.data.flat[label_voxels] = labels_surf[label_index]
+            out_ijk.append(numpy.c_[numpy.unravel_index(label_voxels, volume.data.shape)])
 
         if out_vol_path is None:
             out_vol_path = in_vol_path
@@ -229,6 +207,22 @@ class VolumeService(object):
         numpy.save(filepath + "-idx.npy", out_ijk)
         numpy.savetxt(filepath + "-idx.txt", out_ijk, fmt='%d')
 
+    @staticmethod
+    def _get_surface_voxels(data: numpy.ndarray) -> numpy.ndarray:
+        """
+        :return: boolean mask of the voxels that differ from at least one of their (up to 6) face neighbors
+                 inside the image
+        """
+        # Edge padding makes the neighbors outside the image equal to the voxel itself, so that they are ignored
+        padded_data = numpy.pad(data, 1, mode='edge')
+        surface_voxels = numpy.zeros(data.shape, dtype='bool')
+        for axis in range(data.ndim):
+            for shift in (-1, 1):
+                neighbors = [slice(1, -1)] * data.ndim
+                neighbors[axis] = slice(1 + shift, padded_data.shape[axis] - 1 + shift)
+                surface_voxels |= padded_data[tuple(neighbors)] != data
+        return surface_voxels
+
     def mask_to_vol(self, in_vol_path: os.PathLike, mask_vol_path: os.PathLike,
                     out_vol_path: Optional[os.PathLike]=None, labels: Optional[Union[numpy.ndarray, list]]=None,
                     ctx: Optional[str]=None, vol2mask_path: Optional[os.PathLike]=None, vn: int=1, th: float=0.999,
@@ -292,92 +286,36 @@ class VolumeService(object):
             ijk2ijk = volume.affine_matrix.dot(
                 numpy.dot(xyz2xyz, numpy.linalg.inv(mask_vol.affine_matrix)))
 
-        # Construct a grid template of voxels +/- vn voxels around each ijk
-        # voxel, sharing at least a corner
-        grid = numpy.meshgrid(list(range(-vn, vn + 1, 1)), list(
-            range(-vn, vn + 1, 1)), list(range(-vn, vn + 1, 1)), indexing='ij')
-        grid = numpy.c_[numpy.array(grid[0]).flatten(), numpy.array(
-            grid[1]).flatten(), numpy.array(grid[2]).flatten()]
-        n_grid = grid.shape[0]
+        # Mask voxels to keep: the ones above threshold, or, as long as vn>0, the ones having any voxel not below
+        # threshold among their +/- vn voxels' neighbors (sharing at least a corner) inside the mask volume
+        mask_data = mask_vol.data
+        if vn > 0:
+            keep_mask = scipy.ndimage.maximum_filter(~(mask_data < th), size=2 * vn + 1, mode='constant', cval=False)
+        else:
+            keep_mask = mask_data >= th
 
         out_volume = Volume(numpy.array(volume.data),
                             volume.affine_matrix, volume.header)
 
-        # Initialize output indexes
-        out_ijk = []
-
-        # For each target label:
-        for label_index in range(number_of_labels):
-            current_label = labels[label_index]
-            # Get the indexes of all voxels of this label:
-            label_voxels_i, label_voxels_j, label_voxels_k = numpy.where(
-                volume.data == current_label)
-
-            for voxel_index in range(label_voxels_i.size):
-                current_voxel_i, current_voxel_j, current_voxel_k = \
-                    label_voxels_i[voxel_index], label_voxels_j[
-                        voxel_index], label_voxels_k[voxel_index]
-                # TODO if necessary: deal with voxels at the edge of the image, such as brain stem ones...
-                #     if any([(i==0), (i==mask_shape[0]-1),(j==0), (j==mask_shape[0]-1),(k==0), (k==mask_shape[0]-1)]):
-                #               mask_shape[i,j,k]=0
-                #               continue
-
-                # ...get the corresponding voxel in the mask volume:
-                ijk = numpy.round(ijk2ijk.dot(numpy.array(
-                    [current_voxel_i, current_voxel_j, current_voxel_k, 1]))[:3]).astype('i')
-
-                # Make sure this point is within image limits
-                for cc in range(3):
-                    if ijk[cc] < 0:
-                        ijk[cc] = 0
-
-                    elif ijk[cc] >= mask_vol.dimensions[cc]:
-                        ijk[cc] = mask_vol.dimensions[cc] - 1
-
-                # If this is a voxel to keep, set it so...
-                if mask_vol.data[ijk[0], ijk[1], ijk[2]] >= th:
-                    out_volume.data[current_voxel_i, current_voxel_j,
-                                    current_voxel_k] = labels_mask[label_index]
-                    out_ijk.append(
-                        [current_voxel_i, current_voxel_j, current_voxel_k])
-
-                elif vn > 0:
-                    # If not, and as long as vn>0 check whether any of its vn neighbors is a mask voxel.
-                    # Generate the specific grid centered at the vertex ijk
-                    ijk_grid = grid + numpy.tile(ijk, (n_grid, 1))
-
-                    # Remove voxels outside the mask volume
-                    indexes_within_limits = numpy.all([(ijk_grid[:, 0] >= 0), (ijk_grid[:, 0] < mask_vol.dimensions[0]),
-                                                       (ijk_grid[:, 1] >= 0), (ijk_grid[
-                                                                               :, 1] < mask_vol.dimensions[1]),
-                                                       (ijk_grid[:, 2] >= 0),
-                                                       (ijk_grid[:, 2] < mask_vol.dimensions[2])],
-                                                      axis=0)
-                    ijk_grid = ijk_grid[indexes_within_limits, :]
-
-                    try:
-                        # If none of these points is a mask point:
-                        if (mask_vol.data[ijk_grid[:, 0], ijk_grid[
-                                                          :, 1], ijk_grid[:, 2]] < th).all():
-                            out_volume.data[
-                                current_voxel_i, current_voxel_j, current_voxel_k] = labels_nomask[label_index]
-
-                        else:  # if any of them is a mask point:
-                            out_volume.data[
-                                current_voxel_i, current_voxel_j, current_voxel_k] = labels_mask[label_index]
-                            out_ijk.append(
-                                [current_voxel_i, current_voxel_j, current_voxel_k])
-
-                    except ValueError:  # empty grid
-                        self.logger.error("Error at voxel ( %s, %s, %s ): It appears to have no common-face neighbors "
-                                          "inside the image!", str(
-                            current_voxel_i), str(current_voxel_j),
-                                          str(current_voxel_k))
-                        return
-
-                else:
-                    out_volume.data[current_voxel_i, current_voxel_j,
-                                    current_voxel_k] = labels_nomask[label_index]
+        volume_label_index = volume.get_label_index()
+        # Get the flat indexes of all voxels of the target labels, label by label,
+        label_positions = volume_label_index.get_label_positions(labels)
+        label_voxels = volume_label_index.get_labels_flat_indices(labels)
+        # ...and the target label of each one of them
+        voxels_labels = numpy.repeat(numpy.arange(number_of_labels),
+                                     numpy.where(label_positions >= 0, volume_label_index.counts[label_positions], 0))
+        label_ijk = numpy.c_[numpy.unravel_index(label_voxels, volume.data.shape)].reshape((-1, 3))
+
+        # TODO if necessary: deal with voxels at the edge of the image, such as brain stem ones...
+        # ...get the corresponding voxels in the mask volume, within image limits
+        mask_ijk = numpy.round(numpy.c_[label_ijk, numpy.ones(label_ijk.shape[0])].dot(ijk2ijk.T)[:, :3]).astype('i')
+        mask_ijk = mask_ijk.clip(0, numpy.array(mask_data.shape[:3]) - 1)
+        keep_voxels = keep_mask[mask_ijk[:, 0], mask_ijk[:, 1], mask_ijk[:, 2]]
+
+        # Set the voxels to keep and the excluded ones to their corresponding labels
+        out_volume.data.flat[label_voxels] = numpy.where(keep_voxels, numpy.array(labels_mask)[voxels_labels],
+                                                         numpy.array(labels_nomask)[voxels_labels])
+        out_ijk = label_ijk[keep_voxels]
 
         if out_vol_path is None:
             out_vol_path = in_vol_path
@@ -385,7 +323,6 @@ class VolumeService(object):
         IOUtils.write_volume(out_vol_path, out_volume)
 
         # Save the output indexes that survived masking
-        out_ijk = numpy.vstack(out_ijk)
         filepath = os.path.splitext(out_vol_path)[0]
         numpy.save(filepath + "-idx.npy", out_ijk)
         numpy.savetxt(filepath + "-idx.txt", out_ijk, fmt='%d')
@@ -396,18 +333,18 @@ class VolumeService(object):
         return xyz
 
     def compute_label_volume_centers(self, label_volume: numpy.ndarray, affine: numpy.ndarray):
-
-        for val in numpy.unique(label_volume):
-            xyz = self.vol_val_xyz(label_volume, affine, val)
-            x, y, z = xyz.mean(axis=0)
+        label_index = LabelIndex(label_volume)
+        for val, (x, y, z) in zip(label_index.labels, label_index.get_centroids(affine)):
             yield val, (x, y, z)
 
     def label_with_dilation(self, to_label_nii_fname: os.PathLike, dilated_nii_fname: os.PathLike,
-                            out_nii_fname: os.PathLike):
+                            out_nii_fname: os.PathLike, min_size: int=0):
         """
         Labels a volume using its labeled dilation. The dilated volume is labeled using scipy.ndimage.label function.
+        The objects are labeled 1..n in the order of their centers along the AP axis.
         :param to_label_nii_fname: usually a CT-mask.nii.gz
         :param dilated_nii_fname: dilated version of the to_label_nii_fname volume
+        :param min_size: objects of the dilated volume with less voxels than this are removed
         """
 
         # TODO could make dilation with ndimage also.
@@ -416,17 +353,25 @@ class VolumeService(object):
 
         lab, n = scipy.ndimage.label(dil_mask.data)
 
-        # TODO: this change is from tvb-make. Keep it or not? It returns a different result than the old version.
-        lab_xyz = list(self.compute_label_volume_centers(lab, dil_mask.affine_matrix))
-        lab_sort = numpy.r_[:n + 1]
-        # sort labels along AP axis
-        for i, (val, _) in enumerate(sorted(lab_xyz, key=lambda t: t[1][1])):
-            lab_sort[val] = i
+        # AP (world y) coordinate of the center of every object, in a single pass over the (labeled) foreground voxels
+        foreground_voxels = numpy.flatnonzero(lab)
+        foreground_labels = lab.flat[foreground_voxels]
+        foreground_y = numpy.dot(dil_mask.affine_matrix[1, :3],
+                                 numpy.unravel_index(foreground_voxels, lab.shape)) + dil_mask.affine_matrix[1, 3]
+        sizes = numpy.bincount(foreground_labels, minlength=n + 1)
+        labels_y = numpy.bincount(foreground_labels, weights=foreground_y, minlength=n + 1) / numpy.maximum(sizes, 1)
+
+        # sort the (large enough) objects along AP axis, and relabel them 1..n, with a single lookup
+        labels_to_keep, = numpy.where(sizes[1:] >= max(min_size, 1))
+        labels_to_keep += 1
+        labels_to_keep = labels_to_keep[numpy.argsort(labels_y[labels_to_keep], kind='stable')]
+        lab_sort = numpy.zeros((n + 1,), dtype=lab.dtype)
+        lab_sort[labels_to_keep] = numpy.r_[1:labels_to_keep.size + 1]
         lab = lab_sort[lab]
 
         mask.data *= lab
         self.logger.info(
-            '%d objects found when labeling the dilated volume.', n)
+            '%d objects found when labeling the dilated volume, %d of them kept.', n, labels_to_keep.size)
 
         IOUtils.write_volume(out_nii_fname, mask)
 
@@ -468,88 +413,171 @@ class VolumeService(object):
         IOUtils.write_volume(out_volume_path, tdi_volume)
 
     def remove_zero_connectivity_nodes(self, node_volume_path: os.PathLike, connectivity_matrix_path: os.PathLike,
-                                       tract_length_path: Optional[str]=None):
+                                       tract_length_path: Optional[str]=None, binary_only: bool=False,
+                                       sparse: bool=False):
         """
         It removes network nodes with zero connectivity from the volume and connectivity matrices.
         The zero connectivity nodes will be labeled with 0 in the volume and the remaining labels will be updated.
         The connectivity matrices will be symmetric.
         :param node_volume_path: tdi_lbl.nii volume path
-        :param connectivity_matrix_path: .csv file, output of Mrtrix3 tck2connectome
-        :param tract_length_path: optional .csv tract lengths matrix
-        :return: overwrites the input volume and matrices with the processed ones. Also saves matrices as .npy.
+        :param connectivity_matrix_path: .csv file, output of Mrtrix3 tck2connectome, or its .npy/.npz binary copy
+        :param tract_length_path: optional .csv tract lengths matrix, or its .npy/.npz binary copy
+        :param binary_only: if True, only the binary copies of the matrices are written, and the text files are NOT,
+                            i.e., any text matrices are left unchanged, untrimmed, and out of sync with the volume
+        :param sparse: if True, the matrices are processed as sparse matrices and saved as .npz
+        :return: overwrites the input volume and matrices with the processed ones. Also saves matrices as .npy/.npz.
+                 With binary_only, only the .npy/.npz copies of the matrices hold the processed ones.
         """
 
         node_volume = IOUtils.read_volume(node_volume_path)
 
-        connectivity = numpy.array(numpy.genfromtxt(
-            connectivity_matrix_path, dtype='int64'))
+        connectivity = self.generic_io.read_connectivity_matrix(connectivity_matrix_path, sparse=sparse)
         connectivity = connectivity + connectivity.T
-        connectivity_row_sum = numpy.sum(connectivity, axis=0)
+        connectivity_row_sum = numpy.asarray(connectivity.sum(axis=0)).ravel()
 
         nodes_to_keep_indices = connectivity_row_sum > 0
         connectivity = connectivity[nodes_to_keep_indices, :][
                        :, nodes_to_keep_indices]
 
-        numpy.save(os.path.splitext(connectivity_matrix_path)
-                   [0] + NPY_EXTENSION, connectivity)
-        numpy.savetxt(connectivity_matrix_path, connectivity, fmt='%1d')
+        self._write_trimmed_connectivity_matrix(connectivity_matrix_path, connectivity, binary_only)
 
         if os.path.exists(str(tract_length_path)):
-            connectivity = numpy.array(numpy.genfromtxt(
-                tract_length_path, dtype='int64'))
-            connectivity = connectivity[nodes_to_keep_indices, :][
-                           :, nodes_to_keep_indices]
+            tract_lengths = self.generic_io.read_connectivity_matrix(tract_length_path, sparse=sparse)
+            tract_lengths = tract_lengths[nodes_to_keep_indices, :][
+                            :, nodes_to_keep_indices]
 
-            numpy.save(os.path.splitext(tract_length_path)
-                       [0] + NPY_EXTENSION, connectivity)
-            numpy.savetxt(tract_length_path, connectivity, fmt='%1d')
+            self._write_trimmed_connectivity_matrix(tract_length_path, tract_lengths, binary_only)
 
         else:
             self.logger.warning("Path %s is not valid.", tract_length_path)
 
-        nodes_to_remove_indices, = numpy.where(~nodes_to_keep_indices)
-        nodes_to_remove_indices += 1
-
-        for node_index in nodes_to_remove_indices:
-            node_volume.data[node_volume.data == node_index] = 0
-
-        node_volume.data[node_volume.data > 0] = numpy.r_[
-                                                 1:(connectivity.shape[0] + 1)]
+        # Map the old node labels 1..n to the new ones, i.e., the removed nodes to 0,
+        # and the kept ones to 1..connectivity.shape[0], in the same order
+        new_node_labels = numpy.r_[0, numpy.where(nodes_to_keep_indices, numpy.cumsum(nodes_to_keep_indices), 0)]
+        volume_label_index = node_volume.get_label_index()
+        old_labels = volume_label_index.labels
+        valid_labels = (old_labels >= 0) & (old_labels < new_node_labels.size) & (numpy.mod(old_labels, 1) == 0)
+        if not numpy.all(valid_labels):
+            self.logger.warning("Volume labels %s are not connectivity nodes, they will be labeled with 0.",
+                                old_labels[~valid_labels])
+        node_volume.data = volume_label_index.paint(
+            numpy.where(valid_labels, new_node_labels[numpy.where(valid_labels, old_labels, 0).astype('i')], 0),
+            dtype=node_volume.data.dtype)
 
         IOUtils.write_volume(node_volume_path, node_volume)
 
-    def con_vox_in_ras(self, ref_vol_path: os.PathLike) -> (numpy.ndarray, numpy.ndarray):
+    def _write_trimmed_connectivity_matrix(self, matrix_path: os.PathLike, matrix, binary_only: bool):
+        self.generic_io.write_connectivity_matrix(matrix_path, matrix, binary_only)
+        if binary_only and os.path.splitext(str(matrix_path))[1] not in (NPY_EXTENSION, NPZ_EXTENSION):
+            self.logger.warning("The text matrix %s is left untrimmed, only its binary copy is processed.",
+                                matrix_path)
+
+    def con_vox_in_ras(self, ref_vol_path: os.PathLike, compact: bool=False, cache_dir: Optional[os.PathLike]=None,
+                       slab_size: int=16) -> (numpy.ndarray, numpy.ndarray):
         """
         This function reads a tdi_lbl volume and returns the voxels that correspond to connectome nodes,
         and their coordinates in ras space, simply by applying the affine transform of the volume
         :param ref_vol_path: the path to the tdi_lbl volume
+        :param compact: if True, the volume is read lazily, slab_size slices at a time, and the coordinates are float32
+        :param cache_dir: optional directory (e.g. of the run's outputs or temporary files) to cache the result to,
+                          as <volume file name>.con_vox[.compact].npz, and read it from, as long as the volume file
+                          (path and modification time) does not change. By default, nothing is cached.
         :return: vox and voxxyz,
                 i.e., the labels (integers>=1) and the coordinates of the connnectome nodes-voxels, respectively
         """
-        # Read the reference tdi_lbl volume:
-        vollbl = IOUtils.read_volume(ref_vol_path)
-        vox = vollbl.data.astype('i')
-        # Get only the voxels that correspond to connectome nodes:
-        voxijk, = numpy.where(vox.flatten() > 0)
-        voxijk = numpy.unravel_index(voxijk, vollbl.dimensions)
-        vox = vox[voxijk[0], voxijk[1], voxijk[2]]
-        # ...and their coordinates in ras xyz space
-        voxxzy = vollbl.affine_matrix.dot(numpy.c_[voxijk[0], voxijk[1], voxijk[
-            2], numpy.ones(vox.shape[0])].T)[:3].T
+        if cache_dir is not None:
+            cache_path = self._get_con_vox_cache_path(ref_vol_path, compact, cache_dir)
+            cache_key = self._get_con_vox_cache_key(ref_vol_path)
+            if os.path.isfile(cache_path):
+                with numpy.load(cache_path) as cache:
+                    if str(cache["key"]) == cache_key:
+                        self.logger.info("Reading connectome nodes-voxels from cache %s", cache_path)
+                        return cache["vox"], cache["voxxyz"]
+                self.logger.info("Replacing the stale cache %s", cache_path)
+
+        if compact:
+            vox, voxxzy = self._compact_con_vox_in_ras(ref_vol_path, slab_size)
+        else:
+            # Read the reference tdi_lbl volume:
+            vollbl = IOUtils.read_volume(ref_vol_path)
+            vox = vollbl.data.astype('i')
+            # Get only the voxels that correspond to connectome nodes:
+            voxijk, = numpy.where(vox.flatten() > 0)
+            voxijk = numpy.unravel_index(voxijk, vollbl.dimensions)
+            vox = vox[voxijk[0], voxijk[1], voxijk[2]]
+            # ...and their coordinates in ras xyz space
+            voxxzy = vollbl.affine_matrix.dot(numpy.c_[voxijk[0], voxijk[1], voxijk[
+                2], numpy.ones(vox.shape[0])].T)[:3].T
+
+        if cache_dir is not None:
+            numpy.savez(cache_path, vox=vox, voxxyz=voxxzy, key=cache_key)
         return vox, voxxzy
 
+    def _compact_con_vox_in_ras(self, ref_vol_path: os.PathLike, slab_size: int) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Read the connectome nodes-voxels slab by slab. Uncompressed volumes are read from disk one slab at a time,
+        whereas compressed (.gz) ones can only be read sequentially, so they are fully loaded once, with their native
+        dtype, and then sliced into slabs.
+        """
+        vollbl = IOUtils.read_volume(ref_vol_path, lazy=True)
+        if str(ref_vol_path).endswith(".gz"):
+            data = vollbl.data
+            get_slab = data.__getitem__
+        else:
+            get_slab = vollbl.get_slab
+        affine = numpy.array(vollbl.affine_matrix)
+        vox = []
+        voxijk = []
+        # Slabs along the last axis are contiguous on disk (NIfTI data are stored in Fortran order)
+        for k_start in range(0, vollbl.dimensions[2], slab_size):
+            slab = get_slab((slice(None), slice(None), slice(k_start, k_start + slab_size)))
+            slab_voxijk = numpy.nonzero(slab > 0)
+            slab_vox = slab[slab_voxijk].astype('i')
+            # keep only the voxels of integer labels >= 1, as casting the whole volume to integers does
+            slab_voxijk = numpy.array(slab_voxijk, dtype='i')[:, slab_vox > 0]
+            slab_voxijk[2] += k_start
+            vox.append(slab_vox[slab_vox > 0])
+            voxijk.append(slab_voxijk)
+        vox = numpy.concatenate(vox)
+        voxijk = numpy.concatenate(voxijk, axis=1)
+        # Sort the voxels in the (C) order of the whole volume
+        c_order = numpy.lexsort(voxijk[::-1])
+        vox = vox[c_order]
+        voxijk = voxijk[:, c_order]
+        return vox, (affine[:3, :3].dot(voxijk).T + affine[:3, 3]).astype(numpy.float32)
+
+    @staticmethod
+    def _get_con_vox_cache_path(ref_vol_path: os.PathLike, compact: bool, cache_dir: os.PathLike) -> str:
+        return os.path.join(cache_dir, "%s.con_vox%s%s" % (os.path.basename(ref_vol_path), ".compact" if compact else "",
+                                                           NPZ_EXTENSION))
+
+    @staticmethod
+    def _get_con_vox_cache_key(ref_vol_path: os.PathLike) -> str:
+        ref_vol_path = os.path.abspath(ref_vol_path)
+        return "%s %d" % (ref_vol_path, os.stat(ref_vol_path).st_mtime_ns)
+
     def change_labels_of_aparc_aseg(self, atlas_suffix, volume, mapping_dict, conn_regs_nr):
+        """
+        Relabel an aparc+aseg volume with mapping_dict, from the distinct labels of the volume to their new labels.
+        Labels not in mapping_dict are reported and set to -1 (background).
+        The relabeled data are stored with the smallest integer dtype holding the new labels.
+        """
+        volume_label_index = volume.get_label_index()
+        labels = volume_label_index.labels.copy()
         if atlas_suffix == AtlasSuffix.A2009S:
-            volume.data[volume.data == 1000] = 11100
-            volume.data[volume.data == 2000] = 12100
-        not_matched = set()
-        for i in range(volume.data.shape[0]):
-            for j in range(volume.data.shape[1]):
-                for k in range(volume.data.shape[2]):
-                    val = volume.data[i][j][k]
-                    if not val in mapping_dict:
-                        not_matched.add(val)
-                    volume.data[i][j][k] = mapping_dict.get(val, -1)
+            labels[labels == 1000] = 11100
+            labels[labels == 2000] = 12100
+        not_matched = set(label for label in labels if label not in mapping_dict)
+        new_labels = numpy.array([mapping_dict.get(label, -1) for label in labels], dtype='i')
+        if new_labels.size > 0:
+            # (the signed type of the maximum label is the one of its negation - 1, e.g. int8 for 127)
+            dtype = numpy.result_type(numpy.min_scalar_type(min(int(new_labels.min()), -1)),
+                                      numpy.min_scalar_type(-int(new_labels.max()) - 1))
+        else:
+            dtype = numpy.int8
+        volume.data = volume_label_index.paint(new_labels, dtype=dtype)
+        if volume.header is not None:
+            volume.header.set_data_dtype(dtype)
 
         print("Now values are in interval [%d - %d]" % (volume.data.min(), volume.data.max()))
 
@@ -562,22 +590,69 @@ class VolumeService(object):
     def transform_coords(self, coords: Union[list, numpy.ndarray, str], src_img: os.PathLike, dest_img: os.PathLike,
                   transform_mat: os.PathLike, output_file: Optional[str]=None) \
             -> (numpy.array, Union[numpy.ndarray, type(None)]):
+        """
+        Transform world (mm) coordinates of src_img to the ones of dest_img, with a FLIRT transform matrix,
+        as "img2imgcoord -mm" of FSL does, but for all points with a single matrix product.
+        Relative src_img, dest_img and output_file paths are resolved against the directory of transform_mat,
+        where img2imgcoord used to be run.
+        :param coords: coordinates array (3, ) or (number of points x 3), or a file to read them from
+        :param transform_mat: the FLIRT (4 x 4) matrix text file, from the src_img to the dest_img
+        :param output_file: optional file to write the transformed coordinates to, in the img2imgcoord output format
+        :return: the transformed coordinates, of the shape of the input ones, or (number of points x 3) if read from a
+                 file, and the (resolved) output_file
+        """
 
-        if os.path.isfile(coords):
-            command = "img2imgcoord %s -mm -src %s -dest %s -xfm %s"
-            args = [coords, src_img, dest_img, transform_mat]
-        else:
-            coords_str = " ".join([str(x) for x in coords])
-            command = "echo %s | img2imgcoord -mm -src %s -dest %s -xfm %s"
-            args = [coords_str, src_img, dest_img, transform_mat]
-
-        if os.path.isdir(os.path.dirname(output_file)):
-            command += " > %s"
-            args.append(output_file)
-
-        output, std_out, time = \
-            execute_command(command % tuple(args), cwd=os.path.dirname(transform_mat), shell=True)
-
-        transformed_coords_str = output.strip().split('\n')[-1]
+        if isinstance(coords, (str, os.PathLike)) and os.path.isfile(coords):
+            # img2imgcoord reads the coordinates as a stream of triplets of numbers
+            with open(coords) as coords_file:
+                coords = numpy.array(coords_file.read().split(), dtype=float).reshape((-1, 3))
+        coords = numpy.asarray(coords, dtype=float)
+
+        transform_dir = os.path.dirname(os.path.abspath(transform_mat))
+        src_img = os.path.join(transform_dir, src_img)
+        dest_img = os.path.join(transform_dir, dest_img)
+        world2world = self._get_fsl_world_transform(src_img, dest_img, numpy.loadtxt(transform_mat))
+        transformed_coords = coords.dot(world2world[:3, :3].T) + world2world[:3, 3]
+
+        if output_file is not None:
+            output_file = os.path.join(transform_dir, output_file)
+        if output_file is not None and os.path.isdir(os.path.dirname(output_file)):
+            with open(output_file, "w") as out_file:
+                out_file.write("Coordinates in Destination volume (in mm):\n")
+                for x, y, z in transformed_coords.reshape((-1, 3)):
+                    out_file.write("%g  %g  %g  \n" % (x, y, z))
+
+        return transformed_coords, output_file
+
+    def _get_fsl_world_transform(self, src_img: os.PathLike, dest_img: os.PathLike,
+                                 flirt_mat: numpy.ndarray) -> numpy.ndarray:
+        """
+        :return: the (4 x 4) world to world transform of a FLIRT matrix, which maps FSL scaled voxel coordinates
+        """
+        src_world, src_scaled_voxels = self._get_fsl_affines(src_img)
+        dest_world, dest_scaled_voxels = self._get_fsl_affines(dest_img)
+        return numpy.linalg.multi_dot([dest_world, numpy.linalg.inv(dest_scaled_voxels), flirt_mat, src_scaled_voxels,
+                                       numpy.linalg.inv(src_world)])
 
-        return numpy.array([float(x) for x in transformed_coords_str.split(" ") if x]), output_file
+    def _get_fsl_affines(self, img_path: os.PathLike) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Read (only the header of) a NIfTI image, to get its voxel to world and its voxel to FSL scaled voxel affines.
+        Like FSL, the world affine is the sform, or the qform if there is no sform, or else the scaled voxel affine.
+        FSL scaled voxels are voxel indices times voxel sizes, with the x axis flipped for neurological images
+        (positive world affine determinant).
+        """
+        header = nibabel.load(img_path).header
+        world, world_code = header.get_sform(coded=True)
+        if not world_code:
+            world, world_code = header.get_qform(coded=True)
+
+        scaled_voxels = numpy.diag(list(header.get_zooms()[:3]) + [1.0])
+        if world_code and numpy.linalg.det(world[:3, :3]) > 0:
+            flip_x = numpy.identity(4)
+            flip_x[0, 0] = -1
+            flip_x[0, 3] = header.get_data_shape()[0] - 1
+            scaled_voxels = scaled_voxels.dot(flip_x)
+
+        if not world_code:
+            world = scaled_voxels
+        return world, scaled_voxels
@@ -30,9 +30,9 @@ class IOUtils(object):
                 return FreesurferIO()
 
     @staticmethod
-    def read_surface(surface_path, use_center_surface):
+    def read_surface(surface_path, use_center_surface, compact=False):
         surface_io = IOUtils.surface_io_factory(surface_path)
-        return surface_io.read(surface_path, use_center_surface)
+        return surface_io.read(surface_path, use_center_surface, compact=compact)
 
     @staticmethod
     def write_surface(out_surface_path, surface):
@@ -49,9 +49,9 @@ class IOUtils(object):
             return VolumeIO()
 
     @staticmethod
-    def read_volume(volume_path):
+    def read_volume(volume_path, lazy=False):
         volume_io = IOUtils.volume_io_factory(volume_path)
-        return volume_io.read(volume_path)
+        return volume_io.read(volume_path, lazy=lazy)
 
     @staticmethod
     def write_volume(out_volume_path, volume):
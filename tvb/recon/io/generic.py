@@ -4,8 +4,9 @@ import os
 import tempfile
 from zipfile import ZipFile
 import numpy
+from scipy.sparse import csr_matrix, issparse, load_npz, save_npz
 from tvb.recon.dax.mappings import OutputConvFiles
-from tvb.recon.model.constants import CC_POINT_FILE
+from tvb.recon.model.constants import CC_POINT_FILE, NPY_EXTENSION, NPZ_EXTENSION
 
 try:
     from io import StringIO
@@ -85,6 +86,37 @@ class GenericIO(object):
             for val in list:
                 f.write("%s\n" % val)
 
+    def read_connectivity_matrix(self, matrix_path, dtype='int64', sparse=False):
+        """
+        Read a connectivity matrix (e.g. of tck2connectome) from a whitespace delimited text file,
+        or straight from its binary .npy (dense) or .npz (sparse) copy.
+        :return: numpy.ndarray, or scipy.sparse.csr_matrix if sparse
+        """
+        extension = os.path.splitext(str(matrix_path))[1]
+        if extension == NPZ_EXTENSION:
+            matrix = load_npz(matrix_path).astype(dtype)
+        elif extension == NPY_EXTENSION:
+            matrix = numpy.load(matrix_path).astype(dtype, copy=False)
+        else:
+            # parsing as float (and then casting) also accepts non integer text values
+            matrix = numpy.loadtxt(matrix_path, ndmin=2).astype(dtype)
+        if sparse:
+            return csr_matrix(matrix)
+        return matrix.toarray() if issparse(matrix) else matrix
+
+    def write_connectivity_matrix(self, matrix_path, matrix, binary_only=False, fmt='%1d'):
+        """
+        Write a connectivity matrix to its binary copy, with the same name as matrix_path, and .npz extension
+        if the matrix is sparse, or .npy otherwise. Unless binary_only, also (over)write matrix_path as text.
+        """
+        binary_path = os.path.splitext(str(matrix_path))[0]
+        if issparse(matrix):
+            save_npz(binary_path + NPZ_EXTENSION, matrix.tocsr())
+        else:
+            numpy.save(binary_path + NPY_EXTENSION, matrix)
+        if not binary_only:
+            numpy.savetxt(matrix_path, matrix.toarray() if issparse(matrix) else matrix, fmt=fmt)
+
     def read_field_from_zip(self, field, zip, cols=[0, 1, 2], dtype="f"):
         with ZipFile(zip, "r") as f_zip:
             extracted_field = f_zip.extract(field)
@@ -21,7 +21,7 @@ class ABCSurfaceIO(object):
     This will define the behaviour needed for a surface io.
     """
 
-    def read(self, data_file, use_center_surface):
+    def read(self, data_file, use_center_surface, compact=False):
         raise NotImplementedError()
 
     def write(self, surface_obj, file_path):
@@ -46,7 +46,7 @@ class GiftiSurfaceIO(ABCSurfaceIO):
     """
     logger = get_logger(__name__)
 
-    def read(self, data_file, use_center_surface):
+    def read(self, data_file, use_center_surface, compact=False):
         gifti_image = giftiio.read(data_file)
         image_metadata = gifti_image.meta.metadata
         self.logger.info(
@@ -80,7 +80,7 @@ class GiftiSurfaceIO(ABCSurfaceIO):
         return Surface(vertices, triangles, area_mask=None,
                        center_ras=vol_geom_center_ras, vertices_coord_system=vertices_coord_system,
                        generic_metadata=image_metadata, vertices_metadata=vertices_metadata,
-                       triangles_metadata=triangles_metadata)
+                       triangles_metadata=triangles_metadata, compact=compact)
 
     def write(self, surface_obj, file_path):
         image_metadata = GiftiMetaData().from_dict(surface_obj.generic_metadata)
@@ -138,7 +138,7 @@ class FreesurferIO(ABCSurfaceIO):
     """
     logger = get_logger(__name__)
 
-    def read(self, surface_path, use_center_surface):
+    def read(self, surface_path, use_center_surface, compact=False):
         vertices, triangles, metadata = read_geometry(
             surface_path, read_metadata=True)
         self.logger.info(
@@ -159,7 +159,7 @@ class FreesurferIO(ABCSurfaceIO):
                                     "The cras will be %s", surface_path, cras)
 
         return Surface(vertices, triangles, area_mask=None,
-                       center_ras=cras, generic_metadata=metadata)
+                       center_ras=cras, generic_metadata=metadata, compact=compact)
 
     def write(self, surface, surface_path):
         write_geometry(filepath=surface_path, coords=surface.vertices, faces=surface.triangles,
@@ -208,12 +208,12 @@ class H5SurfaceIO(ABCSurfaceIO):
     """
     logger = get_logger(__name__)
 
-    def read(self, h5_path, use_center_surface=False):
+    def read(self, h5_path, use_center_surface=False, compact=False):
         h5_file = h5py.File(h5_path, 'r', libver='latest')
         vertices = h5_file['/vertices'][()]
         triangles = h5_file['/triangles'][()]
         h5_file.close()
-        return Surface(vertices, triangles)
+        return Surface(vertices, triangles, compact=compact)
 
 
 class ZipSurfaceIO(ABCSurfaceIO):
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import nibabel
+import numpy
 import h5py
 from tvb.recon.logger import get_logger
 from tvb.recon.model.volume import Volume
@@ -11,7 +12,7 @@ class ABCVolumeIO(object):
     This will define the behaviour needed for a volume io.
     """
 
-    def read(self, volume_path):
+    def read(self, volume_path, lazy=False):
         raise NotImplementedError()
 
     def write(self, out_volume_path, volume):
@@ -25,10 +26,12 @@ class VolumeIO(ABCVolumeIO):
 
     logger = get_logger(__name__)
 
-    def read(self, volume_path):
+    def read(self, volume_path, lazy=False):
         image = nibabel.load(volume_path)
         header = image.header
-        data = image.get_data()
+        # The array proxy keeps the on-disk dtype unless the image is scaled.
+        # If lazy, it is read only when (and as much as) needed.
+        data = image.dataobj if lazy else numpy.asanyarray(image.dataobj)
         affine_matrix = image.affine
         self.logger.info("The affine matrix extracted from volume %s is %s" % (
             volume_path, affine_matrix))
@@ -48,8 +51,11 @@ class H5VolumeIO(ABCVolumeIO):
 
     logger = get_logger(__name__)
 
-    def read(self, volume_path):
+    def read(self, volume_path, lazy=False):
         h5_file = h5py.File(volume_path, 'r', libver='latest')
+        if lazy:
+            # the file stays open as long as the dataset is referenced
+            return Volume(h5_file['/data'], [], None)
         data = h5_file['/data'][()]
         h5_file.close()
         return Volume(data, [], None)
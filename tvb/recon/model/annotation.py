@@ -2,6 +2,11 @@
 
 from typing import Union, Optional
 import numpy
+from tvb.recon.model.label_index import LabelIndex
+
+FACE_COLORS_AVERAGE = "average"
+FACE_COLORS_MAJORITY = "majority"
+FACE_COLORS_FIRST = "first"
 
 
 class Annotation(object):
@@ -9,6 +14,9 @@ class Annotation(object):
     Hold annotation information as region mapping, color mapping and names of regions.
 
     Has a method to compute face colors using vertices_color_mapping .
+
+    get_region_index() groups the vertices by region once (and caches the grouping until the region mapping changes),
+    for per-region counts, means and other reductions.
     """
 
     def __init__(self, region_mapping: Union[numpy.ndarray, list], regions_color_table: numpy.ndarray,
@@ -18,6 +26,7 @@ class Annotation(object):
         else:
             # ndarray of region_names indices
             self.region_mapping = numpy.array(region_mapping)
+        self._region_index = None
         if len(regions_color_table) == 0:
             self.regions_color_table = numpy.empty((0, 5), dtype='i')
         else:
@@ -27,6 +36,7 @@ class Annotation(object):
 
     def set_region_mapping(self, new_region_mapping: numpy.ndarray):
         self.region_mapping = new_region_mapping
+        self._region_index = None
 
     def add_region_names_and_colors(self, new_region_names: list, new_region_colors: numpy.ndarray):
         self.region_names.append(new_region_names)
@@ -35,6 +45,15 @@ class Annotation(object):
 
     def add_region_mapping(self, new_region_mapping: Union[numpy.ndarray, list]):
         self.region_mapping = numpy.r_[self.region_mapping, new_region_mapping]
+        self._region_index = None
+
+    def get_region_index(self) -> LabelIndex:
+        """
+        :return: the vertices of every region, grouped in a single pass over the region mapping
+        """
+        if self._region_index is None:
+            self._region_index = LabelIndex(self.region_mapping)
+        return self._region_index
 
     # def stack_region_mapping(self):
     #     self.region_mapping = numpy.hstack(self.region_mapping)
@@ -42,17 +61,27 @@ class Annotation(object):
     def get_region_mapping_by_indices(self, indices: Union[numpy.ndarray, list]):
         return self.region_mapping[indices]
 
-    def compute_face_colors(self, triangles: numpy.ndarray) -> list:
-        face_colors = []
+    def compute_face_colors(self, triangles: numpy.ndarray, mode: str=FACE_COLORS_AVERAGE) -> numpy.ndarray:
+        """
+        Compute the rgba colors of the faces of a surface from the colors of the regions of their vertices.
+        :param triangles: array (n_triangles x 3) of vertex indices
+        :param mode: FACE_COLORS_AVERAGE for (0.33 weighted) averaging of the three vertices' colors,
+                     FACE_COLORS_MAJORITY for the color of the region of at least two vertices (else of the first one),
+                     or FACE_COLORS_FIRST for the color of the first vertex
+        :return: array (n_triangles x 4) of colors in [0, 1]
+        """
         converted_colors = self.regions_color_table[:, :4] / 255.0
+        triangle_regions = self.region_mapping[numpy.asarray(triangles)]
 
-        for triangle in triangles:
-            vertex1_color = converted_colors[
-                self.region_mapping[triangle[0]]] * 0.33
-            vertex2_color = converted_colors[
-                self.region_mapping[triangle[1]]] * 0.33
-            vertex3_color = converted_colors[
-                self.region_mapping[triangle[2]]] * 0.33
-            face_colors.append(vertex1_color + vertex2_color + vertex3_color)
-
-        return face_colors
+        if mode == FACE_COLORS_AVERAGE:
+            triangle_colors = converted_colors[triangle_regions]
+            return triangle_colors[:, 0] * 0.33 + triangle_colors[:, 1] * 0.33 + triangle_colors[:, 2] * 0.33
+        if mode == FACE_COLORS_MAJORITY:
+            # the first vertex's region, unless only the other two vertices share a region
+            majority = numpy.where((triangle_regions[:, 1] == triangle_regions[:, 2]) &
+                                   (triangle_regions[:, 0] != triangle_regions[:, 1]),
+                                   triangle_regions[:, 1], triangle_regions[:, 0])
+            return converted_colors[majority]
+        if mode == FACE_COLORS_FIRST:
+            return converted_colors[triangle_regions[:, 0]]
+        raise ValueError("Unknown face colors mode %s" % mode)
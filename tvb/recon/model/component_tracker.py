@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+from typing import Union, Optional
+import numpy
+from scipy.sparse import csr_matrix
+
+
+class ComponentTracker(object):
+    """
+    Track the connected components of a changing subset (the members) of the nodes of a graph, e.g. of a cluster of
+    surface vertices, under a structural connectivity among them.
+
+    It keeps a union-find (disjoint sets, with union by size and path halving) over the members, so that adding nodes
+    costs O(their number of neighbors) instead of a full connected components computation of the subset.
+    Removing whole components is as cheap, whereas removing other nodes rebuilds the sets of the remaining members.
+    """
+
+    def __init__(self, connectivity: Union[numpy.ndarray, csr_matrix],
+                 members: Optional[Union[numpy.ndarray, list]]=None):
+        """
+        :param connectivity: array or sparse matrix (n_nodes x n_nodes), where entry>0 stands for a direct connection,
+                             taken as undirected
+        :param members: optional boolean mask or indices of the initial members
+        """
+        connectivity = csr_matrix(connectivity)
+        connectivity = (connectivity + connectivity.T).tocsr()
+        self.n_nodes = connectivity.shape[0]
+        self._indptr = connectivity.indptr
+        self._indices = connectivity.indices
+        self.members = numpy.zeros((self.n_nodes,), dtype='bool')
+        self._parent = numpy.arange(self.n_nodes)
+        self._size = numpy.ones((self.n_nodes,), dtype='i')
+        self.n_components = 0
+        if members is not None:
+            self.add(members)
+
+    def _node_indices(self, nodes: Union[numpy.ndarray, list]) -> numpy.ndarray:
+        nodes = numpy.asarray(nodes)
+        if nodes.dtype == bool:
+            nodes, = numpy.nonzero(nodes)
+        return nodes.ravel()
+
+    def find(self, node: int) -> int:
+        """
+        :return: the root node of the set of this node
+        """
+        parent = self._parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def _union(self, node1: int, node2: int) -> bool:
+        root1 = self.find(node1)
+        root2 = self.find(node2)
+        if root1 == root2:
+            return False
+        if self._size[root1] < self._size[root2]:
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._size[root1] += self._size[root2]
+        return True
+
+    def add(self, nodes: Union[numpy.ndarray, list]):
+        """
+        Add nodes to the members, merging the components they connect.
+        :param nodes: boolean mask or indices of the nodes to add
+        """
+        for node in self._node_indices(nodes).tolist():
+            if self.members[node]:
+                continue
+            self.members[node] = True
+            self.n_components += 1
+            for neighbor in self._indices[self._indptr[node]:self._indptr[node + 1]].tolist():
+                if self.members[neighbor] and self._union(node, neighbor):
+                    self.n_components -= 1
+
+    def remove(self, nodes: Union[numpy.ndarray, list]):
+        """
+        Remove nodes from the members.
+        :param nodes: boolean mask or indices of the nodes to remove
+        """
+        nodes = self._node_indices(nodes)
+        nodes = numpy.unique(nodes[self.members[nodes]])
+        if nodes.size == 0:
+            return
+        roots, counts = numpy.unique(self._get_roots(nodes), return_counts=True)
+        self.members[nodes] = False
+        self._parent[nodes] = nodes
+        if numpy.array_equal(counts, self._size[roots]):
+            # the nodes make up whole components, which are just dropped
+            self._size[nodes] = 1
+            self.n_components -= roots.size
+        else:
+            members, = numpy.nonzero(self.members)
+            self.members[:] = False
+            self._parent[members] = members
+            self._size[:] = 1
+            self.n_components = 0
+            self.add(members)
+
+    def _get_roots(self, nodes: numpy.ndarray) -> numpy.ndarray:
+        # pointer jumping, for all nodes at once
+        roots = self._parent[nodes]
+        while True:
+            parents = self._parent[roots]
+            if numpy.array_equal(parents, roots):
+                return roots
+            roots = parents
+
+    def get_labels(self) -> numpy.ndarray:
+        """
+        :return: array (n_nodes, ) of the component labels 0...n_components-1 of the members, and -1 for other nodes;
+                 components are numbered in the order of their first member, as by scipy's connected_components
+        """
+        labels = -numpy.ones((self.n_nodes,), dtype='i')
+        members, = numpy.nonzero(self.members)
+        _, first_members, components = numpy.unique(self._get_roots(members), return_index=True,
+                                                    return_inverse=True)
+        order = numpy.empty_like(first_members)
+        order[numpy.argsort(first_members)] = numpy.arange(first_members.size)
+        labels[members] = order[components]
+        return labels
@@ -40,6 +40,7 @@ SNAPSHOTS_DIRECTORY = "snapshots"
 GIFTI_EXTENSION = ".gii"
 H5_EXTENSION = ".h5"
 NPY_EXTENSION = ".npy"
+NPZ_EXTENSION = ".npz"
 
 CENTER_RAS_FS_SURF = 'cras'
 CENTER_RAS_GIFTI_SURF = ['VolGeomC_R', 'VolGeomC_A', 'VolGeomC_S']
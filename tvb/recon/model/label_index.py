@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+from typing import Union, Optional
+import numpy
+
+
+class LabelIndex(object):
+    """
+    Hold, for every distinct label of a label array (e.g. a label volume or a region mapping), its elements.
+
+    It is built with a single stable argsort of the flattened array, so that the elements of every label are kept in
+    C order, as returned by numpy.where(data == label). Lookups then cost O(count of the label) instead of a full scan.
+    """
+
+    def __init__(self, data: Union[numpy.ndarray, list]):
+        data = numpy.asarray(data)
+        self.shape = data.shape
+        flat_data = data.ravel()
+        # flat indices of the elements sorted by label
+        self.order = numpy.argsort(flat_data, kind='mergesort')
+        sorted_labels = flat_data[self.order]
+        starts = numpy.flatnonzero(numpy.r_[True, sorted_labels[1:] != sorted_labels[:-1]]) \
+            if flat_data.size > 0 else numpy.zeros((0,), dtype='i')
+        # sorted distinct labels and their number of elements
+        self.labels = sorted_labels[starts]
+        self.counts = numpy.diff(numpy.r_[starts, flat_data.size])
+        # self.order[self.offsets[i]:self.offsets[i + 1]] are the elements of self.labels[i]
+        self.offsets = numpy.r_[starts, flat_data.size]
+
+    def get_label_positions(self, labels: Union[numpy.ndarray, list]) -> numpy.ndarray:
+        """
+        :return: the positions of labels in self.labels, -1 for the labels that are not present
+        """
+        labels = numpy.asarray(labels)
+        if self.labels.size == 0:
+            return numpy.full(labels.shape, -1, dtype='i')
+        positions = numpy.searchsorted(self.labels, labels).clip(max=self.labels.size - 1)
+        return numpy.where(self.labels[positions] == labels, positions, -1)
+
+    def get_flat_indices(self, label) -> numpy.ndarray:
+        """
+        :return: the (C ordered) flat indices of the elements of this label, empty if it is not present
+        """
+        position = self.get_label_positions(label)
+        if position < 0:
+            return numpy.zeros((0,), dtype=self.order.dtype)
+        return self.order[self.offsets[position]:self.offsets[position + 1]]
+
+    def get_labels_flat_indices(self, labels: Union[numpy.ndarray, list]) -> numpy.ndarray:
+        """
+        :return: the flat indices of the elements of all these labels, label by label
+        """
+        positions = self.get_label_positions(labels).ravel()
+        positions = positions[positions >= 0]
+        counts = self.counts[positions]
+        # consecutive ranges self.offsets[position]:self.offsets[position + 1], without a python loop
+        range_starts = numpy.repeat(self.offsets[positions] - numpy.cumsum(counts) + counts, counts)
+        return self.order[range_starts + numpy.arange(counts.sum())]
+
+    def get_indices(self, label) -> tuple:
+        """
+        :return: the indices of the elements of this label, as numpy.where(data == label)
+        """
+        return numpy.unravel_index(self.get_flat_indices(label), self.shape)
+
+    def get_coords(self, label) -> numpy.ndarray:
+        """
+        :return: array (count x ndim) of the indices of the elements of this label, as numpy.argwhere(data == label)
+        """
+        return numpy.c_[self.get_indices(label)].reshape((-1, len(self.shape)))
+
+    def reduce(self, values: numpy.ndarray, ufunc: numpy.ufunc=numpy.add) -> numpy.ndarray:
+        """
+        Reduce values (of the shape of the indexed data, plus optional trailing dimensions) per label.
+        :param ufunc: e.g. numpy.add, numpy.maximum, numpy.minimum
+        :return: array of the reductions for every label of self.labels
+        """
+        values = numpy.reshape(values, (-1,) + numpy.shape(values)[len(self.shape):])
+        if self.labels.size == 0:
+            return numpy.zeros((0,) + values.shape[1:], dtype=values.dtype)
+        return ufunc.reduceat(values[self.order], self.offsets[:-1], axis=0)
+
+    def get_means(self, values: numpy.ndarray) -> numpy.ndarray:
+        """
+        :return: the mean (in double precision) of values per label, see reduce
+        """
+        sums = self.reduce(numpy.asarray(values, dtype=numpy.float64))
+        return sums / self.counts.reshape((-1,) + (1,) * (sums.ndim - 1))
+
+    def get_element_positions(self) -> numpy.ndarray:
+        """
+        :return: array of the shape of the indexed data, with the position in self.labels of the label of every element
+        """
+        return self.paint(numpy.arange(self.labels.size))
+
+    def get_centroids(self, affine: Optional[numpy.ndarray]=None) -> numpy.ndarray:
+        """
+        :param affine: optional affine transform (e.g. voxel to ras) to apply to the centroids
+        :return: array (n_labels x ndim) of the mean element indices of every label
+        """
+        centroids = numpy.zeros((self.labels.size, len(self.shape)))
+        if self.labels.size == 0:
+            return centroids
+        stride = 1
+        for axis in reversed(range(len(self.shape))):
+            # indices along this axis of the elements, sorted by label
+            axis_indices = (self.order // stride) % self.shape[axis]
+            centroids[:, axis] = numpy.add.reduceat(axis_indices, self.offsets[:-1])
+            stride *= self.shape[axis]
+        centroids /= self.counts[:, numpy.newaxis]
+        if affine is not None:
+            affine = numpy.asarray(affine)
+            centroids = centroids.dot(affine[:-1, :-1].T) + affine[:-1, -1]
+        return centroids
+
+    def paint(self, label_values: Union[numpy.ndarray, list], dtype: Optional[numpy.dtype]=None) -> numpy.ndarray:
+        """
+        Create an array of the shape of the indexed data, with label_values[i] at the elements of self.labels[i].
+        :param label_values: one value per label of self.labels
+        :param dtype: the output dtype, by default the one of label_values
+        """
+        label_values = numpy.asarray(label_values)
+        out = numpy.empty(int(numpy.prod(self.shape)), dtype=dtype or label_values.dtype)
+        out[self.order] = numpy.repeat(label_values, self.counts)
+        return out.reshape(self.shape)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from typing import Union
+import numpy
+from scipy.spatial import cKDTree
+
+
+class SpatialIndex(object):
+    """
+    Hold a KD-tree over a point cloud (n_points x 3), e.g. surface vertices or voxel coordinates.
+
+    Answers nearest neighbour and radius queries in O(log n_points) per query point,
+    instead of computing the full distance matrix between the query points and the cloud.
+    """
+
+    def __init__(self, points: Union[numpy.ndarray, list], leafsize: int=16):
+        self.points = numpy.asarray(points)
+        self.n_points = self.points.shape[0]
+        self.tree = cKDTree(self.points, leafsize=leafsize)
+
+    def query_nearest(self, points: Union[numpy.ndarray, list], k: int=1,
+                      max_distance: float=numpy.inf) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Find the k nearest points of the cloud for every query point.
+        :param points: query points' coordinates array (number of points x 3)
+        :param k: number of neighbors to return
+        :param max_distance: only neighbors closer than this are returned
+        :return: distances and indices of the neighbors, of shape (number of points,) for k=1,
+                 or (number of points x k) otherwise. Missing neighbors have an infinite distance and index n_points.
+        """
+        return self.tree.query(points, k=k, distance_upper_bound=max_distance)
+
+    def query_radius(self, points: Union[numpy.ndarray, list], radius: float) -> list:
+        """
+        Find all the points of the cloud within a radius from every query point.
+        :param points: query points' coordinates array (number of points x 3)
+        :param radius: the search radius
+        :return: list with the (sorted) indices array of the neighbors of every query point
+        """
+        return [numpy.array(sorted(neighbors), dtype='i')
+                for neighbors in self.tree.query_ball_point(points, radius)]
@@ -1,30 +1,52 @@
 # -*- coding: utf-8 -*-
 
-from typing import Union, Optional
+import os
+from typing import Union, Optional, Callable
 import numpy
+from scipy.sparse import csr_matrix
+from sklearn.metrics.pairwise import paired_distances
 from tvb.recon.model.constants import *
-from trimesh import Trimesh, intersections
+from tvb.recon.model.spatial_index import SpatialIndex
 #from tvb.recon.algo.service.surface import  SurfaceService
 
+COMPACT_VERTICES_DTYPE = numpy.float32
+COMPACT_TRIANGLES_DTYPE = numpy.int32
+# distance under which a vertex is considered to be on a cutting plane (as trimesh's tol.merge)
+PLANE_TOLERANCE = 1e-8
+
 
 class Surface(object):
     """
     Hold a surface mesh (vertices and triangles).
 
     Has also few methods to read from this mesh (e.g. a contour cut).
+
+    Derived geometry (areas, normals, edges, adjacency) is computed once on demand and cached. The cache is cleared
+    whenever vertices or triangles are assigned; call invalidate_cache() after modifying them in place.
+
+    With compact=True the mesh is kept as float32 vertices and int32 triangles, and the input arrays are used without
+    a defensive copy whenever they already have these dtypes. make_compact() converts an existing surface, optionally
+    moving its arrays to .npy memory maps.
     """
 
     def __init__(self, vertices: numpy.ndarray, triangles: numpy.ndarray,
                  area_mask: Optional[Union[numpy.ndarray, list]]=None, center_ras: Union[numpy.ndarray, list]=[],
-                 vertices_coord_system=None, generic_metadata=None, vertices_metadata=None, triangles_metadata=None):
+                 vertices_coord_system=None, generic_metadata=None, vertices_metadata=None, triangles_metadata=None,
+                 compact: bool=False):
         # TODO: clarify the args' types
+        self._cache = {}
+        self.compact = compact
         if len(vertices) == 0:
-            self.vertices = numpy.empty((0, 3))
+            self.vertices = numpy.empty((0, 3), dtype=COMPACT_VERTICES_DTYPE if compact else float)
+        elif compact:
+            self.vertices = numpy.asarray(vertices, dtype=COMPACT_VERTICES_DTYPE)
         else:
             # numpy array of n_vertices x 3 [x,y,z] vertices' coordinates
             self.vertices = numpy.array(vertices)
         if len(triangles) == 0:
             self.triangles = numpy.empty((0, 3), dtype='i')
+        elif compact:
+            self.triangles = numpy.asarray(triangles, dtype=COMPACT_TRIANGLES_DTYPE)
         else:
             # numpy array of n_triangles x 3 [v1, v2, v3] indices in vertices'
             # array
@@ -32,9 +54,6 @@ class Surface(object):
 
         self.center_ras = center_ras  # [x, y, z]
 
-        self.n_vertices = self.vertices.shape[0]
-        self.n_triangles = self.triangles.shape[0]
-
         self.generic_metadata = generic_metadata
         self.vertices_metadata = vertices_metadata
         self.triangles_metadata = triangles_metadata
@@ -46,6 +65,62 @@ class Surface(object):
         else:
             self.area_mask = area_mask
 
+    @property
+    def vertices(self) -> numpy.ndarray:
+        return self._vertices
+
+    @vertices.setter
+    def vertices(self, vertices: numpy.ndarray):
+        self._vertices = vertices
+        self.n_vertices = vertices.shape[0]
+        self.invalidate_cache()
+
+    @property
+    def triangles(self) -> numpy.ndarray:
+        return self._triangles
+
+    @triangles.setter
+    def triangles(self, triangles: numpy.ndarray):
+        self._triangles = triangles
+        self.n_triangles = triangles.shape[0]
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        self._cache.clear()
+
+    def _get_cached(self, key: str, compute: Callable):
+        """
+        Return the cached value of key, computing it first if needed.
+        Cached arrays are set read-only, so that callers cannot corrupt them.
+        """
+        if key not in self._cache:
+            value = compute()
+            if isinstance(value, numpy.ndarray):
+                value.flags.writeable = False
+            self._cache[key] = value
+        return self._cache[key]
+
+    def make_compact(self, memmap_dir: Optional[str]=None):
+        """
+        Switch this surface to the compact representation: float32 vertices and int32 triangles.
+        :param memmap_dir: if given, the arrays are saved as vertices.npy and triangles.npy in this folder and
+                           replaced by copy-on-write memory maps of these files
+        :return: this surface
+        """
+        vertices = numpy.asarray(self.vertices, dtype=COMPACT_VERTICES_DTYPE)
+        triangles = numpy.asarray(self.triangles, dtype=COMPACT_TRIANGLES_DTYPE)
+        if memmap_dir is not None:
+            vertices_path = os.path.join(memmap_dir, "vertices.npy")
+            triangles_path = os.path.join(memmap_dir, "triangles.npy")
+            numpy.save(vertices_path, vertices)
+            numpy.save(triangles_path, triangles)
+            vertices = numpy.load(vertices_path, mmap_mode="c")
+            triangles = numpy.load(triangles_path, mmap_mode="c")
+        self.vertices = vertices
+        self.triangles = triangles
+        self.compact = True
+        return self
+
     def get_main_metadata(self):
         if self.vertices_metadata is not None:
             return self.vertices_metadata
@@ -60,15 +135,17 @@ class Surface(object):
     # TODO: it will fail if one tries to add empty inputs
     def add_vertices_and_triangles(self, new_vertices: numpy.ndarray, new_triangles: numpy.ndarray,
                                    new_area_mask: Union[numpy.ndarray, list]=[]):
-        self.triangles = numpy.r_[self.triangles,
-                                  new_triangles + self.n_vertices]
-        self.vertices = numpy.r_[self.vertices, new_vertices]
+        triangles = numpy.r_[self.triangles, new_triangles + self.n_vertices]
+        vertices = numpy.r_[self.vertices, new_vertices]
+        if self.compact:
+            triangles = triangles.astype(COMPACT_TRIANGLES_DTYPE, copy=False)
+            vertices = vertices.astype(COMPACT_VERTICES_DTYPE, copy=False)
+        self.triangles = triangles
+        self.vertices = vertices
         n_new_vertices = new_vertices.shape[0]
-        self.n_vertices += n_new_vertices
-        self.n_triangles += new_triangles.shape[0]
         if len(new_area_mask) == 0:
             new_area_mask = numpy.ones((n_new_vertices,), dtype='bool')
-        numpy.r_[self.area_mask, new_area_mask]
+        self.area_mask = numpy.r_[self.area_mask, new_area_mask]
         # self.stack_vertices_and_triangles()
 
     # def stack_vertices_and_triangles(self):
@@ -88,17 +165,65 @@ class Surface(object):
         :param ras:
         :return: Y_array, X_array
         """
-        mesh = Trimesh(self.vertices, self.triangles)
-        contours = intersections.mesh_plane(
-            mesh, PLANE_NORMALS[projection], self._get_plane_origin(ras))
-        x_array = [0] * len(contours)
-        y_array = [0] * len(contours)
+        return self.cut_by_planes([(projection, ras)])[0]
+
+    def cut_by_planes(self, planes: list) -> list:
+        """
+        Cut the surface by several planes in one pass.
+        The edges and the per triangle bounds of the mesh are computed once (and cached) and reused for all planes.
+        :param planes: list of (projection, ras) tuples
+        :return: list with the (X_array, Y_array) contour of every plane, as returned by cut_by_plane
+        """
+        contours = []
+        for projection, ras in planes:
+            axis = PLANE_NORMALS[projection].index(1)
+            segments = self._cut_by_axis_plane(axis, self._get_plane_origin(ras)[axis])
+            x_index, y_index = X_Y_INDEX[projection]
+            contours.append((list(segments[:, :, x_index]), list(segments[:, :, y_index])))
+        return contours
+
+    def _cut_by_axis_plane(self, axis: int, offset: float) -> numpy.ndarray:
+        """
+        Intersect the mesh with the plane vertices[:, axis] == offset.
+        As in trimesh.intersections.mesh_plane, a triangle contributes a segment when the plane crosses it, passes
+        through one vertex and the opposite edge, or contains one edge with the third vertex on the positive side.
+        :return: array (n_segments x 2 x 3) of the segments' end points
+        """
+        bounds = self._get_cached("triangle_bounds", self._compute_triangle_bounds)
+        candidates, = numpy.nonzero((bounds[0, :, axis] <= offset + PLANE_TOLERANCE) &
+                                    (bounds[1, :, axis] >= offset - PLANE_TOLERANCE))
+        triangles = self.triangles[candidates]
+        distances = self.vertices[:, axis] - offset
+        signs = numpy.zeros(triangles.shape, dtype='i1')
+        signs[distances[triangles] < -PLANE_TOLERANCE] = -1
+        signs[distances[triangles] > PLANE_TOLERANCE] = 1
+
+        # edge k of a triangle goes from its vertex k to its vertex (k + 1) % 3
+        on_plane = signs == 0
+        crossed = signs * numpy.roll(signs, -1, axis=1) < 0
+        n_on_plane = on_plane.sum(axis=1)
+        n_crossed = crossed.sum(axis=1)
+        valid = ((n_on_plane == 0) & (n_crossed == 2)) | ((n_on_plane == 1) & (n_crossed == 1)) | \
+                ((n_on_plane == 2) & (signs.sum(axis=1) > 0))
+
+        # every crossed edge is intersected once, so that neighbouring segments share their end points exactly
+        on_plane = on_plane[valid]
+        crossed = crossed[valid]
+        triangle_edges = self.get_triangle_edges()[candidates[valid]][crossed]
+        crossed_edges = numpy.unique(triangle_edges)
+        v0, v1 = self.get_edges()[crossed_edges].T
+        weights = (distances[v0] / (distances[v0] - distances[v1]))[:, numpy.newaxis]
+        crossing_points = self.vertices[v0] + weights * (self.vertices[v1] - self.vertices[v0])
 
-        for s in range(len(contours)):
-            x_array[s] = contours[s][:, X_Y_INDEX[projection][0]]
-            y_array[s] = contours[s][:, X_Y_INDEX[projection][1]]
+        # each valid triangle has exactly two points: its vertices on the plane and the points on its crossed edges
+        points = numpy.zeros((on_plane.shape[0], 6, 3), dtype=crossing_points.dtype)
+        points[:, :3] = self.vertices[triangles[valid]]
+        points[:, 3:][crossed] = crossing_points[numpy.searchsorted(crossed_edges, triangle_edges)]
+        return points[numpy.c_[on_plane, crossed]].reshape((-1, 2, 3))
 
-        return x_array, y_array
+    def _compute_triangle_bounds(self) -> numpy.ndarray:
+        triangle_vertices = self.vertices[self.triangles]
+        return numpy.stack((triangle_vertices.min(axis=1), triangle_vertices.max(axis=1)))
 
     # def compute_area(self):
     #     if numpy.all(self.area_mask):
@@ -109,55 +234,72 @@ class Surface(object):
     #         (vertices,triangles) = surface_service.extract_subsurf(self,self.area_mask,output="verts_triangls")[:2]
     #     return numpy.sum(surface_service.tri_area(vertices[triangles]))
 
-    def compute_normals(self) -> numpy.ndarray:
+    def _get_triangle_edge_vectors(self) -> (numpy.ndarray, numpy.ndarray):
         """
-        :return: array of triangle normal vectors
+        :return: the two edge vectors (v1 - v0, v2 - v0) of every triangle, each of shape (n_triangles, 3)
+        """
+        triangle_vertices = self.vertices[self.triangles]
+        return triangle_vertices[:, 1] - triangle_vertices[:, 0], triangle_vertices[:, 2] - triangle_vertices[:, 0]
+
+    def _sum_on_vertices(self, triangle_values: numpy.ndarray) -> numpy.ndarray:
+        """
+        Accumulate per triangle values (n_triangles, ) or (n_triangles, d) on each of the 3 vertices of the triangle.
+        """
+        return self.get_vertex_triangle_incidence().dot(triangle_values)
+
+    def get_geometry(self) -> dict:
         """
-        normals = [[0, 0, 0] for _ in range(len(self.triangles))]
+        Vectorized geometry kernel: compute in one pass over the mesh all the per triangle and per vertex quantities.
+        :return: dict with triangle_normals (not normalized), vertex_normals, triangle_angles, triangle_areas,
+                 vertex_areas and vertex_triangles
+        """
+        return {"triangle_normals": self.compute_normals(),
+                "vertex_normals": self.vertex_normals(),
+                "triangle_angles": self._get_triangle_angles(),
+                "triangle_areas": self.get_triangle_areas(),
+                "vertex_areas": self.get_vertex_areas(),
+                "vertex_triangles": self.get_vertex_triangles()}
 
-        for i, tri in enumerate(self.triangles):
-            u = self.vertices[tri[1]] - self.vertices[tri[0]]
-            v = self.vertices[tri[2]] - self.vertices[tri[0]]
-            normals[i][0] = u[1] * v[2] - u[2] * v[1]
-            normals[i][1] = u[2] * v[0] - u[0] * v[2]
-            normals[i][2] = u[0] * v[1] - u[1] * v[0]
+    @staticmethod
+    def _normalize(vectors: numpy.ndarray) -> numpy.ndarray:
+        return vectors / numpy.sqrt(numpy.sum(vectors ** 2, axis=1))[:, numpy.newaxis]
 
-        return normals
+    def compute_normals(self) -> numpy.ndarray:
+        """
+        :return: array of triangle normal vectors
+        """
+        return self._get_cached("triangle_normals", lambda: numpy.cross(*self._get_triangle_edge_vectors()))
 
     def vertex_normals(self) -> numpy.ndarray:
         # TODO test by generating points on unit sphere: vtx pos should equal
         # normal
-
-        vf = self.vertices[self.triangles]
-        fn = numpy.cross(vf[:, 1] - vf[:, 0], vf[:, 2] - vf[:, 0])
-        vf = [set() for _ in range(len(self.vertices))]
-        for i, fi in enumerate(self.triangles):
-            for j in fi:
-                vf[j].add(i)
-        vn = numpy.zeros_like(self.vertices)
-        for i, fi in enumerate(vf):
-            fni = fn[list(fi)]
-            norm = fni.sum(axis=0)
-            norm /= numpy.sqrt((norm ** 2).sum())
-            vn[i] = norm
-        return vn
+        return self._get_cached("vertex_normals",
+                                lambda: self._normalize(self._sum_on_vertices(self.compute_normals())))
 
     def get_vertex_triangles(self) -> list:
-        vertex_triangles = [[] for _ in range(self.n_vertices)]
-        for k in range(self.n_triangles):
-            vertex_triangles[self.triangles[k, 0]].append(k)
-            vertex_triangles[self.triangles[k, 1]].append(k)
-            vertex_triangles[self.triangles[k, 2]].append(k)
-        return vertex_triangles
+        incidence = self.get_vertex_triangle_incidence()
+        return [vertex_triangles.tolist() for vertex_triangles in numpy.split(incidence.indices, incidence.indptr[1:-1])]
+
+    def get_vertex_triangle_incidence(self) -> csr_matrix:
+        """
+        :return: sparse matrix (n_vertices x n_triangles) with 1 where the vertex is a corner of the triangle
+        """
+        return self._get_cached("vertex_triangle_incidence", self._compute_vertex_triangle_incidence)
+
+    def _compute_vertex_triangle_incidence(self) -> csr_matrix:
+        return csr_matrix((numpy.ones((3 * self.n_triangles,)),
+                           (self.triangles.ravel(), numpy.repeat(numpy.arange(self.n_triangles), 3))),
+                          shape=(self.n_vertices, self.n_triangles))
 
     def _get_triangle_normals(self) -> numpy.ndarray:
         """Calculates triangle normals."""
-        tri_u = self.vertices[self.triangles[:, 1], :] - self.vertices[self.triangles[:, 0], :]
-        tri_v = self.vertices[self.triangles[:, 2], :] - self.vertices[self.triangles[:, 0], :]
-        tri_norm = numpy.cross(tri_u, tri_v)
+        return self._get_cached("triangle_unit_normals", self._compute_triangle_unit_normals)
+
+    def _compute_triangle_unit_normals(self) -> numpy.ndarray:
+        tri_norm = self.compute_normals()
 
         try:
-            triangle_normals = tri_norm / numpy.sqrt(numpy.sum(tri_norm ** 2, axis=1))[:, numpy.newaxis]
+            triangle_normals = self._normalize(tri_norm)
         except FloatingPointError:
             # TODO: NaN generation would stop execution, however for normals this case could maybe be
             #  handled in a better way.
@@ -168,36 +310,172 @@ class Surface(object):
         """
         Calculates the inner angles of all the triangles which make up a surface
         """
-        verts = self.vertices
-        # TODO: Should be possible with arrays, ie not nested loops...
-        # A short profile indicates this function takes 95% of the time to compute normals
-        # (this was a direct translation of some old matlab code)
+        triangle_vertices = self.vertices[self.triangles]
         angles = numpy.zeros((self.n_triangles, 3))
-        for tt in range(self.n_triangles):
-            triangle = self.triangles[tt, :]
-            for ta in range(3):
-                ang = numpy.roll(triangle, -ta)
-                angles[tt, ta] = numpy.arccos(numpy.dot(
-                    (verts[ang[1], :] - verts[ang[0], :]) /
-                    numpy.sqrt(numpy.sum((verts[ang[1], :] - verts[ang[0], :]) ** 2, axis=0)),
-                    (verts[ang[2], :] - verts[ang[0], :]) /
-                    numpy.sqrt(numpy.sum((verts[ang[2], :] - verts[ang[0], :]) ** 2, axis=0))))
+        for ta in range(3):
+            # Unit vectors of the two edges starting from the ta-th vertex of every triangle
+            edge_1 = triangle_vertices[:, (ta + 1) % 3] - triangle_vertices[:, ta]
+            edge_2 = triangle_vertices[:, (ta + 2) % 3] - triangle_vertices[:, ta]
+            angles[:, ta] = numpy.arccos(numpy.sum(self._normalize(edge_1) * self._normalize(edge_2), axis=1))
 
         return angles
 
     def get_triangle_areas(self) -> numpy.ndarray:
         """Calculates the area of triangles making up a surface."""
-        tri_u = self.vertices[self.triangles[:, 1], :] - self.vertices[self.triangles[:, 0], :]
-        tri_v = self.vertices[self.triangles[:, 2], :] - self.vertices[self.triangles[:, 0], :]
-        tri_norm = numpy.cross(tri_u, tri_v)
-        triangle_areas = numpy.sqrt(numpy.sum(tri_norm ** 2, axis=1)) / 2.0
+        return self._get_cached("triangle_areas", self._compute_triangle_areas)
+
+    def _compute_triangle_areas(self) -> numpy.ndarray:
+        tri_norm = self.compute_normals()
+        # accumulate in double precision, also for compact (float32) surfaces
+        triangle_areas = numpy.sqrt(numpy.sum(tri_norm ** 2, axis=1, dtype=numpy.float64)) / 2.0
         triangle_areas = triangle_areas[:, numpy.newaxis]
         return triangle_areas
 
     def get_vertex_areas(self) -> numpy.ndarray:
-        triangle_areas = self.get_triangle_areas()
-        vertex_areas = numpy.zeros((self.vertices.shape[0]))
-        for triang, vertices in enumerate(self.triangles):
-            for i in range(3):
-                vertex_areas[vertices[i]] += 1. / 3. * triangle_areas[triang]
-        return vertex_areas
+        return self._get_cached("vertex_areas",
+                                lambda: self._sum_on_vertices(1. / 3. * self.get_triangle_areas()[:, 0]))
+
+    def get_edges(self) -> numpy.ndarray:
+        """
+        :return: array (n_edges x 2) of the unique undirected edges of the mesh, as (smaller, larger) vertex indices
+        """
+        return self._get_cached("edges", self._compute_edges)
+
+    def _compute_edges(self) -> numpy.ndarray:
+        edges = numpy.r_[self.triangles[:, [0, 1]], self.triangles[:, [1, 2]], self.triangles[:, [2, 0]]]
+        edges = numpy.sort(edges, axis=1).astype('int64')
+        # Encode every edge as a single integer to find the unique ones
+        edges = numpy.unique(edges[:, 0] * self.n_vertices + edges[:, 1])
+        return numpy.c_[edges // self.n_vertices, edges % self.n_vertices]
+
+    def get_triangle_edges(self) -> numpy.ndarray:
+        """
+        :return: array (n_triangles x 3) of the indices in get_edges() of the edges (v0, v1), (v1, v2), (v2, v0) of
+                 every triangle
+        """
+        return self._get_cached("triangle_edges", self._compute_triangle_edges)
+
+    def _compute_triangle_edges(self) -> numpy.ndarray:
+        edges = self.get_edges()
+        edge_codes = edges[:, 0] * self.n_vertices + edges[:, 1]
+        triangle_edges = numpy.stack((self.triangles, numpy.roll(self.triangles, -1, axis=1)), axis=2)
+        triangle_edges = numpy.sort(triangle_edges, axis=2).astype('int64')
+        return numpy.searchsorted(edge_codes, triangle_edges[:, :, 0] * self.n_vertices + triangle_edges[:, :, 1])
+
+    def get_sub_surface_indices(self, verts_mask: Union[numpy.ndarray, list]) \
+            -> (numpy.ndarray, numpy.ndarray, numpy.ndarray):
+        """
+        Find the part of the mesh made of the masked vertices and the triangles having all 3 of them masked.
+        :param verts_mask: boolean mask (n_vertices, ) of the vertices to keep
+        :return: the indices of the kept vertices and triangles, and the kept triangles, with their vertex indices
+                 remapped to the kept vertices, through an old to new vertex index lookup array
+        """
+        verts_mask = numpy.asarray(verts_mask, dtype=bool)
+        vertex_indices, = numpy.nonzero(verts_mask)
+        triangle_indices, = numpy.nonzero(verts_mask[self.triangles].all(axis=1))
+        new_vertex_indices = numpy.full((self.n_vertices,), -1, dtype=self.triangles.dtype)
+        new_vertex_indices[vertex_indices] = numpy.arange(vertex_indices.size)
+        return vertex_indices, triangle_indices, new_vertex_indices[self.triangles[triangle_indices]]
+
+    def get_spatial_index(self) -> SpatialIndex:
+        """
+        :return: a KD-tree index over the vertices, for nearest vertex and radius queries
+        """
+        return self._get_cached("spatial_index", lambda: SpatialIndex(self.vertices))
+
+    def get_vertex_adjacency(self, weighted: bool=False) -> csr_matrix:
+        """
+        :param weighted: if True, entries are the euclidean lengths of the edges instead of 1
+        :return: symmetric sparse matrix (n_vertices x n_vertices) with an entry for every pair of vertices sharing
+                 an edge
+        """
+        if weighted:
+            return self._get_cached("vertex_adjacency_weighted", lambda: self._compute_vertex_adjacency(True))
+        return self._get_cached("vertex_adjacency", self._compute_vertex_adjacency)
+
+    def _compute_vertex_adjacency(self, weighted: bool=False) -> csr_matrix:
+        edges = self.get_edges()
+        if weighted:
+            weights = numpy.sqrt(numpy.sum((self.vertices[edges[:, 0]] - self.vertices[edges[:, 1]]) ** 2, axis=1))
+        else:
+            weights = numpy.ones((edges.shape[0],))
+        return csr_matrix((numpy.r_[weights, weights], (numpy.r_[edges[:, 0], edges[:, 1]],
+                                                        numpy.r_[edges[:, 1], edges[:, 0]])),
+                          shape=(self.n_vertices, self.n_vertices))
+
+    def get_vertex_connectivity(self, metric: Optional[str]=None, symmetric: bool=False) -> csr_matrix:
+        """
+        The matrix is cached per metric and symmetry, and shared among callers, so it should not be modified in place.
+        :param metric: None for entries of 1, else the metric of the edge lengths, e.g. "euclidean"
+        :param symmetric: if False, only the edges (v0, v1), (v1, v2), (v2, v0), as oriented in the triangles, have an
+                          entry, otherwise both directions of every edge have one
+        :return: float32 sparse matrix (n_vertices x n_vertices) of the connectivity among the vertices
+        """
+        return self._get_cached("vertex_connectivity_%s_%s" % (metric, symmetric),
+                                lambda: self._compute_vertex_connectivity(metric, symmetric))
+
+    def _compute_vertex_connectivity(self, metric: Optional[str]=None, symmetric: bool=False) -> csr_matrix:
+        if symmetric:
+            edges = self.get_edges()
+            edges = numpy.r_[edges, edges[:, [1, 0]]]
+        else:
+            edges = numpy.r_[self.triangles[:, [0, 1]], self.triangles[:, [1, 2]], self.triangles[:, [2, 0]]]
+            edges = edges.astype('int64')
+            # Encode every directed edge as a single integer to find the unique ones
+            edges = numpy.unique(edges[:, 0] * self.n_vertices + edges[:, 1])
+            edges = numpy.c_[edges // self.n_vertices, edges % self.n_vertices]
+        if metric is None:
+            weights = numpy.ones((edges.shape[0],), dtype=numpy.float32)
+        elif metric == "euclidean":
+            weights = numpy.sqrt(numpy.sum((self.vertices[edges[:, 0]] - self.vertices[edges[:, 1]]) ** 2, axis=1))
+        else:
+            weights = paired_distances(self.vertices[edges[:, 0]], self.vertices[edges[:, 1]], metric=metric)
+        # edges are unique, so no entries are summed up
+        return csr_matrix((weights.astype(numpy.float32), (edges[:, 0], edges[:, 1])),
+                          shape=(self.n_vertices, self.n_vertices))
+
+
+class SubSurface(Surface):
+    """
+    View of the part of a parent surface made of a subset of its vertices, and the triangles among them.
+
+    It is built from index arrays only: the indices of its vertices and triangles in the parent, and its triangles
+    remapped to its own vertices. The vertices are gathered from the parent once, on first access, and the triangle
+    areas and normals are sliced from the parent's cache, all being cached read-only, so that extracting (nested)
+    sub-surfaces does not copy or recompute geometry that is not used.
+    A view of a view refers directly to the root surface, but takes its area mask from its immediate parent.
+    The vertices of a view cannot be assigned, and it does not follow later changes of the parent.
+    """
+
+    def __init__(self, parent: Surface, verts_mask: Union[numpy.ndarray, list],
+                 area_mask: Optional[Union[numpy.ndarray, list]]=None):
+        vertex_indices, self.triangle_indices, triangles = parent.get_sub_surface_indices(verts_mask)
+        if area_mask is None:
+            area_mask = numpy.asarray(parent.area_mask)[vertex_indices]
+        if isinstance(parent, SubSurface):
+            self.vertex_indices = parent.vertex_indices[vertex_indices]
+            self.triangle_indices = parent.triangle_indices[self.triangle_indices]
+            parent = parent.parent
+        else:
+            self.vertex_indices = vertex_indices
+        self.parent = parent
+        self._cache = {}
+        self.compact = parent.compact
+        self.n_vertices = self.vertex_indices.size
+        self.triangles = triangles
+        self.center_ras = parent.center_ras
+        self.generic_metadata = parent.generic_metadata
+        self.vertices_metadata = parent.vertices_metadata
+        self.triangles_metadata = parent.triangles_metadata
+        self.vertices_coord_system = parent.vertices_coord_system
+        self.area_mask = area_mask
+
+    @property
+    def vertices(self) -> numpy.ndarray:
+        return self._get_cached("vertices", lambda: self.parent.vertices[self.vertex_indices])
+
+    def compute_normals(self) -> numpy.ndarray:
+        return self._get_cached("triangle_normals", lambda: self.parent.compute_normals()[self.triangle_indices])
+
+    def get_triangle_areas(self) -> numpy.ndarray:
+        return self._get_cached("triangle_areas", lambda: self.parent.get_triangle_areas()[self.triangle_indices])
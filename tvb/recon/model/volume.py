@@ -4,23 +4,58 @@ from typing import Union
 import numpy
 import numpy.linalg
 from tvb.recon.model.constants import *
+from tvb.recon.model.label_index import LabelIndex
 from nibabel.affines import apply_affine
+from scipy.ndimage import map_coordinates
 
 
 class Volume(object):
     """
     Hold volume data, dimensions and affine matrix.
 
-    Has a method that cuts a slice from the volume.
+    Has methods that cut orthogonal slices from the volume, or resample it on batches of arbitrary planes.
+
+    The data can also be a lazy array proxy (a nibabel image dataobj or a h5py dataset). It is then read with its
+    on-disk dtype only when the data attribute is first accessed, while slicing reads only the needed slabs.
     """
 
     def __init__(self, data: numpy.ndarray, affine_matrix: numpy.ndarray, header: str):
-        self.data = data  # 3D array
-        self.dimensions = data.shape  # array with the length of each data dimension
+        self.data = data  # 3D array, or array proxy
         # matrix containing voxel to ras transformation
         self.affine_matrix = affine_matrix
         self.header = header
 
+    @property
+    def data(self) -> numpy.ndarray:
+        if self.is_lazy():
+            self._data = numpy.asanyarray(self._data)
+        return self._data
+
+    @data.setter
+    def data(self, data: numpy.ndarray):
+        self._data = data
+        self.dimensions = data.shape  # array with the length of each data dimension
+
+    def is_lazy(self) -> bool:
+        """
+        :return: True if the data is an array proxy that has not been read yet
+        """
+        return not isinstance(self._data, numpy.ndarray)
+
+    def get_slab(self, index: tuple) -> numpy.ndarray:
+        """
+        Read a part of the data (e.g. a slice or a bounding box), without reading the whole volume if it is lazy.
+        :param index: tuple of integers and slices (with non negative bounds and steps)
+        :return: the data of this part, with its native dtype
+        """
+        return numpy.asarray(self._data[index])
+
+    def get_label_index(self) -> LabelIndex:
+        """
+        :return: an index of the voxels of every label of this (label) volume, built in a single pass over the data
+        """
+        return LabelIndex(self.data)
+
     def get_center_point(self) -> numpy.ndarray:
         a = numpy.array(self.affine_matrix)
         b = numpy.array(list(numpy.divide(self.dimensions, 2)) + [1])
@@ -41,24 +76,147 @@ class Volume(object):
         ijk_ras = numpy.round(apply_affine(affine_inverse, ras)).astype('i')
 
         slice_index_1, slice_index_2 = X_Y_INDEX[projection]
+        fixed_index, = {0, 1, 2} - {slice_index_1, slice_index_2}
+        n_1 = self.dimensions[slice_index_1]
+        n_2 = self.dimensions[slice_index_2]
+
+        # voxel coordinates of every (i, j) pixel of the slice, transformed to ras in one go
+        ijk_grid = numpy.empty((n_1, n_2, 3), dtype='i')
+        ijk_grid[:, :, fixed_index] = ijk_ras[fixed_index]
+        ijk_grid[:, :, slice_index_1] = numpy.arange(n_1)[:, numpy.newaxis]
+        ijk_grid[:, :, slice_index_2] = numpy.arange(n_2)[numpy.newaxis, :]
+        ras_grid = apply_affine(self.affine_matrix, ijk_grid)
+        x_axis_coords = ras_grid[:, :, slice_index_1]
+        y_axis_coords = ras_grid[:, :, slice_index_2]
 
-        slice_data = numpy.zeros(
-            (self.dimensions[slice_index_1], self.dimensions[slice_index_2]))
-        x_axis_coords = numpy.zeros_like(slice_data)
-        y_axis_coords = numpy.zeros_like(slice_data)
+        # an out of range slice raises IndexError (used by callers to fall back to the volume center point),
+        # while negative positions wrap around as in numpy indexing
+        fixed_position = int(ijk_ras[fixed_index])
+        if not -self.dimensions[fixed_index] <= fixed_position < self.dimensions[fixed_index]:
+            raise IndexError("Slice %d is out of the volume dimensions %s" % (fixed_position, self.dimensions))
+        slice_position = [slice(None)] * 3
+        slice_position[fixed_index] = fixed_position % self.dimensions[fixed_index]
+        slice_data = self.get_slab(self._get_scalar_index(slice_position)).astype(numpy.float64)
 
-        for i in range(self.dimensions[slice_index_1]):
-            for j in range(self.dimensions[slice_index_2]):
-                ijk_ras[slice_index_1] = i
-                ijk_ras[slice_index_2] = j
+        return x_axis_coords, y_axis_coords, slice_data
 
-                ras_coordinates = apply_affine(self.affine_matrix, ijk_ras)
-                x_axis_coords[i, j] = ras_coordinates[slice_index_1]
-                y_axis_coords[i, j] = ras_coordinates[slice_index_2]
+    def _get_scalar_index(self, index: list) -> tuple:
+        # keep the first value of every voxel for multi-valued (e.g. 4D) volumes
+        return tuple(index) + (0,) * (len(self.dimensions) - 3)
 
-                color = self.data[ijk_ras[0], ijk_ras[1], ijk_ras[2]]
-                if isinstance(color, (list, numpy.ndarray)):
-                    color = color[0]
-                slice_data[i][j] = color
+    def _map_voxel_coordinates(self, ijk_points: numpy.ndarray, order: int=0, cval: float=0.0) -> numpy.ndarray:
+        """
+        Interpolate the volume at the voxel coordinates (n_points x 3) of ijk_points.
+        Only the bounding box of the points (with a margin of one voxel) is read from the data.
+        """
+        ijk_points = numpy.reshape(ijk_points, (-1, 3))
+        dimensions = numpy.array(self.dimensions[:3])
+        if ijk_points.shape[0] == 0:
+            return numpy.zeros((0,))
+        lower = numpy.clip(numpy.floor(ijk_points.min(axis=0)).astype('i') - 1, 0, dimensions)
+        upper = numpy.clip(numpy.ceil(ijk_points.max(axis=0)).astype('i') + 2, 0, dimensions)
+        if numpy.any(upper <= lower):
+            return numpy.full((ijk_points.shape[0],), cval, dtype=numpy.float64)
+        slab = self.get_slab(self._get_scalar_index([slice(l, u) for l, u in zip(lower, upper)]))
+        return map_coordinates(slab, (ijk_points - lower).T, output=numpy.float64, order=order,
+                               mode='constant', cval=cval, prefilter=False)
 
-        return x_axis_coords, y_axis_coords, slice_data
+    def sample_ras_points(self, ras_points: numpy.ndarray, order: int=0, cval: float=0.0) -> numpy.ndarray:
+        """
+        Sample the volume at arbitrary ras points, in one vectorized call.
+        :param ras_points: array of ras coordinates, of shape (..., 3)
+        :param order: 0 for nearest neighbor, 1 for trilinear interpolation
+        :param cval: value for the points outside the volume
+        :return: float array of the sampled values, of shape ras_points.shape[:-1]
+        """
+        ras_points = numpy.asarray(ras_points, dtype=numpy.float64)
+        ijk_points = apply_affine(numpy.linalg.inv(self.affine_matrix), ras_points.reshape((-1, 3)))
+        values = self._map_voxel_coordinates(ijk_points, order=order, cval=cval)
+        return values.reshape(ras_points.shape[:-1])
+
+    def sample_planes(self, centers: Union[numpy.ndarray, list], x_directions: Union[numpy.ndarray, list],
+                      y_directions: Union[numpy.ndarray, list], shape: tuple, spacing: float=1.0, order: int=0,
+                      cval: float=0.0) -> (numpy.ndarray, numpy.ndarray, numpy.ndarray):
+        """
+        Resample the volume on a batch of (possibly oblique) planes.
+        Every plane is a shape[0] x shape[1] grid centered at its center and spanned by its x and y directions.
+        :param centers: ras points at the center of the planes (n_planes x 3)
+        :param x_directions: in-plane directions of the grid rows (n_planes x 3), normalized here
+        :param y_directions: in-plane directions of the grid columns (n_planes x 3), normalized here
+        :param shape: number of samples along the x and y directions
+        :param spacing: distance in mm between neighboring samples
+        :param order: 0 for nearest neighbor, 1 for trilinear interpolation
+        :param cval: value for the samples outside the volume
+        :return: X, Y in-plane coordinates in mm (relative to the centers) and data matrices,
+                 each of shape (n_planes, shape[0], shape[1]); X[i], Y[i], data[i] can be passed to write_matrix
+        """
+        centers = numpy.reshape(numpy.asarray(centers, dtype=numpy.float64), (-1, 3))
+        x_directions = numpy.reshape(numpy.asarray(x_directions, dtype=numpy.float64), (-1, 3))
+        y_directions = numpy.reshape(numpy.asarray(y_directions, dtype=numpy.float64), (-1, 3))
+        x_directions = x_directions / numpy.linalg.norm(x_directions, axis=1)[:, numpy.newaxis]
+        y_directions = y_directions / numpy.linalg.norm(y_directions, axis=1)[:, numpy.newaxis]
+
+        x_offsets = (numpy.arange(shape[0]) - (shape[0] - 1) / 2.0) * spacing
+        y_offsets = (numpy.arange(shape[1]) - (shape[1] - 1) / 2.0) * spacing
+        x_axis_coords, y_axis_coords = numpy.meshgrid(x_offsets, y_offsets, indexing='ij')
+
+        ras_points = centers[:, numpy.newaxis, numpy.newaxis, :] + \
+                     x_axis_coords[numpy.newaxis, :, :, numpy.newaxis] * x_directions[:, numpy.newaxis, numpy.newaxis, :] + \
+                     y_axis_coords[numpy.newaxis, :, :, numpy.newaxis] * y_directions[:, numpy.newaxis, numpy.newaxis, :]
+        slices_data = self.sample_ras_points(ras_points, order=order, cval=cval)
+
+        n_planes = centers.shape[0]
+        return numpy.repeat(x_axis_coords[numpy.newaxis], n_planes, axis=0), \
+               numpy.repeat(y_axis_coords[numpy.newaxis], n_planes, axis=0), slices_data
+
+    def sample_slices(self, projection: str=SAGITTAL, ras_points: Union[numpy.ndarray, list]=(ORIGIN,),
+                      order: int=0, cval: float=0.0) -> (numpy.ndarray, numpy.ndarray, numpy.ndarray):
+        """
+        Cut a stack of orthogonal slices, e.g. for a mosaic of several slices per projection.
+        Like slice_volume, the slices follow the voxel grid and are returned with their ras axes coordinates,
+        but the slice positions are not rounded to the nearest voxel when order is 1.
+        :param projection: one of sagittal, axial or coronal
+        :param ras_points: 3D points where to do the slicing (n_slices x 3)
+        :param order: 0 for nearest neighbor, 1 for trilinear interpolation
+        :param cval: value for the samples outside the volume
+        :return: X, Y, data matrices, each of shape (n_slices, dimension 1, dimension 2)
+        """
+        ras_points = numpy.reshape(numpy.asarray(ras_points, dtype=numpy.float64), (-1, 3))
+        ijk_points = apply_affine(numpy.linalg.inv(self.affine_matrix), ras_points)
+        if order == 0:
+            ijk_points = numpy.round(ijk_points)
+
+        slice_index_1, slice_index_2 = X_Y_INDEX[projection]
+        fixed_index, = {0, 1, 2} - {slice_index_1, slice_index_2}
+        n_1 = self.dimensions[slice_index_1]
+        n_2 = self.dimensions[slice_index_2]
+
+        ijk_grid = numpy.empty((ras_points.shape[0], n_1, n_2, 3))
+        ijk_grid[:, :, :, fixed_index] = ijk_points[:, fixed_index, numpy.newaxis, numpy.newaxis]
+        ijk_grid[:, :, :, slice_index_1] = numpy.arange(n_1)[:, numpy.newaxis]
+        ijk_grid[:, :, :, slice_index_2] = numpy.arange(n_2)[numpy.newaxis, :]
+        ras_grid = apply_affine(self.affine_matrix, ijk_grid)
+        slices_data = self._map_voxel_coordinates(ijk_grid, order=order, cval=cval)
+
+        return ras_grid[..., slice_index_1], ras_grid[..., slice_index_2], slices_data.reshape(ijk_grid.shape[:-1])
+
+    @staticmethod
+    def get_trajectory_planes(entry: Union[numpy.ndarray, list], target: Union[numpy.ndarray, list],
+                              up: Union[numpy.ndarray, list]=PLANE_NORMALS[AXIAL]) \
+            -> (numpy.ndarray, numpy.ndarray, numpy.ndarray):
+        """
+        Compute two orthogonal oblique planes containing the trajectory from entry to target (e.g. of an electrode).
+        :param entry: ras point where the trajectory starts
+        :param target: ras point where the trajectory ends
+        :param up: reference direction, used to orient the planes (it must not be parallel to the trajectory)
+        :return: centers, x_directions, y_directions of the two planes, to be passed to sample_planes;
+                 the x direction of both planes is along the trajectory
+        """
+        entry = numpy.asarray(entry, dtype=numpy.float64)
+        target = numpy.asarray(target, dtype=numpy.float64)
+        direction = (target - entry) / numpy.linalg.norm(target - entry)
+        normal_1 = numpy.cross(direction, up)
+        normal_1 /= numpy.linalg.norm(normal_1)
+        normal_2 = numpy.cross(normal_1, direction)
+        center = (entry + target) / 2.0
+        return numpy.array([center, center]), numpy.array([direction, direction]), numpy.array([normal_2, normal_1])
@@ -28,13 +28,13 @@ class ImageProcessor(object):
 
     def read_t1_affine_matrix(self) -> np.ndarray:
         t1_volume = IOUtils.read_volume(os.path.join(
-            os.environ[MRI_DIRECTORY], os.environ[T1_RAS_VOLUME]))
+            os.environ[MRI_DIRECTORY], os.environ[T1_RAS_VOLUME]), lazy=True)
         return t1_volume.affine_matrix
 
     def show_single_volume(self, volume_path: os.PathLike, use_cc_point: bool,
                            snapshot_name: os.PathLike=SNAPSHOT_NAME):
 
-        volume = IOUtils.read_volume(volume_path)
+        volume = IOUtils.read_volume(volume_path, lazy=True)
 
         if use_cc_point:
             ras = self.generic_io.get_ras_coordinates(
@@ -59,8 +59,8 @@ class ImageProcessor(object):
     def overlap_2_volumes(self, background_path: os.PathLike, overlay_path: os.PathLike,
                           use_cc_point: bool, snapshot_name: str=SNAPSHOT_NAME):
 
-        background_volume = IOUtils.read_volume(background_path)
-        overlay_volume = IOUtils.read_volume(overlay_path)
+        background_volume = IOUtils.read_volume(background_path, lazy=True)
+        overlay_volume = IOUtils.read_volume(overlay_path, lazy=True)
 
         if use_cc_point:
             ras = self.generic_io.get_ras_coordinates(
@@ -90,9 +90,9 @@ class ImageProcessor(object):
                           overlay_2_path: os.PathLike, use_cc_point: bool,
                           snapshot_name: str=SNAPSHOT_NAME):
 
-        volume_background = IOUtils.read_volume(background_path)
-        volume_overlay_1 = IOUtils.read_volume(overlay_1_path)
-        volume_overlay_2 = IOUtils.read_volume(overlay_2_path)
+        volume_background = IOUtils.read_volume(background_path, lazy=True)
+        volume_overlay_1 = IOUtils.read_volume(overlay_1_path, lazy=True)
+        volume_overlay_2 = IOUtils.read_volume(overlay_2_path, lazy=True)
 
         if use_cc_point:
             ras = self.generic_io.get_ras_coordinates(
@@ -131,7 +131,7 @@ class ImageProcessor(object):
 
     def overlap_volume_surfaces(self, volume_background: os.PathLike, surfaces_path: os.PathLike,
                                 use_center_surface: bool, use_cc_point: bool, snapshot_name: str=SNAPSHOT_NAME):
-        volume = IOUtils.read_volume(volume_background)
+        volume = IOUtils.read_volume(volume_background, lazy=True)
 
         if use_cc_point:
             ras = self.generic_io.get_ras_coordinates(
@@ -142,6 +142,8 @@ class ImageProcessor(object):
         surfaces = [IOUtils.read_surface(os.path.expandvars(surface), use_center_surface) for surface in
                     surfaces_path]
 
+        slices = []
+        planes = []
         for projection in PROJECTIONS:
             try:
                 x, y, background_matrix = volume.slice_volume(projection, ras)
@@ -150,11 +152,16 @@ class ImageProcessor(object):
                 x, y, background_matrix = volume.slice_volume(projection, ras)
                 self.logger.info("The volume center point has been used for %s snapshot of %s and %s.", projection,
                                  volume_background, surfaces_path)
+            slices.append((x, y, background_matrix))
+            planes.append((projection, ras))
 
+        surfaces_contours = [surface.cut_by_planes(planes) for surface in surfaces]
+
+        for plane_index, (projection, _) in enumerate(planes):
+            x, y, background_matrix = slices[plane_index]
             clear_flag = True
-            for surface_index, surface in enumerate(surfaces):
-                surf_x_array, surf_y_array = surface.cut_by_plane(
-                    projection, ras)
+            for surface_index, surface_contours in enumerate(surfaces_contours):
+                surf_x_array, surf_y_array = surface_contours[plane_index]
                 self.writer.write_matrix_and_surfaces(x, y, background_matrix, surf_x_array, surf_y_array,
                                                       surface_index, clear_flag)
                 clear_flag = False
@@ -182,7 +189,7 @@ class ImageProcessor(object):
 
         """
 
-        aparc_aseg_volume = IOUtils.read_volume(aparc_aseg_volume_path)
+        aparc_aseg_volume = IOUtils.read_volume(aparc_aseg_volume_path, lazy=True)
 
         fs_to_conn_indices_mapping = {}
         with open(fs_to_conn_indices_mapping_path, 'r') as fd:
@@ -204,7 +211,7 @@ class ImageProcessor(object):
 
         background_volume = None
         if background_volume_path:
-            background_volume = IOUtils.read_volume(background_volume_path)
+            background_volume = IOUtils.read_volume(background_volume_path, lazy=True)
 
         for projection in PROJECTIONS:
             self._aparc_aseg_projection(
@@ -230,15 +237,12 @@ class ImageProcessor(object):
 
         x_axis_coords, y_axis_coords, aparc_aseg_matrix  = slice
 
-        for i, row in enumerate(aparc_aseg_matrix):
-            for j, el in enumerate(row):
-                if el > 0:
-                    if el in fs_to_conn_indices_mapping:
-                        idx = fs_to_conn_indices_mapping.get(el)
-                        new_val = conn_measure[int(idx)]
-                        aparc_aseg_matrix[i, j] = new_val
-                    else:
-                        aparc_aseg_matrix[i, j] = -1
+        # Map every distinct (positive) label of the slice to its connectivity measure, -1 if it is not mapped
+        labels, labels_inverse = np.unique(aparc_aseg_matrix, return_inverse=True)
+        new_values = np.array([(conn_measure[int(fs_to_conn_indices_mapping[label])]
+                                if label in fs_to_conn_indices_mapping else -1) if label > 0 else label
+                               for label in labels], dtype=aparc_aseg_matrix.dtype)
+        aparc_aseg_matrix = new_values[labels_inverse].reshape(aparc_aseg_matrix.shape)
 
         if background_volume_path == '':
             self.writer.write_matrix(x_axis_coords, y_axis_coords, aparc_aseg_matrix,
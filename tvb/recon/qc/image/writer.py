@@ -10,7 +10,7 @@ from mpl_toolkits.mplot3d import Axes3D
 from tvb.recon.logger import get_logger
 from tvb.recon.model.constants import SNAPSHOT_EXTENSION
 from tvb.recon.model.surface import Surface
-from tvb.recon.model.annotation import Annotation
+from tvb.recon.model.annotation import Annotation, FACE_COLORS_AVERAGE
 
 
 class ImageWriter(object):
@@ -66,7 +66,8 @@ class ImageWriter(object):
                        bbox_inches='tight', pad_inches=0.0)
 
     def write_surface_with_annotation(self, surface: Surface, annot: Annotation, result_name:str,
-                                      positions: list=[(0, 0), (0, 90), (0, 180), (0, 270), (90, 0), (270, 0)]):
+                                      positions: list=[(0, 0), (0, 90), (0, 180), (0, 270), (90, 0), (270, 0)],
+                                      face_colors_mode: str=FACE_COLORS_AVERAGE):
         x = surface.vertices[:, 0]
         y = surface.vertices[:, 1]
         z = surface.vertices[:, 2]
@@ -83,7 +84,7 @@ class ImageWriter(object):
         ax.set_zlim3d(min, max)
 
         if annot is not None:
-            face_colors = annot.compute_face_colors(surface.triangles)
+            face_colors = annot.compute_face_colors(surface.triangles, face_colors_mode)
             normals = surface.compute_normals()
             face_colors = ax._shade_colors(face_colors, normals)
 
@@ -29,15 +29,15 @@ def compute_region_details(atlas_suffix: AtlasSuffix, fs_color_lut: os.PathLike,
 
     surface_service = SurfaceService()
 
-    surf_cort_lh = IOUtils.read_surface(lh_cort, False)
-    surf_cort_rh = IOUtils.read_surface(rh_cort, False)
+    surf_cort_lh = IOUtils.read_surface(lh_cort, False, compact=True)
+    surf_cort_rh = IOUtils.read_surface(rh_cort, False, compact=True)
 
-    full_cort_surface = surface_service.merge_surfaces([surf_cort_lh, surf_cort_rh])
+    full_cort_surface = surface_service.merge_surfaces([surf_cort_lh, surf_cort_rh], compact=True)
 
-    surf_subcort_lh = IOUtils.read_surface(lh_subcort, False)
-    surf_subcort_rh = IOUtils.read_surface(rh_subcort, False)
+    surf_subcort_lh = IOUtils.read_surface(lh_subcort, False, compact=True)
+    surf_subcort_rh = IOUtils.read_surface(rh_subcort, False, compact=True)
 
-    full_subcort_surface = surface_service.merge_surfaces([surf_subcort_lh, surf_subcort_rh])
+    full_subcort_surface = surface_service.merge_surfaces([surf_subcort_lh, surf_subcort_rh], compact=True)
 
     genericIO.write_list_to_txt_file(mapping.cort_region_mapping, AsegFiles.RM_CORT_TXT.value.replace("%s", atlas_suffix))
     genericIO.write_list_to_txt_file(mapping.subcort_region_mapping,
@@ -54,18 +54,21 @@ def compute_region_details(atlas_suffix: AtlasSuffix, fs_color_lut: os.PathLike,
 
     os.remove(vox2ras_file)
 
-    cort_subcort_full_surf = surface_service.merge_surfaces([full_cort_surface, full_subcort_surface])
-    cort_subcort_full_region_mapping = mapping.cort_region_mapping + mapping.subcort_region_mapping
+    cort_subcort_full_surf = surface_service.merge_surfaces([full_cort_surface, full_subcort_surface],
+                                                            compact=True)
+    # the vertices are grouped by region once, for the areas, centers and orientations below
+    cort_subcort_full_region_index = surface_service.get_region_index(
+        mapping.cort_region_mapping + mapping.subcort_region_mapping)
 
     dict_fs_custom = mapping.get_mapping_for_connectome_generation()
     genericIO.write_dict_to_txt_file(dict_fs_custom, AsegFiles.FS_CUSTOM_TXT.value.replace("%s", atlas_suffix))
 
     region_areas = surface_service.compute_areas_for_regions(mapping.get_all_regions(), cort_subcort_full_surf,
-                                                             cort_subcort_full_region_mapping)
+                                                             cort_subcort_full_region_index)
     genericIO.write_list_to_txt_file(region_areas, AsegFiles.AREAS_TXT.value.replace("%s", atlas_suffix))
 
     region_centers = surface_service.compute_centers_for_regions(mapping.get_all_regions(), cort_subcort_full_surf,
-                                                                 cort_subcort_full_region_mapping)
+                                                                 cort_subcort_full_region_index)
     cort_subcort_lut = mapping.get_entire_lut()
     region_names = list(cort_subcort_lut.values())
 
@@ -75,22 +78,24 @@ def compute_region_details(atlas_suffix: AtlasSuffix, fs_color_lut: os.PathLike,
 
     region_orientations = surface_service.compute_orientations_for_regions(mapping.get_all_regions(),
                                                                            cort_subcort_full_surf,
-                                                                           cort_subcort_full_region_mapping)
+                                                                           cort_subcort_full_region_index)
 
+    lh_region_index = surface_service.get_region_index(mapping.lh_region_mapping)
     lh_region_centers = surface_service.compute_centers_for_regions(mapping.get_lh_regions(), surf_cort_lh,
-                                                                    mapping.lh_region_mapping)
+                                                                    lh_region_index)
     lh_region_orientations = surface_service.compute_orientations_for_regions(mapping.get_lh_regions(), surf_cort_lh,
-                                                                              mapping.lh_region_mapping)
+                                                                              lh_region_index)
     with open(AsegFiles.LH_DIPOLES_TXT.value.replace("%s", atlas_suffix), "w") as f:
         for idx, (val_x, val_y, val_z) in enumerate(lh_region_centers):
             f.write("%.2f %.2f %.2f %.2f %.2f %.2f\n" % (
                 val_x, val_y, val_z, lh_region_orientations[idx][0], lh_region_orientations[idx][1],
                 lh_region_orientations[idx][2]))
 
+    rh_region_index = surface_service.get_region_index(mapping.rh_region_mapping)
     rh_region_centers = surface_service.compute_centers_for_regions(mapping.get_rh_regions(), surf_cort_rh,
-                                                                    mapping.rh_region_mapping)
+                                                                    rh_region_index)
     rh_region_orientations = surface_service.compute_orientations_for_regions(mapping.get_rh_regions(), surf_cort_rh,
-                                                                              mapping.rh_region_mapping)
+                                                                              rh_region_index)
     with open(AsegFiles.RH_DIPOLES_TXT.value.replace("%s", atlas_suffix), "w") as f:
         for idx, (val_x, val_y, val_z) in enumerate(rh_region_centers):
             f.write("%.2f %.2f %.2f %.2f %.2f %.2f\n" % (
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import os
+import gdist
 import numpy
+from scipy.sparse import load_npz
 from numpy.testing import assert_array_equal
 from tvb.recon.algo.service.surface import SurfaceService
 from tvb.recon.io.annotation import AnnotationIO
 from tvb.recon.io.factory import IOUtils
 from tvb.recon.io.surface import FreesurferIO, H5SurfaceIO
-from tvb.recon.model.surface import Surface
+from tvb.recon.model.annotation import Annotation
+from tvb.recon.model.component_tracker import ComponentTracker
+from tvb.recon.model.surface import Surface, SubSurface
 from tvb.recon.tests.base import (
     get_data_file, get_temporary_files_path, data_path)
 from ..base import BaseTest
@@ -27,6 +31,131 @@ class SurfaceTest(BaseTest):
         area = self.service.tri_area(surface.vertices[surface.triangles[rfi]])
         self.assertEqual(5000, area[0])
 
+    def test_surface_geometry(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        geometry = surface.get_geometry()
+        numpy.testing.assert_allclose(geometry["triangle_angles"].sum(axis=1), numpy.pi, rtol=1e-6)
+        numpy.testing.assert_allclose(geometry["vertex_areas"].sum(), geometry["triangle_areas"].sum())
+        numpy.testing.assert_allclose(numpy.linalg.norm(geometry["vertex_normals"], axis=1), 1.0, rtol=1e-6)
+        self.assertEqual(geometry["vertex_triangles"][0], [0, 8, 11])
+        assert_array_equal(geometry["triangle_normals"], surface.compute_normals())
+        assert_array_equal(geometry["vertex_areas"], surface.get_vertex_areas())
+
+    def test_surface_cache(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        areas = surface.get_triangle_areas()
+        self.assertIs(areas, surface.get_triangle_areas())
+        self.assertFalse(areas.flags.writeable)
+        self.assertEqual(surface.get_edges().shape, (36, 2))
+        adjacency = surface.get_vertex_adjacency()
+        self.assertEqual((adjacency != adjacency.T).nnz, 0)
+
+        surface.add_vertices_and_triangles(surface.vertices, surface.triangles)
+        self.assertEqual(surface.n_vertices, 32)
+        self.assertEqual(surface.n_triangles, 48)
+        self.assertEqual(surface.get_triangle_areas().shape, (48, 1))
+        self.assertEqual(surface.get_edges().shape, (72, 2))
+
+    def test_sparse_incidence_and_adjacency(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        incidence = surface.get_vertex_triangle_incidence()
+        self.assertEqual(incidence.shape, (16, 24))
+        assert_array_equal(incidence.sum(axis=0), 3)
+        assert_array_equal(incidence[0].indices, [0, 8, 11])
+        adjacency = surface.get_vertex_adjacency(weighted=True)
+        self.assertEqual(adjacency[0, 1], 100)
+        self.assertEqual(adjacency[0, 4], 48)
+        self.assertEqual(adjacency[0, 10], 0)
+
+    def test_compute_areas_for_regions(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        region_mapping = [0] * 8 + [1] * 8
+        areas = self.service.compute_areas_for_regions([1, 0, 2], surface, region_mapping)
+        numpy.testing.assert_allclose(areas, [surface.get_triangle_areas()[12:].sum(),
+                                              surface.get_triangle_areas()[:12].sum(), 0])
+
+    def test_compute_centers_and_orientations_for_regions(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        annotation = Annotation([0] * 8 + [1] * 8, numpy.array([]), [])
+        region_index = self.service.get_region_index(annotation)
+        self.assertIs(region_index, annotation.get_region_index())
+        assert_array_equal(region_index.counts, [8, 8])
+        centers = self.service.compute_centers_for_regions([1, 0, 2], surface, region_index)
+        numpy.testing.assert_allclose(centers, [surface.vertices[8:].mean(axis=0),
+                                                surface.vertices[:8].mean(axis=0), [0, 0, 0]])
+        orientations = self.service.compute_orientations_for_regions([1, 2], surface, annotation.region_mapping)
+        mean_normal = surface.vertex_normals()[8:].mean(axis=0)
+        numpy.testing.assert_allclose(orientations, [mean_normal / numpy.linalg.norm(mean_normal), [0, 0, 0]])
+
+    def test_connected_surface_components(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        n_components, components, areas = self.service.connected_surface_components(surface=surface)
+        self.assertEqual(n_components, 2)
+        assert_array_equal(components, [0] * 8 + [1] * 8)
+        numpy.testing.assert_allclose(areas, [surface.get_triangle_areas()[:12].sum(),
+                                              surface.get_triangle_areas()[12:].sum()])
+
+    def test_component_tracker(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        connectivity = self.service.vertex_connectivity(surface, symmetric=True)
+        tracker = ComponentTracker(connectivity, [0, 8])
+        self.assertEqual(tracker.n_components, 2)
+        tracker.add(numpy.arange(16) < 8)
+        self.assertEqual(tracker.n_components, 2)
+        assert_array_equal(tracker.get_labels(), [0] * 8 + [1] + [-1] * 7)
+        tracker.remove([8])
+        self.assertEqual(tracker.n_components, 1)
+        tracker.add([9, 10, 11])
+        components = self.service.connected_surface_components(surface, connectivity, tracker.members)[:2]
+        self.assertEqual(tracker.n_components, components[0])
+        assert_array_equal(tracker.get_labels(), components[1])
+
+        assert_array_equal(self.service.count_components_of_labels(connectivity, [0] * 8 + [1] * 8), [1, 1])
+        assert_array_equal(self.service.count_components_of_labels(connectivity, [0] * 16), [2])
+        assert_array_equal(self.service.count_components_of_labels(connectivity, [1] * 8 + [-1] * 8), [0, 1])
+
+    def test_compute_gdist_mat(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        os.makedirs(self.temp_file_path('subject', 'surf'))
+        for h, part in zip('rl', [slice(0, 12), slice(12, 24)]):
+            hemisphere = Surface(surface.vertices, surface.triangles[part])
+            FreesurferIO().write(hemisphere, self.temp_file_path('subject', 'surf', h + 'h.pial'))
+        mat_paths = self.service.compute_gdist_mat(max_distance=120.0, n_processes=2, chunk_size=5,
+                                                   subjects_dir=self.temp_dir.name, subject='subject')
+        self.assertEqual(mat_paths, [self.temp_file_path('subject', 'surf', h + 'h.pial.gdist.120mm.npz') for h in 'rl'])
+        self.assertEqual(sorted(os.listdir(self.temp_file_path('subject', 'surf'))),
+                         ['lh.pial', 'lh.pial.gdist.120mm.npz', 'rh.pial', 'rh.pial.gdist.120mm.npz'])
+        for h, mat_path in zip('rl', mat_paths):
+            hemisphere = FreesurferIO().read(self.temp_file_path('subject', 'surf', h + 'h.pial'), False)
+            expected = gdist.local_gdist_matrix(hemisphere.vertices.astype('float64'),
+                                                hemisphere.triangles.astype('<i4'), max_distance=120.0)
+            mat = load_npz(mat_path)
+            self.assertEqual(mat.nnz, expected.nnz)
+            numpy.testing.assert_allclose(mat.toarray(), expected.toarray())
+
+        # a matrix of another max_distance is computed, not taken from the existing one
+        short_mat_paths = self.service.compute_gdist_mat(max_distance=60.0, n_processes=1,
+                                                         subjects_dir=self.temp_dir.name, subject='subject')
+        self.assertEqual(short_mat_paths[0], self.temp_file_path('subject', 'surf', 'rh.pial.gdist.60mm.npz'))
+        for mat_path, short_mat_path in zip(mat_paths, short_mat_paths):
+            self.assertLess(load_npz(short_mat_path).nnz, load_npz(mat_path).nnz)
+
+    def test_compute_gdist_mat_isolated_vertex(self):
+        vertices = numpy.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 1.0, 0.0], [50.0, 50.0, 50.0]])
+        triangles = numpy.array([[0, 1, 2], [1, 3, 2]])
+        os.makedirs(self.temp_file_path('subject', 'surf'))
+        for h in 'rl':
+            FreesurferIO().write(Surface(vertices, triangles), self.temp_file_path('subject', 'surf', h + 'h.pial'))
+        # the last chunk holds only the vertex of no triangle, far from the others
+        mat_paths = self.service.compute_gdist_mat(max_distance=10.0, n_processes=1, chunk_size=2,
+                                                   subjects_dir=self.temp_dir.name, subject='subject')
+        expected = gdist.local_gdist_matrix(vertices, triangles.astype('<i4'), max_distance=10.0)
+        for mat_path in mat_paths:
+            mat = load_npz(mat_path)
+            self.assertEqual(mat.shape, (5, 5))
+            self.assertEqual(mat[4].nnz, 0)
+            numpy.testing.assert_allclose(mat.toarray(), expected.toarray())
+
     def test_merge_surfaces(self,):
         h5_surface_path = get_data_file("head2", "SurfaceCortical.h5")
         h5_surface = IOUtils.read_surface(h5_surface_path, False)
@@ -54,6 +183,92 @@ class SurfaceTest(BaseTest):
                          len(lh_surface.triangles) + len(rh_surface.triangles))
         #assert len(out_region_mapping) == len(lh_region_mapping) + len(rh_region_mapping)
 
+    def test_compact_surface(self):
+        h5_surface_path = get_data_file("head2", "SurfaceCortical.h5")
+        surface = IOUtils.read_surface(h5_surface_path, False)
+        compact_surface = IOUtils.read_surface(h5_surface_path, False, compact=True)
+        self.assertEqual(compact_surface.vertices.dtype, numpy.float32)
+        self.assertEqual(compact_surface.triangles.dtype, numpy.int32)
+        numpy.testing.assert_allclose(compact_surface.get_vertex_areas(), surface.get_vertex_areas(), rtol=1e-6)
+
+        out_surface = self.service.merge_surfaces([compact_surface, surface], compact=True)
+        self.assertEqual(out_surface.vertices.dtype, numpy.float32)
+        self.assertEqual(out_surface.triangles.dtype, numpy.int32)
+        assert_array_equal(out_surface.triangles[24:], surface.triangles + 16)
+        self.assertEqual(out_surface.area_mask.shape, (32,))
+
+        surface.make_compact(memmap_dir=self.temp_dir.name)
+        self.assertIsInstance(surface.vertices, numpy.memmap)
+        assert_array_equal(surface.vertices, compact_surface.vertices)
+        assert_array_equal(surface.get_triangle_areas(), compact_surface.get_triangle_areas())
+
+    def test_cut_by_planes(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        surface.center_ras = [0, 0, 0]
+        contours = surface.cut_by_planes([("sagittal", [0, 0, 0]), ("sagittal", [25, 0, 0]), ("axial", [0, 0, 0])])
+        self.assertEqual(len(contours), 3)
+        self.assertEqual(contours[0], ([], []))
+        # the plane x=25 cuts the 100 x 100 side faces of the right box
+        x_array, y_array = contours[1]
+        self.assertEqual(len(x_array), 8)
+        lengths = [numpy.hypot(numpy.diff(x), numpy.diff(y)) for x, y in zip(x_array, y_array)]
+        numpy.testing.assert_allclose(numpy.sum(lengths), 400)
+        x_array, y_array = surface.cut_by_plane("axial", [0, 0, 0])
+        assert_array_equal(x_array, contours[2][0])
+        assert_array_equal(y_array, contours[2][1])
+
+    def test_spatial_index(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        index = surface.get_spatial_index()
+        self.assertIs(index, surface.get_spatial_index())
+        distances, nearest = index.query_nearest([[49, 49, 49], [-3, -50, -50]])
+        assert_array_equal(nearest, [0, 11])
+        numpy.testing.assert_allclose(distances, [numpy.sqrt(3), 1])
+        assert_array_equal(index.query_radius([[26, 50, 50]], 25)[0], [0, 4])
+
+    def test_compute_consim_affinity(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        vertices = surface.vertices.copy()
+        vox = numpy.array([1, 2])
+        voxxzy = numpy.array([[40, 0, 0], [-40, 0, 0]])
+        con = numpy.array([[1.0, 0.2], [0.2, 1.0]])
+        affinity = self.service.compute_consim_affinity(vertices, vox, voxxzy, con, cras=[1, 0, 0])
+        assert_array_equal(vertices, surface.vertices)
+        # vertices with x >= 2 are nearest to the first voxel node, those with x <= -2 to the second
+        assert_array_equal(affinity, numpy.where((vertices[:, 0] > 0)[:, None] == (vertices[:, 0] > 0), 1.0, 0.2))
+
+    def test_sub_surface_view(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        verts_mask = numpy.arange(16) >= 8
+        subsurf = self.service.extract_subsurf(surface, verts_mask)
+        assert_array_equal(subsurf.vertices, surface.vertices[8:])
+        assert_array_equal(subsurf.triangles, surface.triangles[12:] - 8)
+
+        view = self.service.extract_subsurf(surface, verts_mask, output='view')
+        self.assertIsInstance(view, SubSurface)
+        assert_array_equal(view.vertices, subsurf.vertices)
+        assert_array_equal(view.triangles, subsurf.triangles)
+        assert_array_equal(view.get_triangle_areas(), surface.get_triangle_areas()[12:])
+        self.assertEqual(self.service.compute_surface_area(view), self.service.compute_surface_area(subsurf))
+        # the vertices are gathered once
+        self.assertIs(view.vertices, view.vertices)
+        self.assertFalse(view.vertices.flags.writeable)
+        # a view of a view refers to the root surface, with the area mask of its immediate parent
+        view.area_mask = numpy.arange(8) % 2 == 0
+        nested_view = SubSurface(view, numpy.arange(8) < 4)
+        self.assertIs(nested_view.parent, surface)
+        assert_array_equal(nested_view.vertex_indices, [8, 9, 10, 11])
+        assert_array_equal(nested_view.area_mask, [True, False, True, False])
+
+    def test_near_labels(self):
+        data = numpy.zeros((6, 6, 6), dtype='i')
+        data[1, 1, 1] = 3
+        data[4, 4, 4] = 5
+        ijk = numpy.array([[1, 1, 1], [2, 2, 2], [3, 1, 1], [4, 4, 4], [5, 5, 5], [-1, 0, 0], [-2, 0, 0]])
+        assert_array_equal(self.service._near_labels(data, ijk, [3]), [1, 0, 0, 0, 0, 0, 0])
+        assert_array_equal(self.service._near_labels(data, ijk, [3, 5], 1), [1, 1, 0, 1, 1, 0, 0])
+        assert_array_equal(self.service._near_labels(data, ijk, [3], 2), [1, 1, 1, 0, 0, 1, 0])
+
     def test_extract_subsurf(self,):
         surface_parser = FreesurferIO()
         annot_parser = AnnotationIO()
@@ -111,3 +326,16 @@ class SurfaceTest(BaseTest):
         self.assertEqual(conn.shape, (16, 16))
         self.assertEqual(conn[0, 1], 100)
         self.assertEqual(conn[0, 10], 0)
+
+    def test_vertex_connectivity_symmetric(self):
+        surface = H5SurfaceIO().read(get_data_file('head2', 'SurfaceCortical.h5'))
+        conn = self.service.vertex_connectivity(surface, metric='euclidean', symmetric=True)
+        self.assertEqual(conn.dtype, numpy.float32)
+        self.assertEqual(conn.nnz, 72)
+        self.assertEqual((conn != conn.T).nnz, 0)
+        self.assertEqual(conn[1, 0], 100)
+        self.assertIs(conn, self.service.vertex_connectivity(surface, metric='euclidean', symmetric=True))
+        dense = self.service.vertex_connectivity(surface, mode="2D", metric='euclidean', symmetric=True)
+        assert_array_equal(dense, conn.toarray())
+        sub_conn = self.service.vertex_connectivity(surface, symmetric=True, verts_mask=numpy.arange(16) < 8)
+        assert_array_equal(sub_conn.toarray(), conn[:8, :8].toarray() > 0)
@@ -3,8 +3,11 @@
 import os
 
 import numpy
+import pytest
+import scipy.sparse
 
 from tvb.recon.algo.service.volume import VolumeService
+from tvb.recon.dax import AtlasSuffix
 from tvb.recon.io.factory import IOUtils
 from tvb.recon.model.volume import Volume
 from tvb.recon.tests.base import get_temporary_files_path, remove_temporary_test_files
@@ -61,8 +64,13 @@ def test_label_with_dilation():
     assert os.path.exists(ct_result)
 
     vol = IOUtils.read_volume(ct_result)
-    # TODO: Once TODO inside volume service (label_with_dilation) is resolved, we need to adjust this assert.
-    # assert numpy.array_equal(numpy.unique(vol.data), [0, 1, 2, 3])
+    assert numpy.array_equal(numpy.unique(vol.data), [0, 1, 2, 3])
+    # the objects are labeled along the AP (here j) axis
+    assert numpy.array_equal(vol.data, ct_mask_data * numpy.array(
+        [[[0, 0, 0], [2, 2, 2], [0, 2, 0]], [[1, 1, 1], [0, 0, 0], [0, 0, 0]], [[0, 1, 1], [0, 0, 0], [0, 3, 3]]]))
+
+    service.label_with_dilation(ct_mask_path, ct_dil_mask_path, ct_result, min_size=3)
+    assert numpy.array_equal(numpy.unique(IOUtils.read_volume(ct_result).data), [0, 1, 2])
 
 
 def test_remove_zero_connectivity():
@@ -94,3 +102,276 @@ def test_remove_zero_connectivity():
 
     conn = numpy.array(numpy.genfromtxt(connectivity_path, dtype='int64'))
     assert numpy.array_equal(conn, [[20, 1, 3], [1, 20, 2], [3, 2, 20]])
+
+
+def test_remove_zero_connectivity_binary_only():
+    data = numpy.array([[[0, 0, 1], [2, 3, 0]], [[4, 0, 0], [0, 0, 0]]])
+    volume_path = get_temporary_files_path("tdi_lbl_binary_only.nii.gz")
+    IOUtils.write_volume(volume_path, Volume(data, numpy.identity(4), None))
+
+    in_connectivity = numpy.array(
+        [[10, 1, 0, 3], [0, 10, 0, 2], [0, 0, 0, 0], [0, 0, 0, 10]])
+    connectivity_path = get_temporary_files_path("conn_binary_only.csv")
+    numpy.savetxt(connectivity_path, in_connectivity, fmt='%1d')
+
+    VolumeService().remove_zero_connectivity_nodes(volume_path, connectivity_path, binary_only=True)
+
+    conn = numpy.load(get_temporary_files_path("conn_binary_only.npy"))
+    assert numpy.array_equal(conn, [[20, 1, 3], [1, 20, 2], [3, 2, 20]])
+    # the text matrix is left unchanged
+    assert numpy.array_equal(numpy.genfromtxt(connectivity_path, dtype='int64'), in_connectivity)
+
+
+def test_slice_volume():
+    data = numpy.arange(4 * 5 * 6).reshape((4, 5, 6))
+    affine = numpy.array([[2.0, 0, 0, -4], [0, 1.0, 0, -2], [0, 0, 0.5, 1], [0, 0, 0, 1]])
+    volume = Volume(data, affine, None)
+    x, y, slice_data = volume.slice_volume("coronal", [0, 1, 0])
+    assert slice_data.shape == (4, 6)
+    assert slice_data.dtype == numpy.float64
+    assert numpy.array_equal(slice_data, data[:, 3, :])
+    assert numpy.array_equal(x, numpy.repeat([[-4.0], [-2.0], [0.0], [2.0]], 6, axis=1))
+    assert numpy.array_equal(y, numpy.repeat([numpy.arange(6) * 0.5 + 1], 4, axis=0))
+
+    volume_4d = Volume(numpy.stack((data, -data), axis=3), affine, None)
+    assert numpy.array_equal(volume_4d.slice_volume("axial", [0, 0, 2])[2], data[:, :, 2])
+
+    with pytest.raises(IndexError):
+        volume.slice_volume("sagittal", [100, 0, 0])
+
+
+def test_sample_slices_and_planes():
+    data = numpy.arange(4 * 5 * 6, dtype=float).reshape((4, 5, 6))
+    affine = numpy.array([[2.0, 0, 0, -4], [0, 1.0, 0, -2], [0, 0, 0.5, 1], [0, 0, 0, 1]])
+    volume = Volume(data, affine, None)
+    ras_points = [[0, 1, 0], [0, 0, 0], [0, -1, 0]]
+    x, y, slices_data = volume.sample_slices("coronal", ras_points)
+    assert slices_data.shape == (3, 4, 6)
+    for i, ras in enumerate(ras_points):
+        for stacked, single in zip((x, y, slices_data), volume.slice_volume("coronal", ras)):
+            assert numpy.array_equal(stacked[i], single)
+    # trilinear interpolation halfway between two coronal slices
+    slices_data = volume.sample_slices("coronal", [[0, 0.5, 0]], order=1)[2]
+    assert numpy.allclose(slices_data[0], (data[:, 2, :] + data[:, 3, :]) / 2)
+
+    # an oblique plane along the voxel diagonal of the first two axes
+    x, y, planes_data = volume.sample_planes([[-2, 0, 2]], [[2, 1, 0]], [[0, 0, 1]], (3, 1),
+                                             spacing=numpy.sqrt(5), order=1)
+    assert x.shape == y.shape == planes_data.shape == (1, 3, 1)
+    assert numpy.allclose(planes_data[0, :, 0], data[[0, 1, 2], [1, 2, 3], 2])
+    assert numpy.allclose(x[0, :, 0], [-numpy.sqrt(5), 0, numpy.sqrt(5)])
+
+    centers, x_directions, y_directions = Volume.get_trajectory_planes([0, 0, 0], [10, 0, 0])
+    assert numpy.allclose(x_directions, [[1, 0, 0], [1, 0, 0]])
+    assert numpy.allclose(numpy.abs(y_directions), [[0, 0, 1], [0, 1, 0]])
+
+
+def test_lazy_volume():
+    data = numpy.arange(4 * 5 * 6, dtype='int16').reshape((4, 5, 6))
+    affine = numpy.diag([2.0, 1.0, 0.5, 1.0])
+    volume_path = get_temporary_files_path("lazy_volume.nii.gz")
+    IOUtils.write_volume(volume_path, Volume(data, affine, None))
+
+    volume = IOUtils.read_volume(volume_path, lazy=True)
+    assert volume.is_lazy()
+    assert volume.dimensions == (4, 5, 6)
+    _, _, slice_data = volume.slice_volume("axial", [0, 0, 1])
+    assert numpy.array_equal(slice_data, data[:, :, 2])
+    assert numpy.array_equal(volume.sample_slices("sagittal", [[2, 0, 0]])[2][0], data[1])
+    assert volume.is_lazy()
+    assert volume.data.dtype == numpy.int16
+    assert numpy.array_equal(volume.data, data)
+    assert not volume.is_lazy()
+
+
+def test_label_index():
+    data = numpy.array([[[0, 0, 1], [2, 3, 0]], [[2, 1, 3], [3, 1, 0]]])
+    label_index = Volume(data, numpy.identity(4), None).get_label_index()
+    assert numpy.array_equal(label_index.labels, [0, 1, 2, 3])
+    assert numpy.array_equal(label_index.counts, [4, 3, 2, 3])
+    for label in range(5):
+        for indices, expected in zip(label_index.get_indices(label), numpy.where(data == label)):
+            assert numpy.array_equal(indices, expected)
+    assert numpy.array_equal(label_index.get_coords(3), numpy.argwhere(data == 3))
+    assert numpy.array_equal(label_index.get_labels_flat_indices([3, 5, 2]), [4, 8, 9, 3, 6])
+    assert numpy.array_equal(label_index.reduce(numpy.ones(data.shape)), label_index.counts)
+    assert numpy.array_equal(label_index.paint([10, 11, 12, 13]), data + 10)
+
+    affine = numpy.array([[2.0, 0, 0, 1], [0, 1.0, 0, 0], [0, 0, 1.0, 0], [0, 0, 0, 1]])
+    centers = dict(VolumeService().compute_label_volume_centers(data, affine))
+    assert numpy.allclose(centers[2], [2 * 0.5 + 1, 0.5, 0])
+
+
+def test_gen_label_volume_from_labels_inds():
+    data = numpy.array([[[0, 0, 1], [2, 3, 0]], [[2, 1, 3], [3, 1, 0]]])
+    in_path = get_temporary_files_path("labels_inds_in.nii.gz")
+    out_path = get_temporary_files_path("labels_inds_out.nii.gz")
+    IOUtils.write_volume(in_path, Volume(data, numpy.identity(4), None))
+    VolumeService().gen_label_volume_from_labels_inds([0.5, 1.5], in_path, out_path)
+    out_data = IOUtils.read_volume(out_path).data
+    assert numpy.array_equal(out_data, numpy.choose(data, [numpy.nan, 0.5, 1.5, numpy.nan]), equal_nan=True)
+
+
+def test_vol_to_ext_surf_vol():
+    data = numpy.zeros((4, 4, 4), dtype='i')
+    data[:3, :3, :3] = 5
+    in_path = get_temporary_files_path("ext_surf_in.nii.gz")
+    out_path = get_temporary_files_path("ext_surf_out.nii.gz")
+    IOUtils.write_volume(in_path, Volume(data, numpy.identity(4), None))
+    VolumeService().vol_to_ext_surf_vol(in_path, labels="5", out_vol_path=out_path, labels_inner="1")
+    # neighbors outside the image are ignored, so that only the voxels next to the 0 ones are on the surface
+    surface_ijk = numpy.argwhere(data == 5)
+    surface_ijk = surface_ijk[surface_ijk.max(axis=1) == 2]
+    expected_data = numpy.where(data == 5, 1, 0)
+    expected_data[tuple(surface_ijk.T)] = 5
+    assert numpy.array_equal(IOUtils.read_volume(out_path).data, expected_data)
+    out_ijk = numpy.load(os.path.splitext(out_path)[0] + "-idx.npy")
+    assert numpy.array_equal(out_ijk, surface_ijk)
+
+
+def test_mask_to_vol():
+    data = numpy.zeros((5, 5, 5), dtype='i')
+    data[:, :, :2] = 7
+    mask_data = numpy.zeros((5, 5, 5))
+    mask_data[0, 0, 0] = 1.0
+    in_path = get_temporary_files_path("mask_to_vol_in.nii.gz")
+    mask_path = get_temporary_files_path("mask_to_vol_mask.nii.gz")
+    IOUtils.write_volume(in_path, Volume(data, numpy.identity(4), None))
+    IOUtils.write_volume(mask_path, Volume(mask_data, numpy.identity(4), None))
+    service = VolumeService()
+
+    out_path = get_temporary_files_path("mask_to_vol_out_0.nii.gz")
+    service.mask_to_vol(in_path, mask_path, out_path, labels="7", vn=0)
+    assert numpy.array_equal(numpy.argwhere(IOUtils.read_volume(out_path).data), [[0, 0, 0]])
+
+    # with a neighborhood of 1 voxel, the label voxels sharing at least a corner with the mask voxel are kept
+    out_path = get_temporary_files_path("mask_to_vol_out_1.nii.gz")
+    service.mask_to_vol(in_path, mask_path, out_path, labels="7", vn=1, labels_mask="2")
+    expected_ijk = numpy.argwhere(numpy.ones((2, 2, 2)))
+    assert numpy.array_equal(numpy.argwhere(IOUtils.read_volume(out_path).data == 2), expected_ijk)
+    assert numpy.array_equal(numpy.load(os.path.splitext(out_path)[0] + "-idx.npy"), expected_ijk)
+
+
+def test_change_labels_of_aparc_aseg():
+    data = numpy.array([[[0, 10, 1000], [1001, 2000, 10]]], dtype='int32')
+    volume = Volume(data, numpy.identity(4), None)
+    mapping_dict = {0: 0, 10: 1, 1001: 2, 11100: 3}
+    volume = VolumeService().change_labels_of_aparc_aseg(AtlasSuffix.A2009S, volume, mapping_dict, 4)
+    assert volume.data.dtype == numpy.int8
+    assert numpy.array_equal(volume.data, [[[0, 1, 3], [2, -1, 1]]])
+
+    for max_label, dtype in ((127, numpy.int8), (128, numpy.int16), (32768, numpy.int32)):
+        volume = Volume(data.copy(), numpy.identity(4), None)
+        mapping_dict = {0: 0, 10: 1, 1001: 2, 11100: max_label}
+        volume = VolumeService().change_labels_of_aparc_aseg(AtlasSuffix.A2009S, volume, mapping_dict, max_label + 1)
+        assert volume.data.dtype == dtype
+        assert numpy.array_equal(volume.data, [[[0, 1, max_label], [2, -1, 1]]])
+
+
+def test_gen_label_volume_from_coords():
+    ref_path = get_temporary_files_path("coords_ref.nii.gz")
+    out_path = get_temporary_files_path("coords_out.nii.gz")
+    IOUtils.write_volume(ref_path, Volume(numpy.zeros((5, 5, 5)), numpy.identity(4), None))
+    out_nii = VolumeService().gen_label_volume_from_coords(
+        [1, 2, 3], numpy.array([[2, 2, 2], [0, 0, 0], [4, 4, 4]]), ["A1", "A2", "A3"], ref_path, out_path, dist=1)
+    out_data = IOUtils.read_volume(out_path).data
+    assert out_data.dtype == numpy.float32
+    assert numpy.array_equal(out_data, out_nii.get_fdata())
+    # the neighborhoods are clipped at the borders of the volume, and the later positions overwrite the earlier ones
+    expected_data = numpy.zeros((5, 5, 5))
+    expected_data[1:4, 1:4, 1:4] = 1
+    expected_data[:2, :2, :2] = 2
+    expected_data[3:, 3:, 3:] = 3
+    assert numpy.array_equal(out_data, expected_data)
+
+
+def test_remove_zero_connectivity_sparse():
+    data = numpy.array([[[0, 0, 1], [2, 3, 0]], [[4, 0, 0], [0, 0, 4]]])
+    volume_path = get_temporary_files_path("tdi_lbl_sparse.nii.gz")
+    IOUtils.write_volume(volume_path, Volume(data, numpy.identity(4), None))
+
+    in_connectivity = numpy.array(
+        [[10, 1, 0, 3], [0, 10, 0, 2], [0, 0, 0, 0], [0, 0, 0, 10]])
+    connectivity_path = get_temporary_files_path("conn_sparse.npy")
+    numpy.save(connectivity_path, in_connectivity)
+
+    VolumeService().remove_zero_connectivity_nodes(volume_path, connectivity_path, binary_only=True, sparse=True)
+
+    conn = scipy.sparse.load_npz(get_temporary_files_path("conn_sparse.npz"))
+    assert numpy.array_equal(conn.toarray(), [[20, 1, 3], [1, 20, 2], [3, 2, 20]])
+    # node 3 is removed and node 4 becomes node 3, in all of its voxels
+    vol = IOUtils.read_volume(volume_path)
+    assert numpy.array_equal(vol.data, [[[0, 0, 1], [2, 0, 0]], [[3, 0, 0], [0, 0, 3]]])
+
+
+def test_transform_coords():
+    service = VolumeService()
+    flirt_mat_path = get_temporary_files_path("flirt.mat")
+    flirt_mat = numpy.identity(4)
+    flirt_mat[:3, 3] = [1, 2, 3]
+    numpy.savetxt(flirt_mat_path, flirt_mat)
+    coords = numpy.array([[0.0, 0.0, 0.0], [10.0, -5.0, 2.5]])
+    # FSL scaled voxels are flipped along x for neurological images, so that they are always radiological
+    expected_translation = [-1, 2, 3]
+    for x_direction in (1.0, -1.0):
+        img_path = get_temporary_files_path("transform_coords.nii.gz")
+        affine = numpy.diag([2 * x_direction, 2.0, 2.0, 1.0])
+        affine[:3, 3] = [-10, 20, 5]
+        IOUtils.write_volume(img_path, Volume(numpy.zeros((10, 10, 10)), affine, None))
+        transformed_coords, _ = service.transform_coords(coords, img_path, img_path, flirt_mat_path)
+        assert numpy.allclose(transformed_coords, coords + expected_translation)
+        assert numpy.allclose(service.transform_coords(coords[1], img_path, img_path, flirt_mat_path)[0],
+                              coords[1] + expected_translation)
+
+    coords_path = get_temporary_files_path("coords.txt")
+    numpy.savetxt(coords_path, coords)
+    out_path = get_temporary_files_path("coords_out.txt")
+    transformed_coords, _ = service.transform_coords(coords_path, img_path, img_path, flirt_mat_path, out_path)
+    assert numpy.allclose(numpy.loadtxt(out_path, skiprows=1), transformed_coords)
+
+    # relative image and output paths are resolved against the directory of the transform
+    transformed_coords, relative_out_path = service.transform_coords(
+        coords, os.path.basename(img_path), os.path.basename(img_path), flirt_mat_path,
+        os.path.join(".", "coords_out_relative.txt"))
+    assert numpy.allclose(transformed_coords, coords + expected_translation)
+    assert os.path.samefile(relative_out_path, get_temporary_files_path("coords_out_relative.txt"))
+    assert numpy.allclose(numpy.loadtxt(relative_out_path, skiprows=1), transformed_coords)
+
+
+def test_con_vox_in_ras():
+    data = numpy.zeros((5, 6, 7), dtype='float32')
+    data[0, 1, 2] = 3
+    data[4, 0, 6] = 1
+    data[2, 5, 0] = 2.5
+    data[3, 3, 3] = 0.5
+    affine = numpy.array([[-1.0, 0, 0, 2], [0, 0, 1, -3], [0, -1, 0, 3], [0, 0, 0, 1]])
+    volume_path = get_temporary_files_path("tdi_lbl_nodes.nii.gz")
+    IOUtils.write_volume(volume_path, Volume(data, affine, None))
+    service = VolumeService()
+    vox, voxxyz = service.con_vox_in_ras(volume_path)
+    assert numpy.array_equal(vox, [3, 2, 1])
+
+    cache_dir = get_temporary_files_path()
+    for _ in range(2):
+        compact_vox, compact_voxxyz = service.con_vox_in_ras(volume_path, compact=True, cache_dir=cache_dir,
+                                                             slab_size=2)
+        assert compact_voxxyz.dtype == numpy.float32
+        assert numpy.array_equal(compact_vox, vox)
+        assert numpy.allclose(compact_voxxyz, voxxyz)
+    cache_path = service._get_con_vox_cache_path(volume_path, True, cache_dir)
+    assert os.path.basename(cache_path) == "tdi_lbl_nodes.nii.gz.con_vox.compact.npz"
+    assert os.path.isfile(cache_path)
+
+    # a rewritten volume replaces the stale cache
+    data[0, 0, 0] = 4
+    IOUtils.write_volume(volume_path, Volume(data, affine, None))
+    os.utime(volume_path, ns=(0, 0))
+    compact_vox, _ = service.con_vox_in_ras(volume_path, compact=True, cache_dir=cache_dir)
+    assert numpy.array_equal(compact_vox, [4, 3, 2, 1])
+
+    # uncompressed volumes are read slab by slab
+    uncompressed_path = get_temporary_files_path("tdi_lbl_nodes.nii")
+    IOUtils.write_volume(uncompressed_path, Volume(data, affine, None))
+    compact_vox, compact_voxxyz = service.con_vox_in_ras(uncompressed_path, compact=True, slab_size=2)
+    assert numpy.array_equal(compact_vox, [4, 3, 2, 1])
+    assert numpy.allclose(compact_voxxyz, service.con_vox_in_ras(uncompressed_path)[1])
@@ -3,7 +3,9 @@
 import os
 import importlib
 from collections import OrderedDict
+import numpy
 from tvb.recon.io.factory import IOUtils
+from tvb.recon.model.annotation import Annotation, FACE_COLORS_MAJORITY, FACE_COLORS_FIRST
 from tvb.recon.tests.base import BaseTest, get_data_file
 
 
@@ -163,3 +165,19 @@ class ServiceTests(BaseTest):
         self.assertEqual(expect, len(labels2))
         labels = service.read_input_labels()
         self.assertEqual(0, len(labels))
+
+    def test_compute_face_colors(self,):
+        color_table = [[255, 0, 0, 255, 0], [0, 255, 0, 255, 0], [0, 0, 255, 255, 0]]
+        annotation = Annotation([0, 1, 1, 2], color_table, ['r', 'g', 'b'])
+        triangles = numpy.array([[0, 1, 2], [0, 1, 3], [1, 2, 3]])
+        colors = numpy.array(color_table)[:, :4] / 255.0
+
+        face_colors = annotation.compute_face_colors(triangles)
+        self.assertEqual(face_colors.shape, (3, 4))
+        numpy.testing.assert_allclose(face_colors[1], (colors[0] + colors[1] + colors[2]) * 0.33)
+
+        majority = annotation.compute_face_colors(triangles, FACE_COLORS_MAJORITY)
+        numpy.testing.assert_array_equal(majority, colors[[1, 0, 1]])
+        first = annotation.compute_face_colors(triangles, FACE_COLORS_FIRST)
+        numpy.testing.assert_array_equal(first, colors[[0, 0, 1]])
+        self.assertRaises(ValueError, annotation.compute_face_colors, triangles, "median")